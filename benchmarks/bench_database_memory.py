@@ -0,0 +1,135 @@
+"""Measure the memory used by cached installed distributions.
+
+A temporary site-packages directory is filled with fake distributions, then
+the deep size of the objects built by distutils2.database is compared with
+the size of the layout used before distributions became compact (plain
+instances holding a full Metadata object each).
+
+Usage: python benchmarks/bench_database_memory.py [-n NUMBER]
+"""
+
+import os
+import sys
+import time
+import tempfile
+from optparse import OptionParser
+
+from distutils2 import database
+from distutils2.metadata import Metadata
+from distutils2._backport import shutil
+
+METADATA = u"""\
+Metadata-Version: 1.2
+Name: %(name)s
+Version: %(version)s
+Summary: Fake distribution number %(number)d
+Author: Someone
+Author-email: someone@example.org
+License: PSF
+Requires-Dist: common-dep (>=1.0)
+Requires-Dist: %(name)s-dep
+Classifier: Programming Language :: Python
+Description: %(description)s
+"""
+
+DESCRIPTION = u'\n       |'.join([u'A line of the long description.'] * 60)
+
+
+class LegacyDistribution(object):
+    """The layout of distutils2.database.Distribution before it was made
+    compact: an instance dict and a full Metadata object."""
+
+    def __init__(self, path):
+        self.path = path
+        self.metadata = Metadata(path=os.path.join(path, 'METADATA'))
+        self.name = self.metadata['Name']
+        self.version = self.metadata['Version']
+        self.requested = os.path.exists(os.path.join(path, 'REQUESTED'))
+
+
+def make_site_packages(number):
+    site_packages = tempfile.mkdtemp()
+    for i in range(number):
+        name = u'project%d' % i
+        version = u'1.%d' % (i % 10)
+        distinfo = os.path.join(site_packages,
+                                database.distinfo_dirname(name, version))
+        os.mkdir(distinfo)
+        fp = open(os.path.join(distinfo, 'METADATA'), 'w')
+        try:
+            fp.write((METADATA % {'name': name, 'version': version,
+                                  'number': i, 'description': DESCRIPTION}
+                      ).encode('utf-8'))
+        finally:
+            fp.close()
+    return site_packages
+
+
+def deep_size(obj, seen):
+    """Return the size of *obj* and of the objects it references that are
+    not in *seen*; classes, functions and modules are not counted."""
+    if id(obj) in seen or isinstance(obj, (type, type(deep_size),
+                                           type(sys))):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_size(item, seen)
+    if hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    for cls in type(obj).__mro__:
+        for slot in cls.__dict__.get('__slots__', ()):
+            if hasattr(obj, slot):
+                size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def measure(label, build, load_metadata):
+    start = time.time()
+    dists = build()
+    if load_metadata:
+        for dist in dists:
+            dist.metadata['Requires-Dist']
+    elapsed = time.time() - start
+    size = deep_size(dists, set())
+    print '%-35s %10.1f KiB %8.2f s' % (label, size / 1024.0, elapsed)
+    return size
+
+
+def main():
+    parser = OptionParser(usage='%prog [-n NUMBER]')
+    parser.add_option('-n', '--number', type='int', default=2000,
+                      help='number of fake distributions (default: 2000)')
+    options, args = parser.parse_args()
+
+    site_packages = make_site_packages(options.number)
+    try:
+        paths = [site_packages]
+        names = sorted(os.listdir(site_packages))
+
+        def legacy():
+            return [LegacyDistribution(os.path.join(site_packages, name))
+                    for name in names]
+
+        def compact():
+            database.clear_cache()
+            return list(database.get_distributions(paths=paths))
+
+        print '%d distributions' % options.number
+        print '%-35s %14s %10s' % ('layout', 'memory', 'time')
+        legacy_size = measure('legacy, metadata loaded', legacy, False)
+        measure('compact, name and version only', compact, False)
+        compact_size = measure('compact, metadata loaded', compact, True)
+        print 'compact layout uses %.0f%% of the legacy layout' % (
+            100.0 * compact_size / legacy_size)
+    finally:
+        database.clear_cache()
+        shutil.rmtree(site_packages)
+
+
+if __name__ == '__main__':
+    main()
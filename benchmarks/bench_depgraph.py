@@ -0,0 +1,192 @@
+"""Measure the time taken by distutils2.depgraph on a large environment.
+
+A synthetic environment of fake distributions is built with a fixed seed:
+each distribution requires a few of the previous ones with version
+predicates, some requirements are not provided by any distribution and
+some distributions provide other names.  A few "hub" distributions are
+required by a large part of the environment, like setuptools on a real
+system.
+
+The graph is then sorted with topological_levels, and the dependents of
+50 distributions are looked up at once with the transitive closure of the
+graph, computed for the query (cold) or already known (warm).  For
+comparison, the search dependent_dists used to run for each distribution
+is timed once for one of them: it is quadratic in the number of
+dependents.  The graph is also updated with
+DependencyGraph.insert_distribution and remove_distribution, saved with
+save_graph and read again with load_graph.  Last, the whole graph and the
+dependencies of the last distribution up to 3 levels deep are written in
+the DOT and JSON lines formats and as text.
+
+The fake distributions hold their metadata in memory: with installed
+distributions, generate_graph also has to read the metadata files, which
+load_graph does not need.
+
+Usage: python benchmarks/bench_depgraph.py [-n NUMBER] [-r REPEAT]
+"""
+
+import os
+import time
+import random
+import tempfile
+from optparse import OptionParser
+
+from distutils2 import depgraph
+
+NUM_HUBS = 5
+
+
+class FakeDistribution(object):
+    """The attributes of an installed distribution used by depgraph.
+
+    Like :class:`distutils2.database.Distribution`, distributions are equal
+    when they have the same path.
+    """
+
+    def __init__(self, name, version, requires, provides):
+        self.name = name
+        self.version = version
+        self.path = '/fake/%s-%s.dist-info' % (name, version)
+        self.metadata = {'Provides-Dist': provides, 'Provides': [],
+                         'Requires-Dist': requires, 'Requires': []}
+
+    def __eq__(self, other):
+        return (isinstance(other, FakeDistribution) and
+                self.path == other.path)
+
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return '<FakeDistribution %s %s>' % (self.name, self.version)
+
+
+def make_environment(number):
+    rand = random.Random(0)
+    dists = []
+    for i in xrange(number):
+        version = '%d.%d' % (rand.randint(0, 5), rand.randint(0, 20))
+        requires = []
+        if i >= NUM_HUBS and rand.random() < 0.3:
+            requires.append('project%d' % rand.randint(0, NUM_HUBS - 1))
+        for j in range(rand.randint(0, 6)):
+            if i == 0 or rand.random() < 0.05:
+                requires.append('missing%d' % rand.randint(0, number))
+                continue
+            other = dists[rand.randint(max(0, i - 200), i - 1)]
+            major = int(other.version.split('.')[0])
+            requires.append('%s (>=%d.0, <%d.0)' % (other.name, major,
+                                                     major + 1))
+        provides = []
+        if rand.random() < 0.05:
+            provides.append('virtual%d (1.0)' % rand.randint(0, 100))
+        if rand.random() < 0.05:
+            requires.append('virtual%d' % rand.randint(0, 100))
+        dists.append(FakeDistribution('project%d' % i, version, requires,
+                                      provides))
+    return dists
+
+
+def search_dependents(graph, dist):
+    """The breadth-first search of dependent_dists before it used the
+    transitive closure of the graph."""
+    dep = [dist]
+    fringe = list(graph.reverse_list[dist])
+    while fringe:
+        node = fringe.pop()
+        dep.append(node)
+        for prev in graph.reverse_list[node]:
+            if prev not in dep:
+                fringe.append(prev)
+    return dep[1:]
+
+
+def measure(label, func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print '%-30s %8.3f s' % (label, best)
+    return best
+
+
+def main():
+    parser = OptionParser(usage='%prog [-n NUMBER] [-r REPEAT]')
+    parser.add_option('-n', '--number', type='int', default=10000,
+                      help='number of fake distributions (default: 10000)')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='number of runs, the best one is kept '
+                           '(default: 3)')
+    options, args = parser.parse_args()
+
+    dists = make_environment(options.number)
+    graph = depgraph.generate_graph(dists)
+    edges = sum([len(adjs) for adjs in graph.adjacency_list.itervalues()])
+    missing = sum([len(reqs) for reqs in graph.missing.itervalues()])
+    print '%d distributions, %d edges, %d missing requirements' % (
+        len(dists), edges, missing)
+
+    measure('generate_graph', lambda: depgraph.generate_graph(dists),
+            options.repeat)
+
+    measure('topological_levels',
+            lambda: depgraph.topological_levels(graph, dists),
+            options.repeat)
+
+    removed = random.Random(0).sample(dists, 50)
+
+    def closure_cold():
+        graph._closure = {}
+        graph.get_dependents(removed)
+
+    measure('1 dependents search',
+            lambda: search_dependents(graph, removed[0]), 1)
+    measure('50 dependents, closure (cold)', closure_cold, options.repeat)
+    measure('50 dependents, closure (warm)',
+            lambda: graph.get_dependents(removed), options.repeat)
+
+    new = FakeDistribution('new-project', '1.0',
+                           ['project1 (>=0.0)', 'project2', 'missing'],
+                           ['virtual0 (1.0)'])
+
+    def insert_remove():
+        for i in xrange(1000):
+            graph.insert_distribution(new)
+            graph.remove_distribution(new)
+
+    measure('1000 inserts and removals', insert_remove, options.repeat)
+
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        measure('save_graph', lambda: depgraph.save_graph(graph, path),
+                options.repeat)
+        measure('load_graph', lambda: depgraph.load_graph(path, dists),
+                options.repeat)
+    finally:
+        os.remove(path)
+
+    last = [dists[-1]]
+    null = open(os.devnull, 'w')
+    try:
+        measure('graph_to_dot', lambda: depgraph.graph_to_dot(graph, null),
+                options.repeat)
+        measure('graph_to_jsonl',
+                lambda: depgraph.graph_to_jsonl(graph, null), options.repeat)
+        measure('repr', lambda: repr(graph), options.repeat)
+        measure('graph_to_dot, depth 3',
+                lambda: depgraph.graph_to_dot(graph, null, roots=last,
+                                              depth=3), options.repeat)
+        measure('graph_to_jsonl, depth 3',
+                lambda: depgraph.graph_to_jsonl(graph, null, roots=last,
+                                                depth=3), options.repeat)
+        measure('repr_node, depth 3',
+                lambda: graph.repr_node(last[0], depth=3), options.repeat)
+    finally:
+        null.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Measure the throughput of suggest_normalized_version.
+
+The version strings of version_corpus.txt, a collection of spellings found
+on PyPI, are sampled (with a fixed seed, so that runs are comparable) into
+a list with many duplicates, as in a real index.  Suggestions are then
+computed one string at a time with the caches of distutils2.version
+disabled, then with the caches enabled, and in one batch with
+suggest_normalized_versions.
+
+Usage: python benchmarks/bench_suggest_version.py [-n NUMBER] [-r REPEAT]
+"""
+
+import os
+import time
+import random
+from optparse import OptionParser
+
+from distutils2 import version
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'version_corpus.txt')
+
+
+def load_corpus(number):
+    fp = open(CORPUS)
+    try:
+        corpus = [line.strip() for line in fp if line.strip()]
+    finally:
+        fp.close()
+    rand = random.Random(0)
+    return corpus, [rand.choice(corpus) for i in xrange(number)]
+
+
+def clear_caches():
+    version._parsed.clear()
+    version._suggestions.clear()
+
+
+def measure(label, func, versions, repeat):
+    best = None
+    for i in range(repeat):
+        clear_caches()
+        start = time.time()
+        func(versions)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print '%-25s %8.3f s %12.0f versions/s' % (label, best,
+                                               len(versions) / best)
+    return best
+
+
+def one_at_a_time(versions):
+    return [version.suggest_normalized_version(v) for v in versions]
+
+
+def main():
+    parser = OptionParser(usage='%prog [-n NUMBER] [-r REPEAT]')
+    parser.add_option('-n', '--number', type='int', default=100000,
+                      help='number of version strings (default: 100000)')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='number of runs, the best one is kept '
+                           '(default: 3)')
+    options, args = parser.parse_args()
+
+    corpus, versions = load_corpus(options.number)
+    suggestions = version.suggest_normalized_versions(corpus)
+    rational = len([1 for v, s in zip(corpus, suggestions) if v == s])
+    missing = suggestions.count(None)
+    print '%d distinct versions: %d rational, %d suggested, %d unknown' % (
+        len(corpus), rational, len(corpus) - rational - missing, missing)
+    print '%d versions sampled' % len(versions)
+
+    max_parsed = version._MAX_PARSED
+    try:
+        version._MAX_PARSED = 0
+        uncached = measure('one at a time, no cache', one_at_a_time,
+                           versions, options.repeat)
+        version._MAX_PARSED = max_parsed
+        measure('one at a time, cached', one_at_a_time, versions,
+                options.repeat)
+        batch = measure('batch', version.suggest_normalized_versions,
+                        versions, options.repeat)
+        print 'speedup: %.1fx' % (uncached / batch)
+    finally:
+        version._MAX_PARSED = max_parsed
+        clear_caches()
+
+
+if __name__ == '__main__':
+    main()
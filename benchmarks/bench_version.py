@@ -0,0 +1,220 @@
+"""Benchmarks of distutils2.version.
+
+Each benchmark runs a fixed workload built from version_corpus.txt (with a
+fixed seed, no network access is needed) several times and reports the
+best time.  "cold" benchmarks clear the caches of distutils2.version before
+each run, "warm" ones run with the caches filled by a previous run.
+
+Results can be saved to a file and compared with the results of another
+commit:
+
+    python benchmarks/bench_version.py -o before.txt
+    (change the code)
+    python benchmarks/bench_version.py -c before.txt
+
+Usage: python benchmarks/bench_version.py [-r REPEAT] [-o FILE] [-c FILE]
+                                          [BENCHMARK ...]
+"""
+
+import os
+import sys
+import time
+import random
+from optparse import OptionParser
+
+from distutils2 import version
+from distutils2.version import (NormalizedVersion, VersionPredicate,
+                                suggest_normalized_version, sort_versions)
+from distutils2.pypi.dist import ReleaseInfo, ReleasesList
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'version_corpus.txt')
+
+# size of the workloads; the distinct versions fit in the caches (see
+# distutils2.version._MAX_PARSED), or "warm" benchmarks would be cold
+NUM_VERSIONS = 4000  # versions parsed, compared or suggested
+NUM_PREDICATES = 5000  # predicates parsed
+NUM_MATCHES = 200  # versions matched against each of 200 predicates
+NUM_RELEASES = 500  # releases of the project sorted by sort_releases
+NUM_PROJECTS = 20  # projects sorted by sort_releases
+
+OPERATORS = ('<', '>', '<=', '>=', '==', '!=')
+
+
+def clear_caches():
+    version._parsed.clear()
+    version._predicates.clear()
+    version._suggestions.clear()
+
+
+class Workload(object):
+    """The data used by the benchmarks."""
+
+    def __init__(self):
+        rand = random.Random(0)
+        fp = open(CORPUS)
+        try:
+            corpus = [line.strip() for line in fp if line.strip()]
+        finally:
+            fp.close()
+        rational = [v for v in corpus
+                    if suggest_normalized_version(v) == v and
+                    int(v.split('.')[0]) <= 1980]
+        self.strings = [rand.choice(corpus) for i in xrange(NUM_VERSIONS)]
+        # distinct versions, like the versions of a large set of projects
+        self.rational = ['%d.%d.%s' % (i % 100, i // 100,
+                                       rand.choice(rational))
+                         for i in xrange(NUM_VERSIONS)]
+        self.versions = [NormalizedVersion(v) for v in self.rational]
+
+        self.predicates = []
+        for i in xrange(NUM_PREDICATES):
+            clauses = ['%s%s' % (rand.choice(OPERATORS), rand.choice(rational))
+                       for j in range(rand.randint(1, 3))]
+            self.predicates.append('project%d (%s)' % (rand.randint(0, 99),
+                                                       ', '.join(clauses)))
+        self.matched = [rand.choice(rational) for i in xrange(NUM_MATCHES)]
+
+        # (project, releases in random order)
+        self.projects = []
+        for i in xrange(NUM_PROJECTS):
+            releases = [ReleaseInfo('project', v) for v in
+                        rand.sample(self.rational, NUM_RELEASES)]
+            project = ReleasesList('project')
+            project.releases = list(releases)
+            self.projects.append((project, releases))
+        clear_caches()
+
+
+def bench_parse(data):
+    for s in data.rational:
+        NormalizedVersion(s)
+
+
+def bench_compare(data):
+    sorted(data.versions)
+    first = data.versions[0]
+    for other in data.versions:
+        first == other
+
+
+def bench_sort_versions(data):
+    sort_versions(data.rational)
+
+
+def bench_suggest(data):
+    for s in data.strings:
+        suggest_normalized_version(s)
+
+
+def bench_predicate(data):
+    for predicate in data.predicates:
+        VersionPredicate(predicate)
+
+
+def bench_match(data):
+    for predicate in data.predicates[:NUM_MATCHES]:
+        predicate = VersionPredicate(predicate)
+        for s in data.matched:
+            predicate.match(s)
+
+
+def bench_sort_releases(data):
+    for project, releases in data.projects:
+        project.releases[:] = releases
+        project.sort_releases(prefer_final=True)
+        project.releases[:] = releases
+        project.sort_releases(prefer_final=False)
+
+
+# name, function, whether the caches are cleared before each run
+BENCHMARKS = [
+    ('parse-cold', bench_parse, True),
+    ('parse-warm', bench_parse, False),
+    ('compare', bench_compare, False),
+    ('sort-versions-cold', bench_sort_versions, True),
+    ('sort-versions-warm', bench_sort_versions, False),
+    ('suggest-cold', bench_suggest, True),
+    ('suggest-warm', bench_suggest, False),
+    ('predicate-cold', bench_predicate, True),
+    ('predicate-warm', bench_predicate, False),
+    ('match-cold', bench_match, True),
+    ('match-warm', bench_match, False),
+    ('sort-releases', bench_sort_releases, False),
+]
+
+
+def run(func, data, cold, repeat):
+    best = None
+    if not cold:
+        func(data)
+    for i in range(repeat):
+        if cold:
+            clear_caches()
+        start = time.time()
+        func(data)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def load_results(filename):
+    results = {}
+    fp = open(filename)
+    try:
+        for line in fp:
+            name, value = line.split()
+            results[name] = float(value)
+    finally:
+        fp.close()
+    return results
+
+
+def main():
+    parser = OptionParser(usage='%prog [-r REPEAT] [-o FILE] [-c FILE] '
+                                '[BENCHMARK ...]')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='number of runs, the best one is kept '
+                           '(default: 5)')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='save the results to FILE')
+    parser.add_option('-c', '--compare', metavar='FILE',
+                      help='compare with the results saved in FILE')
+    options, args = parser.parse_args()
+
+    names = [name for name, func, cold in BENCHMARKS]
+    for name in args:
+        if name not in names:
+            parser.error('unknown benchmark %r, choose from %s' %
+                         (name, ', '.join(names)))
+
+    previous = {}
+    if options.compare is not None:
+        previous = load_results(options.compare)
+
+    data = Workload()
+    results = []
+    for name, func, cold in BENCHMARKS:
+        if args and name not in args:
+            continue
+        best = run(func, data, cold, options.repeat)
+        results.append((name, best))
+        line = '%-20s %10.6f' % (name, best)
+        if name in previous:
+            line += '  %6.2fx' % (previous[name] / best)
+        print line
+        sys.stdout.flush()
+    clear_caches()
+
+    if options.output is not None:
+        fp = open(options.output, 'w')
+        try:
+            for name, best in results:
+                fp.write('%s %.6f\n' % (name, best))
+        finally:
+            fp.close()
+
+
+if __name__ == '__main__':
+    main()
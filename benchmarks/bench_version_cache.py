@@ -0,0 +1,82 @@
+"""Measure the effect of caching parsed versions on dependency resolution.
+
+A dependency graph is generated for a set of fake distributions, each of
+them requiring a few others with version predicates, first with the caches
+of parsed versions and predicates of distutils2.version disabled and then
+with them enabled.
+
+Usage: python benchmarks/bench_version_cache.py [-n NUMBER] [-r REPEAT]
+"""
+
+import time
+import random
+from optparse import OptionParser
+
+from distutils2 import version
+from distutils2.depgraph import generate_graph
+
+
+class FakeDistribution(object):
+    """The attributes of an installed distribution used by generate_graph."""
+
+    def __init__(self, name, version, requires):
+        self.name = name
+        self.version = version
+        self.metadata = {'Provides-Dist': [], 'Provides': [],
+                         'Requires-Dist': requires, 'Requires': []}
+
+
+def make_distributions(number):
+    rand = random.Random(42)
+    versions = ['%d.%d.%d' % (i % 3, i % 7, i % 5) for i in range(number)]
+    dists = []
+    for i in range(number):
+        requires = []
+        for j in rand.sample(xrange(number), min(5, number)):
+            requires.append('project%d (>=%s, <%d.0)' % (
+                j, versions[j], int(versions[j].split('.')[0]) + 1))
+        dists.append(FakeDistribution('project%d' % i, versions[i],
+                                      requires))
+    return dists
+
+
+def measure(label, dists, repeat):
+    best = None
+    for i in range(repeat):
+        version._parsed.clear()
+        version._predicates.clear()
+        start = time.time()
+        generate_graph(dists)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print '%-25s %8.3f s' % (label, best)
+    return best
+
+
+def main():
+    parser = OptionParser(usage='%prog [-n NUMBER] [-r REPEAT]')
+    parser.add_option('-n', '--number', type='int', default=2000,
+                      help='number of fake distributions (default: 2000)')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='number of runs, the best one is kept '
+                           '(default: 3)')
+    options, args = parser.parse_args()
+
+    dists = make_distributions(options.number)
+    max_parsed = version._MAX_PARSED
+    try:
+        print '%d distributions' % options.number
+        version._MAX_PARSED = 0
+        uncached = measure('without cache', dists, options.repeat)
+        version._MAX_PARSED = max_parsed
+        cached = measure('with cache', dists, options.repeat)
+        print 'speedup: %.1fx' % (uncached / cached)
+    finally:
+        version._MAX_PARSED = max_parsed
+        version._parsed.clear()
+        version._predicates.clear()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,24 +3,49 @@
 import os
 import csv
 import sys
-import zipimport
+import stat
+import codecs
+import marshal
+import tempfile
+import zipfile
 from StringIO import StringIO
+from weakref import WeakValueDictionary
 try:
     from hashlib import md5
 except ImportError:
     from distutils2._backport.hashlib import md5
+try:
+    from threading import RLock, Thread, Event
+except ImportError:
+    from dummy_threading import RLock
+    Thread = Event = None
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
 
+from distutils2 import logger
 from distutils2.errors import PackagingError
-from distutils2.version import suggest_normalized_version, VersionPredicate
+from distutils2.version import (suggest_normalized_version, VersionPredicate,
+                                NormalizedVersion, IrrationalVersionError)
 from distutils2.metadata import Metadata
-from distutils2.util import parse_requires
+from distutils2.util import parse_requires, _parse_requires, _parallel_map
+from distutils2._backport.misc import fsencode
 
 
 __all__ = [
     'Distribution', 'EggInfoDistribution', 'distinfo_dirname',
-    'get_distributions', 'get_distribution', 'get_file_users',
+    'InstalledDatabase', 'get_databases',
+    'get_distributions', 'get_distribution', 'find_distributions',
+    'normalize_name', 'get_file_users',
     'provides_distribution', 'obsoletes_distribution',
     'enable_cache', 'disable_cache', 'clear_cache',
+    'enable_index', 'disable_index', 'get_index_dir',
+    'enable_parallel_scan', 'disable_parallel_scan',
+    'verify_distributions', 'VERIFY_OK', 'VERIFY_MISSING', 'VERIFY_SIZE',
+    'VERIFY_HASH', 'VERIFY_UNCHECKED',
+    'take_snapshot', 'diff_snapshots', 'save_snapshot', 'load_snapshot',
+    'start_watcher', 'stop_watcher',
     'get_file_path', 'get_file']
 
 
@@ -33,9 +58,43 @@ _cache_name = {}  # maps names to Distribution instances
 _cache_name_egg = {}  # maps names to EggInfoDistribution instances
 _cache_path = {}  # maps paths to Distribution instances
 _cache_path_egg = {}  # maps paths to EggInfoDistribution instances
-_cache_generated = False  # indicates if .dist-info distributions are cached
-_cache_generated_egg = False  # indicates if .dist-info and .egg are cached
+_cache_entries = {}  # maps real paths of sys.path entries to _PathEntry
 _cache_enabled = True
+_strings = {}  # shared copies of names, versions and fields, see _intern
+_zip_indexes = {}  # maps paths of zipped eggs to (key, data), see _read_zip
+_cache_lock = RLock()  # protects the cache against the watcher thread
+_watcher = None  # running _Watcher instance, see start_watcher
+# maps inode and content keys of METADATA files to the parsed metadata,
+# shared by identical distributions, see _load_shared_metadata
+_shared_metadata = WeakValueDictionary()
+_shared_metadata_lock = RLock()
+
+# kinds of relations between distributions, see _index_relations
+_PROVIDES = 0
+_OBSOLETES = 1
+
+# On-disk index
+_index_dir = None  # directory holding the index files, None if disabled
+_INDEX_FORMAT = 2  # bump when the layout of the index files changes
+# metadata fields stored in the index next to the name and the version
+_INDEXED_FIELDS = ('Provides-Dist', 'Provides', 'Obsoletes-Dist',
+                   'Obsoletes', 'Requires-Dist', 'Requires')
+
+# Parallel scanning
+_scan_workers = 0  # number of scanning threads, 0 if disabled
+
+# Verification of installed files, see verify_distributions
+VERIFY_OK = 'ok'
+VERIFY_MISSING = 'missing'
+VERIFY_SIZE = 'bad-size'
+VERIFY_HASH = 'bad-hash'
+VERIFY_UNCHECKED = 'unchecked'  # no size nor hash recorded
+_HASH_CHUNK_SIZE = 64 * 1024
+_file_hashes = {}  # maps paths to (mtime, size, md5) of hashed files
+_MAX_HASHES = 10000  # _file_hashes is cleared when it holds that many
+
+# Snapshots, see take_snapshot
+_SNAPSHOT_FORMAT = 1  # bump when the layout of the snapshots changes
 
 
 def enable_cache():
@@ -62,16 +121,380 @@ def disable_cache():
     _cache_enabled = False
 
 
-def clear_cache():
-    """ Clears the internal cache. """
-    global _cache_generated, _cache_generated_egg
+def clear_cache(paths=None):
+    """
+    Clears the internal cache.
+
+    If *paths* is given, only the distributions found in these ``sys.path``
+    entries are forgotten.
+    """
+    _cache_lock.acquire()
+    try:
+        if paths is None:
+            _cache_name.clear()
+            _cache_name_egg.clear()
+            _cache_path.clear()
+            _cache_path_egg.clear()
+            _cache_entries.clear()
+            _strings.clear()
+            _file_hashes.clear()
+            _zip_indexes.clear()
+        else:
+            for path in paths:
+                entry = _cache_entries.pop(os.path.realpath(path), None)
+                if entry is not None:
+                    entry.clear()
+    finally:
+        _cache_lock.release()
+
+
+def enable_index(index_dir):
+    """
+    Enables the on-disk index, stored in the *index_dir* directory.
+
+    For each ``sys.path`` entry scanned, an index file recording the name
+    and version of every distribution found there is written in
+    *index_dir*.  Subsequent scans of the same entry (in this or in another
+    process) read the index file instead of listing the directory, as long
+    as the modification time of the entry is unchanged.  The provides,
+    obsoletes and requires fields are added to the index the first time a
+    dependency query needs them; other metadata fields are read from the
+    distribution on first access.
+
+    The directory is created if needed.
+    """
+    global _index_dir
+
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    _index_dir = os.path.abspath(index_dir)
+
+
+def disable_index():
+    """
+    Disables the on-disk index.
+
+    Existing index files are left untouched; they will be used again if
+    :func:`enable_index` is called with the same directory.
+    """
+    global _index_dir
+
+    _index_dir = None
+
+
+def get_index_dir():
+    """
+    Returns the directory of the on-disk index, or None if it is disabled.
+    """
+    return _index_dir
+
+
+def enable_parallel_scan(workers=8):
+    """
+    Enables parallel scanning of ``sys.path`` entries.
+
+    The directories of the entries are listed and the metadata files of the
+    distributions found there are read by a pool of *workers* threads, so
+    that the I/O of several entries and files overlaps.  The results are
+    unchanged: distributions are still reported in ``sys.path`` order.
+    """
+    global _scan_workers
+
+    if workers < 1:
+        raise ValueError('workers must be a positive integer, not %r' %
+                         workers)
+    _scan_workers = workers
+
+
+def disable_parallel_scan():
+    """
+    Disables parallel scanning of ``sys.path`` entries (the default).
+    """
+    global _scan_workers
+
+    _scan_workers = 0
+
+
+def start_watcher(interval=1.0, use_inotify=True):
+    """
+    Starts a background thread keeping the cache up to date.
+
+    The ``sys.path`` entries already cached are checked every *interval*
+    seconds and scanned again when distributions are added or removed;
+    with *use_inotify* and the :mod:`pyinotify` module available, they are
+    scanned again as soon as the kernel reports a change instead.  Queries
+    then trust the cached entries and do not check them anymore, so they
+    cost no system call at all.  Entries cached for the first time are
+    checked as usual.
+
+    The watcher has no effect while the cache is disabled.  If it is
+    already running, it is restarted with the new settings.
+    """
+    global _watcher
+
+    if Thread is None:
+        raise PackagingError('the watcher needs thread support')
+    stop_watcher()
+    watcher = _Watcher(interval, use_inotify and pyinotify is not None)
+    watcher.start()
+    _watcher = watcher
+
+
+def stop_watcher():
+    """
+    Stops the thread started by :func:`start_watcher`, if any.
+
+    Queries check the cached entries again afterwards.
+    """
+    global _watcher
+
+    watcher = _watcher
+    _watcher = None
+    if watcher is not None:
+        watcher.stop()
+
+
+def _intern(value):
+    """Return a shared copy of the string or tuple *value*.
+
+    Names, versions and requirements are repeated a lot among installed
+    distributions; sharing them saves memory when many are cached.
+    """
+    return _strings.setdefault(value, value)
+
+
+def _compact_fields(fields):
+    """Return the values of :data:`_INDEXED_FIELDS` as a shared tuple of
+    shared tuples."""
+    return _intern(tuple([_intern(tuple([_intern(value) for value in values]))
+                          for values in fields]))
+
+
+def _map(func, items):
+    """Call *func* on each item, using the scanning threads if enabled."""
+    return _parallel_map(func, items, _scan_workers)
+
+
+def _get_index_file(realpath):
+    name = md5(fsencode(realpath)).hexdigest() + '.index'
+    return os.path.join(_index_dir, name)
+
+
+def _read_index(realpath, mtime):
+    """Return the entries indexed for *realpath*, or None if the index file
+    is missing, unreadable or out of date."""
+    try:
+        fp = open(_get_index_file(realpath), 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            data = marshal.load(fp)
+        except (EOFError, ValueError, TypeError):
+            return None
+    finally:
+        fp.close()
+
+    if (not isinstance(data, tuple) or len(data) != 4 or
+        data[:3] != (_INDEX_FORMAT, realpath, mtime)):
+        return None
+    return data[3]
 
-    _cache_name.clear()
-    _cache_name_egg.clear()
-    _cache_path.clear()
-    _cache_path_egg.clear()
-    _cache_generated = False
-    _cache_generated_egg = False
+
+def _write_index(realpath, mtime, has_eggs, dists):
+    """Write the index file of the *dists* found in *realpath*.
+
+    *has_eggs* tells whether the ``.egg(-info)`` distributions were scanned.
+    Only the name and version of the distributions whose metadata was not
+    read yet are indexed; see :meth:`_PathEntry.get_relations` for the
+    other fields.
+    """
+    entries = []
+    for dist in dists:
+        entries.append((dist.path, isinstance(dist, Distribution),
+                        dist.name, dist.version, _get_indexed_fields(dist)))
+    _dump_index(realpath, mtime, (has_eggs, entries))
+
+
+def _get_indexed_fields(dist):
+    """Return the values of :data:`_INDEXED_FIELDS` of *dist*, or None if
+    its metadata was not read yet or cannot be parsed."""
+    if dist._fields is None and dist._metadata is None:
+        return None
+    try:
+        return [dist._get_field(field) for field in _INDEXED_FIELDS]
+    except (PackagingError, IOError, ValueError), e:
+        logger.debug('not indexing the fields of %r: %s', dist.path, e)
+        return None
+
+
+def _dump_index(realpath, mtime, entries):
+    """Write the index file of *realpath*, read back by :func:`_read_index`
+    as long as *mtime* (any marshallable value identifying the state of
+    *realpath*) is unchanged."""
+    _dump_file(_get_index_file(realpath), realpath,
+               (_INDEX_FORMAT, realpath, mtime, entries))
+
+
+def _dump_file(target, path, data):
+    """Marshal *data* to the *target* file of the index directory, which
+    holds information about *path*."""
+    # write to a temporary file first, so that concurrent readers never
+    # see a partially written index
+    fd, tmp = tempfile.mkstemp(dir=_index_dir)
+    try:
+        fp = os.fdopen(fd, 'wb')
+        try:
+            marshal.dump(data, fp)
+        finally:
+            fp.close()
+        if os.name == 'nt' and os.path.exists(target):
+            os.remove(target)
+        os.rename(tmp, target)
+    except (IOError, OSError, ValueError), e:
+        logger.debug('could not write the index of %r: %s', path, e)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _read_zip(path):
+    """Return the ``(members, pkg_info, requires)`` tuple of the zipped egg
+    *path*: the names of its members and the contents of its
+    ``EGG-INFO/PKG-INFO`` and ``EGG-INFO/requires.txt`` files (None if
+    missing).
+
+    The zip directory is only read again when the size or modification time
+    of the file changes; the data is also kept in the on-disk index if it
+    is enabled, so other processes do not read the archive at all.
+    """
+    st = os.stat(path)
+    key = (st.st_mtime, st.st_size)
+    cached = _zip_indexes.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    data = None
+    if _index_dir is not None:
+        data = _read_index(path, key)
+    if data is None:
+        zf = zipfile.ZipFile(path)
+        try:
+            members = tuple(zf.namelist())
+            pkg_info = zf.read('EGG-INFO/PKG-INFO').decode('utf8')
+            if 'EGG-INFO/requires.txt' in members:
+                requires = zf.read('EGG-INFO/requires.txt').decode('utf8')
+            else:
+                requires = None
+        finally:
+            zf.close()
+        data = (members, pkg_info, requires)
+        if _index_dir is not None:
+            _dump_index(path, key, data)
+    _zip_indexes[path] = (key, data)
+    return data
+
+
+def _get_mtime(realpath):
+    """Return the modification time of the *realpath* directory, or None if
+    it is not a directory."""
+    try:
+        st = os.stat(realpath)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode):
+        return None
+    return st.st_mtime
+
+
+def _list_path(realpath, include_dist, include_egg):
+    """Return the ``(class, path)`` pairs of the distributions found in the
+    *realpath* directory."""
+    found = []
+    for dir in os.listdir(realpath):
+        dist_path = os.path.join(realpath, dir)
+        if include_dist and dir.endswith('.dist-info'):
+            found.append((Distribution, dist_path))
+        elif include_egg and (dir.endswith('.egg-info') or
+                              dir.endswith('.egg')):
+            found.append((EggInfoDistribution, dist_path))
+    return found
+
+
+def _restore_index(entries, known):
+    dists = []
+    for path, is_dist, name, version, fields in entries:
+        if path in known:
+            dists.append(known[path])
+            continue
+        if is_dist:
+            cls = Distribution
+        else:
+            cls = EggInfoDistribution
+        if fields is not None:
+            fields = _compact_fields(fields)
+        dists.append(cls._from_index(path, name, version, fields))
+    return dists
+
+
+def _load_paths(requests, include_dist, include_egg):
+    """Return the lists of distributions found in several directories.
+
+    *requests* is a list of ``(realpath, mtime, known)`` tuples, where
+    *known* is a dict mapping paths to distributions created by a previous
+    scan of *realpath*; they are reused instead of being read again.  The
+    on-disk index is used if it is enabled.
+
+    The directories are listed and the new distributions created with
+    :func:`_map`, hence in parallel if it is enabled.
+    """
+    results = [None] * len(requests)
+    to_scan = []
+    if _index_dir is None:
+        to_scan = range(len(requests))
+        scan_dist, scan_egg = include_dist, include_egg
+    else:
+        # the on-disk index always records the .dist-info distributions,
+        # and the .egg(-info) ones if they were asked for
+        scan_dist, scan_egg = True, include_egg
+        indexes = _map(lambda request: _read_index(request[0], request[1]),
+                       requests)
+        for i, data in enumerate(indexes):
+            if data is None or (include_egg and not data[0]):
+                to_scan.append(i)
+            else:
+                results[i] = _restore_index(data[1], requests[i][2])
+
+    listings = _map(lambda i: _list_path(requests[i][0], scan_dist, scan_egg),
+                    to_scan)
+
+    new = []
+    for i, listing in zip(to_scan, listings):
+        known = requests[i][2]
+        new.extend([item for item in listing if item[1] not in known])
+    created = _map(lambda item: item[0](item[1]), new)
+    created = dict(zip([item[1] for item in new], created))
+
+    for i, listing in zip(to_scan, listings):
+        realpath, mtime, known = requests[i]
+        dists = []
+        for cls, path in listing:
+            if path in known:
+                dists.append(known[path])
+            else:
+                dists.append(created[path])
+        if _index_dir is not None:
+            _write_index(realpath, mtime, scan_egg, dists)
+        results[i] = dists
+
+    for i, dists in enumerate(results):
+        results[i] = []
+        for dist in dists:
+            if isinstance(dist, Distribution):
+                if include_dist:
+                    results[i].append(dist)
+            elif include_egg:
+                results[i].append(dist)
+    return results
 
 
 def _yield_distributions(include_dist, include_egg, paths):
@@ -81,60 +504,705 @@ def _yield_distributions(include_dist, include_egg, paths):
     :parameter include_dist: yield .dist-info distributions
     :parameter include_egg: yield .egg(-info) distributions
     """
+    requests = []
     for path in paths:
         realpath = os.path.realpath(path)
-        if not os.path.isdir(realpath):
+        mtime = _get_mtime(realpath)
+        if mtime is None:
             continue
-        for dir in os.listdir(realpath):
-            dist_path = os.path.join(realpath, dir)
-            if include_dist and dir.endswith('.dist-info'):
-                yield Distribution(dist_path)
-            elif include_egg and (dir.endswith('.egg-info') or
-                                  dir.endswith('.egg')):
-                yield EggInfoDistribution(dist_path)
+        if not _scan_workers:
+            # scan lazily, callers may stop at the first match
+            for dist in _load_paths([(realpath, mtime, {})], include_dist,
+                                    include_egg)[0]:
+                yield dist
+        else:
+            requests.append((realpath, mtime, {}))
 
+    for dists in _load_paths(requests, include_dist, include_egg):
+        for dist in dists:
+            yield dist
 
-def _generate_cache(use_egg_info, paths):
-    global _cache_generated, _cache_generated_egg
 
-    if _cache_generated_egg or (_cache_generated and not use_egg_info):
-        return
-    else:
-        gen_dist = not _cache_generated
-        gen_egg = use_egg_info
+class _PathEntry(object):
+    """The cached distributions of one ``sys.path`` entry.
 
-        for dist in _yield_distributions(gen_dist, gen_egg, paths):
-            if isinstance(dist, Distribution):
-                _cache_path[dist.path] = dist
-                if dist.name not in _cache_name:
-                    _cache_name[dist.name] = []
-                _cache_name[dist.name].append(dist)
+    The directory is scanned again only when its modification time changes,
+    that is when distributions are added or removed; the distributions whose
+    directory is still present are reused.
+    """
+
+    def __init__(self, realpath):
+        self.realpath = realpath
+        self.mtime = None
+        self.has_eggs = False  # indicates if .egg(-info) are cached
+        self.dists = []  # Distribution instances, in directory order
+        self.eggs = []  # EggInfoDistribution instances, in directory order
+        self.names = {}  # maps names to Distribution instances
+        self.egg_names = {}  # maps names to EggInfoDistribution instances
+        self.normalized = {}  # same as names, with normalized names
+        self.egg_normalized = {}  # same as egg_names, with normalized names
+        self.paths = {}  # maps paths to all distributions of this entry
+        self._files = None  # RECORD keys and files to users, built lazily
+        self._relations = None  # provides and obsoletes, built lazily
+        self.share_metadata = False  # see enable_metadata_sharing
+
+    def is_stale(self, mtime, use_egg_info):
+        """Tell whether the directory must be scanned again."""
+        return mtime != self.mtime or (use_egg_info and not self.has_eggs)
+
+    def update(self, mtime, has_eggs, dists):
+        """Replace the distributions of this entry with *dists*.
+
+        The new lookup tables are built aside and then swapped in, so that
+        a thread reading the entry while the watcher updates it sees either
+        the old or the new distributions.
+        """
+        fresh = _PathEntry(self.realpath)
+        fresh.mtime = mtime
+        fresh.has_eggs = has_eggs
+        fresh.share_metadata = self.share_metadata
+        for dist in dists:
+            fresh._add(dist)
+        self._unregister()
+        self.__dict__.update(fresh.__dict__)
+        self._register()
+
+    def enable_metadata_sharing(self):
+        """Let the distributions of this entry share their parsed metadata
+        with identical distributions (see :class:`InstalledDatabase`)."""
+        if not self.share_metadata:
+            self.share_metadata = True
+            for dist in self.dists:
+                dist._share_metadata = True
+
+    def _add(self, dist):
+        if isinstance(dist, Distribution):
+            dists, names = self.dists, self.names
+            normalized = self.normalized
+            if self.share_metadata:
+                dist._share_metadata = True
+        else:
+            dists, names = self.eggs, self.egg_names
+            normalized = self.egg_normalized
+
+        dists.append(dist)
+        self.paths[dist.path] = dist
+        if dist.name not in names:
+            names[dist.name] = []
+        names[dist.name].append(dist)
+        name = normalize_name(dist.name)
+        if name not in normalized:
+            normalized[name] = []
+        normalized[name].append(dist)
+
+    def _register(self):
+        """Add the distributions of this entry to the global caches."""
+        for dists, cache_path, cache_name in (
+            (self.dists, _cache_path, _cache_name),
+            (self.eggs, _cache_path_egg, _cache_name_egg)):
+            for dist in dists:
+                cache_path[dist.path] = dist
+                if dist.name not in cache_name:
+                    cache_name[dist.name] = []
+                cache_name[dist.name].append(dist)
+
+    def _unregister(self):
+        """Remove the distributions of this entry from the global caches."""
+        for dists, cache_path, cache_name in (
+            (self.dists, _cache_path, _cache_name),
+            (self.eggs, _cache_path_egg, _cache_name_egg)):
+            for dist in dists:
+                cache_path.pop(dist.path, None)
+                named = cache_name.get(dist.name)
+                if named is not None and dist in named:
+                    named.remove(dist)
+                    if not named:
+                        del cache_name[dist.name]
+
+    def clear(self):
+        """Forget the distributions of this entry."""
+        self._unregister()
+        self.dists = []
+        self.eggs = []
+        self.names = {}
+        self.egg_names = {}
+        self.normalized = {}
+        self.egg_normalized = {}
+        self.paths = {}
+        self._files = None
+        self._relations = None
+
+    def get_file_users(self, path):
+        """Return the list of distributions of this entry that use *path*,
+        which must have been normalized with :func:`_normalize_file_path`.
+
+        The index is built again when the entry is scanned again, and when
+        the ``RECORD`` file of one of its distributions or one of its zipped
+        eggs was read again because it changed (see
+        :meth:`Distribution._load_records` and :func:`_read_zip`); checking
+        that costs no system call.
+        """
+        if self._files is None or not _same_items(self._files[0],
+                                                  self._get_files_key()):
+            files = {}
+            for dist in self.dists:
+                for record_path, checksum, size in dist._get_records():
+                    file_key = _normalize_file_path(record_path)
+                    if file_key not in files:
+                        files[file_key] = [dist]
+                    elif dist not in files[file_key]:
+                        files[file_key].append(dist)
+            for dist in self.eggs:
+                for file_key in dist._get_members():
+                    if file_key not in files:
+                        files[file_key] = [dist]
+                    elif dist not in files[file_key]:
+                        files[file_key].append(dist)
+            self._files = self._get_files_key(), files
+        return self._files[1].get(path, [])
+
+    def _get_files_key(self):
+        """Return the parsed ``RECORD`` files and zipped egg directories
+        kept in memory for the distributions of this entry."""
+        key = [dist._records for dist in self.dists]
+        for dist in self.eggs:
+            key.append(_zip_indexes.get(dist.path))
+        return key
+
+    def get_relations(self, kind, name):
+        """Return the relations of the given *kind* (_PROVIDES or _OBSOLETES)
+        for *name* of the distributions of this entry."""
+        if self._relations is None:
+            dists = self.dists + self.eggs
+            self._relations = _index_relations(dists)
+            if (_index_dir is not None and self.mtime is not None and
+                [dist for dist in dists if dist._fields is None]):
+                # the fields are known now, so that other processes do not
+                # need to read the metadata files again
+                _write_index(self.realpath, self.mtime, self.has_eggs, dists)
+        return self._relations[kind].get(name, [])
+
+
+def _same_items(first, second):
+    """Tell whether the lists *first* and *second* hold the same objects."""
+    if len(first) != len(second):
+        return False
+    for item, other in zip(first, second):
+        if item is not other:
+            return False
+    return True
+
+
+class _Relation(object):
+    """A name provided or obsoleted by an installed distribution.
+
+    The version (for provides) or the predicate (for obsoletes) is parsed on
+    first use and kept for the next queries.
+    """
+
+    def __init__(self, dist, value, version):
+        self.dist = dist
+        self.value = value  # the whole field value
+        self.version = version  # None if the field does not give a version
+        self._parsed = None
+
+    def get_version(self):
+        """Return the provided version, as a NormalizedVersion if possible."""
+        if self._parsed is None:
+            version = self.version
+            if len(version) < 2 or version[0] != '(' or version[-1] != ')':
+                raise PackagingError(
+                    'distribution %r has invalid Provides field: %r' %
+                    (self.dist.name, self.value))
+            version = version[1:-1]  # trim off the parenthesis
+            try:
+                self._parsed = NormalizedVersion(version)
+            except IrrationalVersionError:
+                # let VersionPredicate.match report the error
+                return version
+        return self._parsed
+
+    def get_predicate(self):
+        """Return the obsoleted versions, as a VersionPredicate."""
+        if self._parsed is None:
+            try:
+                self._parsed = VersionPredicate(self.value)
+            except ValueError:
+                raise PackagingError(
+                    'distribution %r has ill-formed obsoletes field: %r' %
+                    (self.dist.name, self.value))
+        return self._parsed
+
+
+def _index_relations(dists):
+    """Return two dicts mapping names to the lists of :class:`_Relation`
+    provided and obsoleted by *dists*, in order.
+
+    The tuple is meant to be indexed with _PROVIDES and _OBSOLETES.
+    """
+    provides = {}
+    obsoletes = {}
+    for dist in dists:
+        provided = (dist._get_field('Provides-Dist') +
+                    dist._get_field('Provides'))
+        for value in provided:
+            components = value.rsplit(' ', 1)
+            if len(components) == 1:
+                version = None
+            else:
+                version = components[1]
+            if components[0] not in provides:
+                provides[components[0]] = []
+            provides[components[0]].append(_Relation(dist, value, version))
+
+        obsoleted = (dist._get_field('Obsoletes-Dist') +
+                     dist._get_field('Obsoletes'))
+        for value in obsoleted:
+            components = value.split(' ', 1)
+            if len(components) == 1:
+                version = None
             else:
-                _cache_path_egg[dist.path] = dist
-                if dist.name not in _cache_name_egg:
-                    _cache_name_egg[dist.name] = []
-                _cache_name_egg[dist.name].append(dist)
+                version = components[1]
+            if components[0] not in obsoletes:
+                obsoletes[components[0]] = []
+            obsoletes[components[0]].append(_Relation(dist, value, version))
+    return provides, obsoletes
 
-        if gen_dist:
-            _cache_generated = True
-        if gen_egg:
-            _cache_generated_egg = True
 
+def _get_relations(kind, name, use_egg_info, paths):
+    """Return the relations of the given *kind* (_PROVIDES or _OBSOLETES) for
+    *name*, .dist-info distributions first."""
+    if paths is None:
+        paths = sys.path
+
+    if not _cache_enabled:
+        dists = get_distributions(use_egg_info, paths)
+        return _index_relations(dists)[kind].get(name, [])
+    return _get_entry_relations(_get_entries(use_egg_info, paths), kind, name,
+                                use_egg_info)
+
+
+def _get_entry_relations(entries, kind, name, use_egg_info):
+    """Return the relations of the given *kind* for *name* found in the cache
+    *entries*, .dist-info distributions first."""
+    relations = []
+    for entry in entries:
+        for relation in entry.get_relations(kind, name):
+            if isinstance(relation.dist, Distribution):
+                relations.append(relation)
+    if use_egg_info:
+        for entry in entries:
+            for relation in entry.get_relations(kind, name):
+                if not isinstance(relation.dist, Distribution):
+                    relations.append(relation)
+    return relations
+
+
+def normalize_name(name):
+    """
+    Returns the form of *name* used to look up distributions regardless of
+    case and of the ``'-'``/``'_'`` spelling, see
+    :func:`find_distributions`.
+    """
+    return _intern(name.lower().replace('_', '-'))
+
+
+def _normalize_file_path(path):
+    """Turn a path found in ``RECORD`` or given to :func:`get_file_users`
+    into a normalized local absolute path."""
+    path = os.path.join(sys.prefix, path.replace('/', os.sep))
+    return os.path.normcase(os.path.normpath(path))
 
-class Distribution(object):
-    """Created with the *path* of the ``.dist-info`` directory provided to the
-    constructor. It reads the metadata contained in ``METADATA`` when it is
-    instantiated."""
 
-    name = ''
-    """The name of the distribution."""
+def _get_entries(use_egg_info, paths, trust_watcher=True):
+    """Return the up-to-date cache entries for *paths*, in order.
 
-    version = ''
-    """The version of the distribution."""
+    If the watcher is running and *trust_watcher* is true, the entries that
+    are already cached are not checked.
+    """
+    _cache_lock.acquire()
+    try:
+        return _update_entries(use_egg_info, paths,
+                               trust_watcher and _watcher is not None)
+    finally:
+        _cache_lock.release()
+
+
+def _update_entries(use_egg_info, paths, watched):
+    entries = []
+    stale = []
+    seen = set()
+    for path in paths:
+        realpath = os.path.realpath(path)
+        if realpath in seen:
+            continue
+        seen.add(realpath)
+        entry = _cache_entries.get(realpath)
+        if (watched and entry is not None and
+            (entry.has_eggs or not use_egg_info)):
+            # kept up to date by the watcher
+            entries.append(entry)
+            continue
+        mtime = _get_mtime(realpath)
+        if mtime is None:
+            if entry is not None:
+                del _cache_entries[realpath]
+                entry.clear()
+            continue
+        if entry is None:
+            entry = _cache_entries[realpath] = _PathEntry(realpath)
+        if entry.is_stale(mtime, use_egg_info):
+            stale.append((entry, mtime))
+        entries.append(entry)
+
+    if stale:
+        use_egg_info = use_egg_info or any(item[0].has_eggs for item in stale)
+        requests = [(item[0].realpath, item[1], item[0].paths)
+                    for item in stale]
+        results = _load_paths(requests, True, use_egg_info)
+        for (entry, mtime), dists in zip(stale, results):
+            entry.update(mtime, use_egg_info, dists)
+    return entries
+
+
+def _refresh_entries(realpaths):
+    """Scan again the cached entries of *realpaths* that changed."""
+    _cache_lock.acquire()
+    try:
+        for has_eggs in (False, True):
+            group = [realpath for realpath in realpaths
+                     if realpath in _cache_entries and
+                     _cache_entries[realpath].has_eggs == has_eggs]
+            if group:
+                _get_entries(has_eggs, group, trust_watcher=False)
+    finally:
+        _cache_lock.release()
+
+
+if pyinotify is not None:
+    _INOTIFY_MASK = (pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                     pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO |
+                     pyinotify.IN_ATTRIB | pyinotify.IN_DELETE_SELF |
+                     pyinotify.IN_MOVE_SELF)
+
+
+def _get_cached_realpaths():
+    """Return the list of the real paths of the cached entries."""
+    # copied under the lock, since queries add entries from other threads
+    _cache_lock.acquire()
+    try:
+        return list(_cache_entries)
+    finally:
+        _cache_lock.release()
+
+
+class _Watcher(object):
+    """The thread keeping the cached entries up to date, either by polling
+    their modification time or with inotify."""
+
+    def __init__(self, interval, use_inotify):
+        self.interval = interval
+        self.stopped = Event()
+        self.notifier = None
+        if use_inotify:
+            self.changed = set()  # real paths reported by inotify
+            self.watches = {}  # maps real paths to watch descriptors
+            self.manager = pyinotify.WatchManager()
+            self.notifier = pyinotify.Notifier(
+                self.manager, self._process_event,
+                timeout=int(interval * 1000))
+        self.thread = Thread(target=self.run,
+                             name='distutils2.database watcher')
+        self.thread.setDaemon(True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        if self.notifier is not None:
+            self.notifier.stop()
+
+    def run(self):
+        while not self.stopped.isSet():
+            try:
+                if self.notifier is None:
+                    _refresh_entries(_get_cached_realpaths())
+                    self.stopped.wait(self.interval)
+                else:
+                    self._wait_events()
+            except Exception, e:
+                # keep watching, the next change may fix the problem
+                logger.warning('could not update the cache: %s', e)
+                self.stopped.wait(self.interval)
+
+    def _wait_events(self):
+        self._sync_watches()
+        if self.notifier.check_events():
+            self.notifier.read_events()
+            self.notifier.process_events()
+        if self.changed:
+            realpaths = list(self.changed)
+            self.changed.clear()
+            _refresh_entries(realpaths)
+
+    def _process_event(self, event):
+        self.changed.add(event.path)
+
+    def _sync_watches(self):
+        """Watch the entries added to the cache since the last call and stop
+        watching the ones removed."""
+        realpaths = set(_get_cached_realpaths())
+        for realpath in realpaths.difference(self.watches):
+            wds = self.manager.add_watch(realpath, _INOTIFY_MASK)
+            self.watches[realpath] = wds.get(realpath)
+            # the directory may have changed before the watch was added
+            self.changed.add(realpath)
+        for realpath in set(self.watches).difference(realpaths):
+            wd = self.watches.pop(realpath)
+            if wd is not None and wd >= 0:
+                self.manager.rm_watch(wd, quiet=True)
+
+
+class _InstalledMetadata(Metadata):
+    """The metadata of an installed distribution, in a compact form.
+
+    Empty fields are not stored, and the description, usually the biggest
+    field, is dropped once parsed: it is read again from the metadata file
+    the first time it is requested.
+    """
+
+    _description_loaded = True
+    _shared_fields = False  # see _copy
+
+    def __init__(self, open_metadata, fileobj=None):
+        if fileobj is None:
+            fp = open_metadata()
+        else:
+            fp = fileobj
+        try:
+            super(_InstalledMetadata, self).__init__(fileobj=fp)
+        finally:
+            fp.close()
+        for name, value in self._fields.items():
+            if value == []:
+                del self._fields[name]
+        if 'Description' in self._fields:
+            del self._fields['Description']
+            self._open_metadata = open_metadata
+            self._description_loaded = False
+
+    def _copy(self, open_metadata):
+        """Return a copy of this metadata, sharing its fields until they are
+        changed.  The description is read with *open_metadata*."""
+        metadata = _InstalledMetadata.__new__(_InstalledMetadata)
+        metadata.__dict__.update(self.__dict__)
+        metadata.requires_files = list(self.requires_files)
+        metadata._shared_fields = True
+        # keeps this metadata in _shared_metadata while copies are in use
+        metadata._parsed = self
+        if not self._description_loaded:
+            metadata._open_metadata = open_metadata
+        return metadata
+
+    def _unshare_fields(self):
+        if self._shared_fields:
+            self._fields = self._fields.copy()
+            self._shared_fields = False
+
+    def _check_description(self, name):
+        if (self._description_loaded or
+            self._convert_name(name) != 'Description'):
+            return
+        fp = self._open_metadata()
+        try:
+            description = Metadata(fileobj=fp).get('Description', None)
+        finally:
+            fp.close()
+        del self._open_metadata
+        self._description_loaded = True
+        if description is not None:
+            self._unshare_fields()
+            self._fields['Description'] = description
+
+    def set_metadata_version(self):
+        self._unshare_fields()
+        super(_InstalledMetadata, self).set_metadata_version()
+
+    def __contains__(self, name):
+        self._check_description(name)
+        return super(_InstalledMetadata, self).__contains__(name)
+
+    def __delitem__(self, name):
+        self._check_description(name)
+        self._unshare_fields()
+        super(_InstalledMetadata, self).__delitem__(name)
+
+    def get(self, name, *args):
+        self._check_description(name)
+        value = super(_InstalledMetadata, self).get(name, *args)
+        if self._shared_fields and isinstance(value, list):
+            # the list may be the one stored in the shared fields
+            value = list(value)
+        return value
+
+    def set(self, name, value):
+        if self._convert_name(name) == 'Description':
+            self._description_loaded = True
+        self._unshare_fields()
+        super(_InstalledMetadata, self).set(name, value)
+
+
+def _load_shared_metadata(path, open_metadata):
+    """Return the parsed metadata of the ``METADATA`` file *path*, opened by
+    *open_metadata* to read the description.
+
+    Environments often contain the same releases, so the fields are shared
+    with the other distributions whose metadata file is the same file (a
+    hard link) or has the same contents, until one of them changes them.
+    The parsed file is only kept as long as one of them uses it.
+    """
+    st = os.stat(path)
+    inode_key = None
+    if st.st_ino:
+        inode_key = (st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+        _shared_metadata_lock.acquire()
+        try:
+            parsed = _shared_metadata.get(inode_key)
+        finally:
+            _shared_metadata_lock.release()
+        if parsed is not None:
+            return parsed._copy(open_metadata)
+
+    fp = open(path, 'rb')
+    try:
+        content = fp.read()
+    finally:
+        fp.close()
+    content_key = md5(content).hexdigest()
+    _shared_metadata_lock.acquire()
+    try:
+        parsed = _shared_metadata.get(content_key)
+    finally:
+        _shared_metadata_lock.release()
+    if parsed is None:
+        # parsed without holding the lock, another thread may do the same
+        # at the same time; the first result stored wins
+        fp = StringIO(content.decode('utf-8'))
+        parsed = _InstalledMetadata(None, fp)
+
+    _shared_metadata_lock.acquire()
+    try:
+        parsed = _shared_metadata.setdefault(content_key, parsed)
+        if inode_key is not None:
+            _shared_metadata[inode_key] = parsed
+    finally:
+        _shared_metadata_lock.release()
+    return parsed._copy(open_metadata)
+
+
+class _BaseDistribution(object):
+    """Common code for the installed distribution classes.
+
+    Thousands of instances can be kept in the cache, so they have no
+    ``__dict__`` and share their strings.
+    """
+
+    __slots__ = (
+        'name',  # the name of the distribution
+        'version',  # the version of the distribution
+        'path',
+        '_metadata',
+        '_fields',  # metadata fields restored from the on-disk index
+    )
+
+    @classmethod
+    def _from_index(cls, path, name, version, fields):
+        """Create a distribution from the data stored in the on-disk index,
+        without reading its metadata."""
+        dist = cls.__new__(cls)
+        dist.path = path
+        dist.name = _intern(name)
+        dist.version = _intern(version)
+        dist._metadata = None
+        dist._fields = fields
+        return dist
+
+    def _open_metadata(self):
+        """Return a file object opened on the metadata file."""
+        raise NotImplementedError
+
+    def _load_metadata(self):
+        return _InstalledMetadata(self._open_metadata)
+
+    def _read_name_version(self):
+        """Return the name and version found in the metadata file.
+
+        Only the first headers of the file are read: the other fields, and
+        most notably the description, are parsed when :attr:`metadata` is
+        first accessed.
+        """
+        name = version = None
+        fp = self._open_metadata()
+        try:
+            for line in fp:
+                if not line.strip():
+                    # end of the headers
+                    break
+                if line[0] in ' \t' or ':' not in line:
+                    # continuation line
+                    continue
+                field, value = line.split(':', 1)
+                field = field.lower()
+                if field == 'name':
+                    name = value.lstrip().rstrip('\r\n')
+                elif field == 'version':
+                    version = value.lstrip().rstrip('\r\n')
+                if name is not None and version is not None:
+                    break
+        finally:
+            fp.close()
+
+        if name is None or version is None:
+            # let Metadata find out (and complain about) the missing fields
+            name, version = self.metadata['Name'], self.metadata['Version']
+        return _intern(name), _intern(version)
+
+    def _get_metadata(self):
+        if self._metadata is None:
+            self._metadata = self._load_metadata()
+        return self._metadata
+
+    def _set_metadata(self, metadata):
+        self._metadata = metadata
+
+    metadata = property(_get_metadata, _set_metadata, doc=
+        """A :class:`distutils2.metadata.Metadata` instance loaded with
+        the distribution's metadata file.""")
+
+    def _get_field(self, name):
+        """Return the value of the metadata field *name*, without loading the
+        metadata if the field was restored from the on-disk index."""
+        if self._fields is not None and name in _INDEXED_FIELDS:
+            return self._fields[_INDEXED_FIELDS.index(name)]
+        return self.metadata[name]
+
+    def __str__(self):
+        return "%s %s" % (self.name, self.version)
+
+
+class Distribution(_BaseDistribution):
+    """Created with the *path* of the ``.dist-info`` directory provided to the
+    constructor. It reads the name and version contained in ``METADATA`` when
+    it is instantiated, and the other fields when :attr:`metadata` is first
+    accessed."""
 
-    metadata = None
-    """A :class:`distutils2.metadata.Metadata` instance loaded with
-    the distribution's ``METADATA`` file."""
+    __slots__ = (
+        '_records',  # (file key, rows) of RECORD, see _get_file_key
+        '_resources',  # (file key, dict) of RESOURCES
+        '_share_metadata',  # see _PathEntry.enable_metadata_sharing
+    )
 
     requested = False
     """A boolean that indicates whether the ``REQUESTED`` metadata file is
@@ -142,53 +1210,99 @@ class Distribution(object):
     request or it was installed as a dependency)."""
 
     def __init__(self, path):
+        self.path = path
         if _cache_enabled and path in _cache_path:
-            self.metadata = _cache_path[path].metadata
+            other = _cache_path[path]
+            self.name, self.version = other.name, other.version
+            self._metadata, self._fields = other._metadata, other._fields
+            self._records, self._resources = other._records, other._resources
+            self._share_metadata = other._share_metadata
         else:
-            metadata_path = os.path.join(path, 'METADATA')
-            self.metadata = Metadata(path=metadata_path)
-
-        self.name = self.metadata['Name']
-        self.version = self.metadata['Version']
-        self.path = path
+            self._metadata = self._fields = None
+            self._records = self._resources = None
+            self._share_metadata = False
+            self.name, self.version = self._read_name_version()
 
         if _cache_enabled and path not in _cache_path:
             _cache_path[path] = self
 
+    @classmethod
+    def _from_index(cls, path, name, version, fields):
+        dist = super(Distribution, cls)._from_index(path, name, version,
+                                                    fields)
+        dist._records = dist._resources = None
+        dist._share_metadata = False
+        return dist
+
+    def _open_metadata(self):
+        metadata_path = os.path.join(self.path, 'METADATA')
+        return codecs.open(metadata_path, 'r', encoding='utf-8')
+
+    def _load_metadata(self):
+        if not self._share_metadata:
+            return super(Distribution, self)._load_metadata()
+        return _load_shared_metadata(os.path.join(self.path, 'METADATA'),
+                                     self._open_metadata)
+
     def __repr__(self):
         return '<Distribution %r %s at %r>' % (
             self.name, self.version, self.path)
 
-    def __str__(self):
-        return "%s %s" % (self.name, self.version)
-
-    def _get_records(self, local=False):
-        results = []
-        record = self.get_distinfo_file('RECORD')
+    def _get_file_key(self, path):
+        """Return the size and modification time of the *path* file of the
+        ``.dist-info`` directory, used to validate the parsed contents kept
+        in memory, or None if it cannot be read."""
         try:
-            record_reader = csv.reader(record, delimiter=',',
-                                       lineterminator='\n')
-            for row in record_reader:
-                missing = [None for i in range(len(row), 3)]
-                path, checksum, size = row + missing
-                if local:
-                    path = path.replace('/', os.sep)
-                    path = os.path.join(sys.prefix, path)
-                results.append((path, checksum, size))
+            st = os.stat(os.path.join(self.path, path))
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def _read_rows(self, path, width):
+        """Parse the *path* CSV file of the ``.dist-info`` directory into a
+        tuple of tuples of *width* items, padded with None."""
+        rows = []
+        missing = (None,) * width
+        fp = self.get_distinfo_file(path)
+        try:
+            for row in csv.reader(fp, delimiter=',', lineterminator='\n'):
+                if len(row) > width:
+                    raise ValueError('too many values in %s: %r' %
+                                     (path, row))
+                rows.append(tuple(row) + missing[len(row):])
         finally:
-            record.close()
-        return results
+            fp.close()
+        return tuple(rows)
+
+    def _load_records(self):
+        """Return the key (see :meth:`_get_file_key`) and the rows of
+        ``RECORD``, parsing the file only if it changed since last time."""
+        key = self._get_file_key('RECORD')
+        if key is None or self._records is None or self._records[0] != key:
+            self._records = key, self._read_rows('RECORD', 3)
+        return self._records
+
+    def _get_records(self, local=False):
+        """Iterate over the ``(path, checksum, size)`` rows of ``RECORD``.
+
+        The file is parsed on first use and kept in memory until it changes.
+        """
+        for path, checksum, size in self._load_records()[1]:
+            if local:
+                path = path.replace('/', os.sep)
+                path = os.path.join(sys.prefix, path)
+            yield path, checksum, size
 
     def get_resource_path(self, relative_path):
-        resources_file = self.get_distinfo_file('RESOURCES')
-        try:
-            resources_reader = csv.reader(resources_file, delimiter=',',
-                                          lineterminator='\n')
-            for relative, destination in resources_reader:
-                if relative == relative_path:
-                    return destination
-        finally:
-            resources_file.close()
+        key = self._get_file_key('RESOURCES')
+        if (key is None or self._resources is None or
+            self._resources[0] != key):
+            resources = {}
+            for relative, destination in self._read_rows('RESOURCES', 2):
+                resources.setdefault(relative, destination)
+            self._resources = key, resources
+        if relative_path in self._resources[1]:
+            return self._resources[1][relative_path]
         raise KeyError(
             'no resource file with relative path %r is installed' %
             relative_path)
@@ -286,94 +1400,77 @@ class Distribution(object):
     __hash__ = object.__hash__
 
 
-class EggInfoDistribution(object):
+class EggInfoDistribution(_BaseDistribution):
     """Created with the *path* of the ``.egg-info`` directory or file provided
     to the constructor. It reads the metadata contained in the file itself, or
     if the given path happens to be a directory, the metadata is read from the
     file ``PKG-INFO`` under that directory."""
 
-    name = ''
-    """The name of the distribution."""
-
-    version = ''
-    """The version of the distribution."""
-
-    metadata = None
-    """A :class:`distutils2.metadata.Metadata` instance loaded with
-    the distribution's ``METADATA`` file."""
+    __slots__ = ()
 
     def __init__(self, path):
+        if not (path.endswith('.egg') or path.endswith('.egg-info')):
+            raise ValueError('path must end with .egg-info or .egg, got %r' %
+                             path)
+
         self.path = path
         if _cache_enabled and path in _cache_path_egg:
-            self.metadata = _cache_path_egg[path].metadata
-            self.name = self.metadata['Name']
-            self.version = self.metadata['Version']
+            other = _cache_path_egg[path]
+            self.name, self.version = other.name, other.version
+            self._metadata, self._fields = other._metadata, other._fields
             return
 
-        requires = None
+        self._metadata = self._fields = None
+        self.name, self.version = self._read_name_version()
 
+        if _cache_enabled:
+            _cache_path_egg[self.path] = self
+
+    def _open_metadata(self):
+        path = self.path
         if path.endswith('.egg'):
             if os.path.isdir(path):
-                meta_path = os.path.join(path, 'EGG-INFO', 'PKG-INFO')
-                self.metadata = Metadata(path=meta_path)
-                req_path = os.path.join(path, 'EGG-INFO', 'requires.txt')
-                requires = parse_requires(req_path)
+                path = os.path.join(path, 'EGG-INFO', 'PKG-INFO')
             else:
-                # FIXME handle the case where zipfile is not available
-                zipf = zipimport.zipimporter(path)
-                fileobj = StringIO(
-                    zipf.get_data('EGG-INFO/PKG-INFO').decode('utf8'))
-                self.metadata = Metadata(fileobj=fileobj)
-                try:
-                    requires = zipf.get_data('EGG-INFO/requires.txt')
-                except IOError:
-                    requires = None
-            self.name = self.metadata['Name']
-            self.version = self.metadata['Version']
+                return StringIO(_read_zip(path)[1])
+        elif os.path.isdir(path):
+            path = os.path.join(path, 'PKG-INFO')
+        return codecs.open(path, 'r', encoding='utf-8')
 
-        elif path.endswith('.egg-info'):
+    def _load_metadata(self):
+        metadata = super(EggInfoDistribution, self)._load_metadata()
+        path = self.path
+        requires = None
+
+        if path.endswith('.egg'):
             if os.path.isdir(path):
-                path = os.path.join(path, 'PKG-INFO')
-                req_path = os.path.join(path, 'requires.txt')
+                req_path = os.path.join(path, 'EGG-INFO', 'requires.txt')
                 requires = parse_requires(req_path)
-            self.metadata = Metadata(path=path)
-            self.name = self.metadata['Name']
-            self.version = self.metadata['Version']
-
-        else:
-            raise ValueError('path must end with .egg-info or .egg, got %r' %
-                             path)
+            else:
+                requires = _read_zip(path)[2]
+                if requires is not None:
+                    requires = _parse_requires(requires)
+        elif os.path.isdir(path):
+            req_path = os.path.join(path, 'requires.txt')
+            requires = parse_requires(req_path)
 
         if requires:
-            if self.metadata['Metadata-Version'] == '1.1':
+            if metadata['Metadata-Version'] == '1.1':
                 # we can't have 1.1 metadata *and* Setuptools requires
                 for field in ('Obsoletes', 'Requires', 'Provides'):
-                    if field in self.metadata:
-                        del self.metadata[field]
-            self.metadata['Requires-Dist'] += requires
-
-        if _cache_enabled:
-            _cache_path_egg[self.path] = self
+                    if field in metadata:
+                        del metadata[field]
+            metadata['Requires-Dist'] += requires
+        return metadata
 
     def __repr__(self):
         return '<EggInfoDistribution %r %s at %r>' % (
             self.name, self.version, self.path)
 
-    def __str__(self):
-        return "%s %s" % (self.name, self.version)
-
     def list_installed_files(self, local=False):
 
-        def _md5(path):
-            f = open(path, 'rb')
-            try:
-                content = f.read()
-            finally:
-                f.close()
-            return md5(content).hexdigest()
-
-        def _size(path):
-            return os.stat(path).st_size
+        def _info(path):
+            return (path, _hash_file(path), os.stat(path).st_size)
 
         path = self.path
         if local:
@@ -381,19 +1478,33 @@ class EggInfoDistribution(object):
 
         # XXX What about scripts and data files ?
         if os.path.isfile(path):
-            return [(path, _md5(path), _size(path))]
+            return [_info(path)]
         else:
             files = []
             for root, dir, files_ in os.walk(path):
                 for item in files_:
-                    item = os.path.join(root, item)
-                    files.append((item, _md5(item), _size(item)))
-            return files
+                    files.append(os.path.join(root, item))
+            return _map(_info, files)
 
-        return []
+    def _get_members(self):
+        """Return the normalized paths of the members of a zipped egg (an
+        empty list for other eggs)."""
+        if not self.path.endswith('.egg') or os.path.isdir(self.path):
+            return []
+        return [_normalize_file_path(os.path.join(self.path, member))
+                for member in _read_zip(self.path)[0]]
 
     def uses(self, path):
-        return False
+        """
+        Returns ``True`` if *path* is a member of this zipped egg, or the
+        egg itself.  The files of other eggs are unknown.
+
+        :rtype: boolean
+        """
+        path = _normalize_file_path(path)
+        if path == _normalize_file_path(self.path):
+            return self.path.endswith('.egg') and not os.path.isdir(self.path)
+        return path in self._get_members()
 
     def __eq__(self, other):
         return (isinstance(other, EggInfoDistribution) and
@@ -449,13 +1560,21 @@ def get_distributions(use_egg_info=True, paths=None):
         for dist in _yield_distributions(True, use_egg_info, paths):
             yield dist
     else:
-        _generate_cache(use_egg_info, paths)
+        entries = _get_entries(use_egg_info, paths)
+        for dist in _iter_entry_distributions(entries, use_egg_info):
+            yield dist
+
 
-        for dist in _cache_path.values():
+def _iter_entry_distributions(entries, use_egg_info):
+    """Iterate over the distributions of the cache *entries*, .dist-info
+    distributions first."""
+    for entry in entries:
+        for dist in entry.dists:
             yield dist
 
-        if use_egg_info:
-            for dist in _cache_path_egg.values():
+    if use_egg_info:
+        for entry in entries:
+            for dist in entry.eggs:
                 yield dist
 
 
@@ -484,17 +1603,69 @@ def get_distribution(name, use_egg_info=True, paths=None):
             if dist.name == name:
                 return dist
     else:
-        _generate_cache(use_egg_info, paths)
+        entries = _get_entries(use_egg_info, paths)
+        return _get_entry_distribution(entries, name, use_egg_info)
 
-        if name in _cache_name:
-            return _cache_name[name][0]
-        elif use_egg_info and name in _cache_name_egg:
-            return _cache_name_egg[name][0]
-        else:
-            return None
 
+def _get_entry_distribution(entries, name, use_egg_info):
+    """Return the first distribution named *name* in the cache *entries*, or
+    None."""
+    for entry in entries:
+        if name in entry.names:
+            return entry.names[name][0]
+    if use_egg_info:
+        for entry in entries:
+            if name in entry.egg_names:
+                return entry.egg_names[name][0]
+    return None
+
+
+def find_distributions(name, use_egg_info=True, paths=None):
+    """
+    Iterates over the installed distributions whose name matches *name*,
+    ignoring case and treating ``'-'`` and ``'_'`` as the same character.
+
+    Distributions are yielded in the order :func:`get_distribution` looks for
+    them: ``.dist-info`` directories in ``sys.path`` order, then, if
+    *use_egg_info* is ``True``, ``.egg-info`` files and directories.
 
-def obsoletes_distribution(name, version=None, use_egg_info=True):
+    :rtype: iterator of :class:`Distribution` and :class:`EggInfoDistribution`
+            instances
+    """
+    if paths is None:
+        paths = sys.path
+    name = normalize_name(name)
+
+    if not _cache_enabled:
+        eggs = []
+        for dist in _yield_distributions(True, use_egg_info, paths):
+            if normalize_name(dist.name) != name:
+                continue
+            if isinstance(dist, Distribution):
+                yield dist
+            else:
+                eggs.append(dist)
+        for dist in eggs:
+            yield dist
+    else:
+        entries = _get_entries(use_egg_info, paths)
+        for dist in _find_entry_distributions(entries, name, use_egg_info):
+            yield dist
+
+
+def _find_entry_distributions(entries, name, use_egg_info):
+    """Iterate over the distributions of the cache *entries* whose normalized
+    name is *name*."""
+    for entry in entries:
+        for dist in entry.normalized.get(name, ()):
+            yield dist
+    if use_egg_info:
+        for entry in entries:
+            for dist in entry.egg_normalized.get(name, ()):
+                yield dist
+
+
+def obsoletes_distribution(name, version=None, use_egg_info=True, paths=None):
     """
     Iterates over all distributions to find which distributions obsolete
     *name*.
@@ -507,28 +1678,33 @@ def obsoletes_distribution(name, version=None, use_egg_info=True):
     :type version: string
     :parameter name:
     """
-    for dist in get_distributions(use_egg_info):
-        obsoleted = (dist.metadata['Obsoletes-Dist'] +
-                     dist.metadata['Obsoletes'])
-        for obs in obsoleted:
-            o_components = obs.split(' ', 1)
-            if len(o_components) == 1 or version is None:
-                if name == o_components[0]:
-                    yield dist
-                    break
-            else:
+    relations = _get_relations(_OBSOLETES, name, use_egg_info, paths)
+    return _filter_obsoletes(relations, version)
+
+
+def _filter_obsoletes(relations, version):
+    """Iterate over the distributions of the obsoleting *relations* that
+    match *version*."""
+    found = set()
+    for relation in relations:
+        if relation.dist in found:
+            continue
+        if relation.version is None or version is None:
+            match = True
+        else:
+            if isinstance(version, basestring):
+                # parse the version only once for all predicates
                 try:
-                    predicate = VersionPredicate(obs)
-                except ValueError:
-                    raise PackagingError(
-                        'distribution %r has ill-formed obsoletes field: '
-                        '%r' % (dist.name, obs))
-                if name == o_components[0] and predicate.match(version):
-                    yield dist
-                    break
+                    version = NormalizedVersion(version)
+                except IrrationalVersionError:
+                    pass
+            match = relation.get_predicate().match(version)
+        if match:
+            found.add(relation.dist)
+            yield relation.dist
 
 
-def provides_distribution(name, version=None, use_egg_info=True):
+def provides_distribution(name, version=None, use_egg_info=True, paths=None):
     """
     Iterates over all distributions to find which distributions provide *name*.
     If a *version* is provided, it will be used to filter the results. Scans
@@ -548,6 +1724,13 @@ def provides_distribution(name, version=None, use_egg_info=True):
     :type name: string
     :type version: string
     """
+    relations = _get_relations(_PROVIDES, name, use_egg_info, paths)
+    return _filter_provides(relations, name, version)
+
+
+def _filter_provides(relations, name, version):
+    """Iterate over the distributions of the providing *relations* that match
+    *version*."""
     predicate = None
     if not version is None:
         try:
@@ -556,42 +1739,424 @@ def provides_distribution(name, version=None, use_egg_info=True):
             raise PackagingError('invalid name or version: %r, %r' %
                                  (name, version))
 
-    for dist in get_distributions(use_egg_info):
-        provided = dist.metadata['Provides-Dist'] + dist.metadata['Provides']
-
-        for p in provided:
-            p_components = p.rsplit(' ', 1)
-            if len(p_components) == 1 or predicate is None:
-                if name == p_components[0]:
-                    yield dist
-                    break
-            else:
-                p_name, p_ver = p_components
-                if len(p_ver) < 2 or p_ver[0] != '(' or p_ver[-1] != ')':
-                    raise PackagingError(
-                        'distribution %r has invalid Provides field: %r' %
-                        (dist.name, p))
-                p_ver = p_ver[1:-1]  # trim off the parenthesis
-                if p_name == name and predicate.match(p_ver):
-                    yield dist
-                    break
+    found = set()
+    for relation in relations:
+        if relation.dist in found:
+            continue
+        if (relation.version is None or predicate is None or
+            predicate.match(relation.get_version())):
+            found.add(relation.dist)
+            yield relation.dist
 
 
-def get_file_users(path):
+def get_file_users(path, paths=None, use_egg_info=False):
     """
     Iterates over all distributions to find out which distributions use
-    *path*.
+    *path*.  If *use_egg_info* is ``True``, the zipped eggs containing
+    *path* are returned too.
+
+    When the cache is enabled, the ``RECORD`` files of the distributions
+    found in a ``sys.path`` entry are read once to build a mapping of
+    installed files to distributions, which is kept until the entry changes.
 
     :parameter path: can be a local absolute path or a relative
                      ``'/'``-separated path.
     :type path: string
-    :rtype: iterator of :class:`Distribution` instances
+    :rtype: iterator of :class:`Distribution` and
+            :class:`EggInfoDistribution` instances
     """
-    for dist in get_distributions():
-        if dist.uses(path):
+    if paths is None:
+        paths = sys.path
+
+    if not _cache_enabled:
+        for dist in get_distributions(use_egg_info, paths):
+            if dist.uses(path):
+                yield dist
+    else:
+        entries = _get_entries(use_egg_info, paths)
+        for dist in _get_entry_file_users(entries, path, use_egg_info):
             yield dist
 
 
+def _get_entry_file_users(entries, path, use_egg_info):
+    """Iterate over the distributions of the cache *entries* using *path*."""
+    path = _normalize_file_path(path)
+    for entry in entries:
+        for dist in entry.get_file_users(path):
+            if use_egg_info or isinstance(dist, Distribution):
+                yield dist
+
+
+def _hash_file(path, st=None, hashes=None):
+    """Return the md5 hex digest of the file *path*.
+
+    The file is read in chunks.  The digest is remembered in the *hashes*
+    dict (default: a cache kept in memory) along with the modification time
+    and size of the file, given as *st* (an ``os.stat`` result) if already
+    known, and reused as long as they do not change.
+    """
+    if st is None:
+        st = os.stat(path)
+    if hashes is None:
+        hashes = _file_hashes
+        if len(hashes) >= _MAX_HASHES:
+            hashes.clear()
+    known = hashes.get(path)
+    if known is not None and known[:2] == (st.st_mtime, st.st_size):
+        return known[2]
+
+    checksum = md5()
+    fp = open(path, 'rb')
+    try:
+        while True:
+            chunk = fp.read(_HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            checksum.update(chunk)
+    finally:
+        fp.close()
+    digest = checksum.hexdigest()
+    hashes[path] = (st.st_mtime, st.st_size, digest)
+    return digest
+
+
+def _get_hashes_file(path):
+    name = md5(fsencode(path)).hexdigest() + '.hashes'
+    return os.path.join(_index_dir, name)
+
+
+def _read_hashes(dist):
+    """Return the digests of the files of *dist* kept in the on-disk index,
+    as a dict mapping paths to ``(mtime, size, md5)`` tuples."""
+    try:
+        fp = open(_get_hashes_file(dist.path), 'rb')
+    except IOError:
+        return {}
+    try:
+        try:
+            data = marshal.load(fp)
+        except (EOFError, ValueError, TypeError):
+            return {}
+    finally:
+        fp.close()
+
+    if (not isinstance(data, tuple) or len(data) != 3 or
+        data[:2] != (_INDEX_FORMAT, dist.path) or
+        not isinstance(data[2], dict)):
+        return {}
+    return data[2]
+
+
+def _verify_file(record):
+    dist, path, checksum, size, hashes = record
+    try:
+        st = os.stat(path)
+    except OSError:
+        return dist, path, VERIFY_MISSING
+    if not checksum and not size:
+        return dist, path, VERIFY_UNCHECKED
+    # compare the cheap size first, hashing is only needed if it matches
+    if size and str(st.st_size) != size:
+        return dist, path, VERIFY_SIZE
+    if checksum:
+        try:
+            if _hash_file(path, st, hashes) != checksum:
+                return dist, path, VERIFY_HASH
+        except IOError:
+            return dist, path, VERIFY_MISSING
+    return dist, path, VERIFY_OK
+
+
+def verify_distributions(dists=None, workers=4, paths=None):
+    """
+    Checks the installed files of distributions against their ``RECORD``.
+
+    *dists* is a list of :class:`Distribution` instances; if it is None, all
+    the ``.dist-info`` distributions found in *paths* (default:
+    ``sys.path``) are checked.  ``.egg-info`` distributions do not record
+    hashes and are thus ignored.
+
+    The files are checked by *workers* threads.  Files whose size differs
+    from the recorded one are not hashed, and the hashes of files whose
+    modification time and size did not change since a previous check are
+    not computed again.  The hashes are remembered in the on-disk index if
+    it is enabled (see :func:`enable_index`), so that they are reused by
+    other processes, and in memory otherwise (see :func:`clear_cache`).
+
+    Returns a list of ``(dist, path, status)`` tuples, in ``RECORD`` order,
+    where *path* is a local absolute path and *status* is one of
+    :data:`VERIFY_OK`, :data:`VERIFY_MISSING`, :data:`VERIFY_SIZE`,
+    :data:`VERIFY_HASH` or :data:`VERIFY_UNCHECKED` (neither size nor hash
+    recorded, for example for ``RECORD`` itself).
+
+    :rtype: list of tuples
+    """
+    if dists is None:
+        dists = get_distributions(paths=paths)
+
+    records = []
+    saved = []
+    for dist in dists:
+        if not isinstance(dist, Distribution):
+            continue
+        hashes = None
+        if _index_dir is not None:
+            hashes = _read_hashes(dist)
+            saved.append((dist, dict(hashes), hashes))
+        for path, checksum, size in dist.list_installed_files(local=True):
+            records.append((dist, path, checksum, size, hashes))
+    results = _parallel_map(_verify_file, records, workers)
+
+    listed = {}
+    for dist, path, status in results:
+        listed.setdefault(dist, set()).add(path)
+    for dist, old, hashes in saved:
+        # forget the files that are not listed in RECORD anymore
+        paths = listed.get(dist, ())
+        for path in list(hashes):
+            if path not in paths:
+                del hashes[path]
+        if hashes != old:
+            _dump_file(_get_hashes_file(dist.path), dist.path,
+                       (_INDEX_FORMAT, dist.path, hashes))
+    return results
+
+
+def _snapshot_dist(dist, previous=None):
+    """Return the snapshot entry of *dist*; the rows of ``RECORD`` are taken
+    from the *previous* entry of the same distribution if it is unchanged."""
+    key, records = None, ()
+    if isinstance(dist, Distribution):
+        key = dist._get_file_key('RECORD')
+        if (previous is not None and key is not None and
+            previous[1:3] == (dist.path, key)):
+            records = previous[3]
+        elif key is not None:
+            try:
+                key, records = dist._load_records()
+            except IOError:
+                key = None
+    return dist.version, dist.path, key, records
+
+
+def take_snapshot(use_egg_info=True, paths=None):
+    """
+    Returns a snapshot of the installed distributions, to be compared later
+    with :func:`diff_snapshots`.
+
+    The snapshot is a dict mapping the names of the distributions (the first
+    one found for each name, as :func:`get_distribution` would) to
+    ``(version, path, key, records)`` tuples, where *records* are the
+    ``(path, checksum, size)`` rows of ``RECORD`` and *key* identifies the
+    state of that file.  It is only made of built-in types, so it can be
+    stored with :func:`save_snapshot` or any serialization module.
+
+    :rtype: dict
+    """
+    return _snapshot_dists(get_distributions(use_egg_info, paths))
+
+
+def _snapshot_dists(dists, old=None):
+    """Return the snapshot of *dists*, reusing the unchanged entries of the
+    *old* snapshot."""
+    snapshot = {}
+    for dist in dists:
+        if dist.name not in snapshot:
+            previous = None
+            if old is not None:
+                previous = old.get(dist.name)
+            snapshot[dist.name] = _snapshot_dist(dist, previous)
+    return snapshot
+
+
+def diff_snapshots(old, new=None, use_egg_info=True, paths=None):
+    """
+    Compares two snapshots taken by :func:`take_snapshot`.
+
+    If *new* is None, *old* is compared with the distributions currently
+    installed in *paths* (default: ``sys.path``).  In both cases, the rows
+    of ``RECORD`` are only compared for the distributions whose ``RECORD``
+    file changed, and only the checksums and sizes it contains are used:
+    installed files are not read.
+
+    The results are returned in a dict of lists sorted by name::
+
+        {'added': [(name, version)],
+         'removed': [(name, version)],
+         'changed': [(name, old_version, new_version)],
+         'modified': [(name, version, paths)]}
+
+    where *modified* lists the distributions whose version did not change
+    but whose files did; *paths* are the files added, removed, or recorded
+    with a different checksum or size.
+
+    :rtype: dict
+    """
+    if new is None:
+        new = _snapshot_dists(get_distributions(use_egg_info, paths), old)
+
+    diff = {'added': [], 'removed': [], 'changed': [], 'modified': []}
+    for name in sorted(new):
+        if name not in old:
+            diff['added'].append((name, new[name][0]))
+    for name in sorted(old):
+        version, path, key, records = old[name]
+        if name not in new:
+            diff['removed'].append((name, version))
+            continue
+        new_version, new_path, new_key, new_records = new[name]
+        if version != new_version:
+            diff['changed'].append((name, version, new_version))
+        elif (path, key) != (new_path, new_key) and records != new_records:
+            rows = dict([(row[0], row[1:]) for row in records])
+            new_rows = dict([(row[0], row[1:]) for row in new_records])
+            files = [file for file in rows if file not in new_rows]
+            files.extend([file for file in new_rows
+                          if rows.get(file) != new_rows[file]])
+            diff['modified'].append((name, version, sorted(files)))
+    return diff
+
+
+def save_snapshot(snapshot, filename):
+    """Writes *snapshot*, returned by :func:`take_snapshot`, to the file
+    *filename*."""
+    fp = open(filename, 'wb')
+    try:
+        marshal.dump((_SNAPSHOT_FORMAT, snapshot), fp)
+    finally:
+        fp.close()
+
+
+def load_snapshot(filename):
+    """Returns the snapshot written to *filename* by :func:`save_snapshot`.
+
+    A :class:`PackagingError` is raised if the file is not a snapshot.
+    """
+    fp = open(filename, 'rb')
+    try:
+        try:
+            data = marshal.load(fp)
+        except (EOFError, ValueError, TypeError):
+            data = None
+    finally:
+        fp.close()
+
+    if (not isinstance(data, tuple) or len(data) != 2 or
+        data[0] != _SNAPSHOT_FORMAT or not isinstance(data[1], dict)):
+        raise PackagingError('%r is not a valid snapshot file' % filename)
+    return data[1]
+
+
+class InstalledDatabase(object):
+    """The distributions installed in one environment, given as the list of
+    its ``sys.path`` entries (default: ``sys.path``).
+
+    The methods work like the module-level functions of the same name with
+    *paths* and *use_egg_info* set to the attributes of the database, except
+    that the distributions are always cached, whether the module-level cache
+    is enabled or not.  The cache is kept per ``sys.path`` entry, so the
+    entries shared by several databases (e.g. the standard library of
+    virtual environments created from the same Python) are scanned once, and
+    the metadata of identical distributions installed in different
+    environments is parsed once.  Changes made to the environment are seen
+    by the next call.
+    """
+
+    def __init__(self, paths=None, use_egg_info=True):
+        if paths is None:
+            paths = sys.path
+        self.paths = list(paths)
+        self.use_egg_info = use_egg_info
+
+    def __repr__(self):
+        return '<InstalledDatabase %r>' % self.paths
+
+    def _get_entries(self):
+        entries = _get_entries(self.use_egg_info, self.paths)
+        _cache_lock.acquire()
+        try:
+            for entry in entries:
+                entry.enable_metadata_sharing()
+        finally:
+            _cache_lock.release()
+        return entries
+
+    def get_distributions(self):
+        """Iterates over the installed distributions, see
+        :func:`get_distributions`."""
+        return _iter_entry_distributions(self._get_entries(),
+                                         self.use_egg_info)
+
+    def get_distribution(self, name):
+        """Returns the distribution named *name*, or None, see
+        :func:`get_distribution`."""
+        return _get_entry_distribution(self._get_entries(), name,
+                                       self.use_egg_info)
+
+    def find_distributions(self, name):
+        """Iterates over the distributions whose name matches *name*, see
+        :func:`find_distributions`."""
+        return _find_entry_distributions(self._get_entries(),
+                                         normalize_name(name),
+                                         self.use_egg_info)
+
+    def provides_distribution(self, name, version=None):
+        """Iterates over the distributions providing *name*, see
+        :func:`provides_distribution`."""
+        relations = _get_entry_relations(self._get_entries(), _PROVIDES,
+                                         name, self.use_egg_info)
+        return _filter_provides(relations, name, version)
+
+    def obsoletes_distribution(self, name, version=None):
+        """Iterates over the distributions obsoleting *name*, see
+        :func:`obsoletes_distribution`."""
+        relations = _get_entry_relations(self._get_entries(), _OBSOLETES,
+                                         name, self.use_egg_info)
+        return _filter_obsoletes(relations, version)
+
+    def get_file_users(self, path):
+        """Iterates over the distributions using *path*, see
+        :func:`get_file_users`."""
+        return _get_entry_file_users(self._get_entries(), path,
+                                     self.use_egg_info)
+
+    def verify_distributions(self, workers=4):
+        """Checks the installed files of the distributions, see
+        :func:`verify_distributions`."""
+        return verify_distributions(list(self.get_distributions()), workers)
+
+    def take_snapshot(self):
+        """Returns a snapshot of the installed distributions, see
+        :func:`take_snapshot`."""
+        return _snapshot_dists(self.get_distributions())
+
+    def diff_snapshot(self, old):
+        """Compares the snapshot *old* with the installed distributions, see
+        :func:`diff_snapshots`."""
+        return diff_snapshots(old, _snapshot_dists(self.get_distributions(),
+                                                   old))
+
+
+def get_databases(environments, use_egg_info=True):
+    """
+    Returns an :class:`InstalledDatabase` for each list of ``sys.path``
+    entries in *environments*.
+
+    The entries of all the environments are scanned in one pass (using
+    several threads if :func:`enable_parallel_scan` was called), each of
+    them once even if it belongs to several environments.
+
+    :rtype: list of :class:`InstalledDatabase` instances
+    """
+    databases = [InstalledDatabase(paths, use_egg_info)
+                 for paths in environments]
+    paths = []
+    for database in databases:
+        paths.extend(database.paths)
+    _get_entries(use_egg_info, paths)
+    return databases
+
+
 def get_file_path(distribution_name, relative_path):
     """Return the path to a resource file."""
     dist = get_distribution(distribution_name)
@@ -5,14 +5,24 @@ dependencies between distributions.  Auxiliary functions can generate a
 graph, find reverse dependencies, and print a graph in DOT format.
 """
 
+import os
+import re
 import sys
+import csv
+import tempfile
 
 from StringIO import StringIO
 from distutils2.errors import PackagingError
-from distutils2.version import VersionPredicate, IrrationalVersionError
+from distutils2.version import (VersionPredicate, NormalizedVersion,
+                                IrrationalVersionError)
+from distutils2.database import normalize_name
 
 __all__ = ['DependencyGraph', 'generate_graph', 'dependent_dists',
-           'graph_to_dot']
+           'graph_to_dot', 'graph_to_jsonl', 'save_graph', 'load_graph',
+           'strongly_connected_components', 'topological_levels']
+
+# the version of the format of the files written by save_graph
+_FORMAT_VERSION = '3'
 
 
 class DependencyGraph:
@@ -29,12 +39,31 @@ class DependencyGraph:
     dependencies are found, they are stored in ``missing``, which is a
     dictionary that maps distributions to a list of requirements that were not
     provided by any other distributions.
+
+    Graphs built by :func:`generate_graph` can be updated with
+    :meth:`insert_distribution` and :meth:`remove_distribution`, which only
+    visit the edges and requirements involving the given distribution.
+
+    :meth:`get_dependents` and :meth:`get_dependencies` use the transitive
+    closure of the graph, computed on first use and kept until the graph is
+    changed by its methods.
     """
 
     def __init__(self):
         self.adjacency_list = {}
         self.reverse_list = {}
         self.missing = {}
+        # the (x, y) tuples of reverse_list, to find duplicate edges quickly
+        self._reverse_edges = set()
+        # indexes used to update the graph
+        self._names = {}  # maps names to normalized names
+        self._versions = {}  # maps version strings to parsed versions
+        self._requirements = {}  # maps requirements to (name, predicate)
+        self._provided = {}  # maps names to lists of (version, dist) tuples
+        self._provides = {}  # maps dists to lists of (name, version) tuples
+        self._missing_names = {}  # maps names to lists of (dist, req) tuples
+        # the transitive closure, see _get_closure
+        self._closure = {}
 
     def add_distribution(self, distribution):
         """Add the *distribution* to the graph.
@@ -45,6 +74,7 @@ class DependencyGraph:
         self.adjacency_list[distribution] = []
         self.reverse_list[distribution] = []
         self.missing[distribution] = []
+        self._closure = {}
 
     def add_edge(self, x, y, label=None):
         """Add an edge from distribution *x* to distribution *y* with the given
@@ -57,8 +87,10 @@ class DependencyGraph:
         :type label: ``str`` or ``None``
         """
         self.adjacency_list[x].append((y, label))
+        self._closure = {}
         # multiple edges are allowed, so be careful
-        if x not in self.reverse_list[y]:
+        if (x, y) not in self._reverse_edges:
+            self._reverse_edges.add((x, y))
             self.reverse_list[y].append(x)
 
     def add_missing(self, distribution, requirement):
@@ -69,46 +101,324 @@ class DependencyGraph:
                             :class:`distutils2.database.EggInfoDistribution`
         :type requirement: ``str``
         """
-        self.missing[distribution].append(requirement)
+        self._add_missing(distribution, requirement,
+                          self._get_requirement(requirement)[0])
+
+    def insert_distribution(self, distribution):
+        """Add the *distribution* to the graph with its dependencies.
+
+        The requirements of *distribution* are resolved with the
+        distributions of the graph, and the missing requirements of the
+        other distributions that *distribution* provides become edges.  The
+        result is the graph :func:`generate_graph` would return with
+        *distribution* at the end of the list, except for the order of the
+        edges.
+
+        :type distribution: :class:`distutils2.database.Distribution` or
+                            :class:`distutils2.database.EggInfoDistribution`
+        """
+        if distribution in self.adjacency_list:
+            raise ValueError('distribution %r is already in the graph' %
+                             distribution.name)
+        self.add_distribution(distribution)
+        self._add_provides(distribution, _parse_provides(distribution))
+
+        for name, version in self._provides[distribution]:
+            entries = self._missing_names.get(name)
+            if not entries:
+                continue
+            remaining = []
+            for dist, req in entries:
+                provider = self._find_provider(name,
+                                               self._get_requirement(req)[1])
+                if provider is None:
+                    remaining.append((dist, req))
+                else:
+                    self.missing[dist].remove(req)
+                    self.add_edge(dist, provider, req)
+            if remaining:
+                self._missing_names[name] = remaining
+            else:
+                del self._missing_names[name]
+
+        self._add_requirements(distribution)
+
+    def remove_distribution(self, distribution):
+        """Remove the *distribution* and its edges from the graph.
+
+        The requirements of the other distributions that *distribution*
+        satisfied are resolved again with the remaining distributions, and
+        become missing requirements if none matches.
+
+        :type distribution: :class:`distutils2.database.Distribution` or
+                            :class:`distutils2.database.EggInfoDistribution`
+        """
+        dependents = self.reverse_list.pop(distribution)
+        self._closure = {}
+        for name, version in self._provides.pop(distribution, ()):
+            providers = [provider for provider in self._provided.get(name, ())
+                         if provider[1] is not distribution]
+            if providers:
+                self._provided[name] = providers
+            elif name in self._provided:
+                del self._provided[name]
+
+        for req in self.missing.pop(distribution):
+            name = self._get_requirement(req)[0]
+            entries = [entry for entry in self._missing_names.get(name, ())
+                       if entry[0] is not distribution]
+            if entries:
+                self._missing_names[name] = entries
+            elif name in self._missing_names:
+                del self._missing_names[name]
+
+        for other, label in self.adjacency_list.pop(distribution):
+            if (distribution, other) in self._reverse_edges:
+                self._reverse_edges.remove((distribution, other))
+                if other is not distribution:
+                    _remove_last(self.reverse_list[other], distribution)
+
+        for dist in dependents:
+            if dist is distribution:
+                continue
+            self._reverse_edges.discard((dist, distribution))
+            edges = self.adjacency_list[dist]
+            removed = [label for other, label in edges
+                       if other is distribution]
+            edges[:] = [edge for edge in edges if edge[0] is not distribution]
+            for req in removed:
+                if req is not None:
+                    self._resolve(dist, req)
+
+    def get_dependents(self, dists):
+        """Return the distributions that depend on one of *dists*, directly
+        or not, that is the distributions broken by the removal of *dists*.
+
+        *dists* are not returned, and the distributions are listed after
+        their dependencies.
+
+        :type dists: list of distributions of the graph
+        """
+        return self._get_reachable(dists, 'dependents')
+
+    def get_dependencies(self, dists):
+        """Return the distributions that one of *dists* depends on,
+        directly or not.
+
+        *dists* are not returned, and the distributions are listed after
+        their dependencies.
+
+        :type dists: list of distributions of the graph
+        """
+        return self._get_reachable(dists, 'dependencies')
+
+    def _get_reachable(self, dists, direction):
+        closure = self._get_closure(direction)
+        nodes, positions, owners = self._closure['nodes']
+        reachable = 0
+        given = 0
+        for dist in dists:
+            if dist not in positions:
+                raise ValueError('given distribution %r is not a member of '
+                                 'the graph' % dist.name)
+            reachable |= closure[owners[dist]]
+            given |= 1 << positions[dist]
+        return [nodes[i] for i in _get_bit_indexes(reachable & ~given)]
+
+    def _get_closure(self, direction):
+        """Return the transitive closure of the graph in *direction*,
+        ``'dependents'`` or ``'dependencies'``.
+
+        The distributions are numbered in the order of
+        :func:`strongly_connected_components`, and the closure is a list
+        giving for each component an integer with the bits of the
+        distributions reachable from it set.
+        """
+        if 'nodes' not in self._closure:
+            components = strongly_connected_components(self)
+            nodes = []  # the distributions, by bit
+            positions = {}  # maps distributions to their bit
+            owners = {}  # maps distributions to the index of their component
+            masks = []  # the bits of the distributions of each component
+            for i, component in enumerate(components):
+                mask = 0
+                for dist in component:
+                    positions[dist] = len(nodes)
+                    owners[dist] = i
+                    mask |= 1 << len(nodes)
+                    nodes.append(dist)
+                masks.append(mask)
+            self._closure['nodes'] = nodes, positions, owners
+            self._closure['components'] = components, masks
+
+        closure = self._closure.get(direction)
+        if closure is None:
+            components, masks = self._closure['components']
+            owners = self._closure['nodes'][2]
+            # the components are visited so that the closures of the
+            # components reachable from a component are already known
+            closure = [0] * len(components)
+            if direction == 'dependencies':
+                order = range(len(components))
+            else:
+                order = range(len(components) - 1, -1, -1)
+            for i in order:
+                bits = 0
+                for dist in components[i]:
+                    if direction == 'dependencies':
+                        others = [other for other, label
+                                  in self.adjacency_list[dist]]
+                    else:
+                        others = self.reverse_list[dist]
+                    for other in others:
+                        j = owners[other]
+                        if j == i:
+                            # a cycle: the distributions of the component
+                            # are reachable from each other
+                            bits |= masks[i]
+                        else:
+                            bits |= masks[j] | closure[j]
+                closure[i] = bits
+            self._closure[direction] = closure
+        return closure
+
+    def _get_name(self, name):
+        """Return the normalized form of *name*."""
+        try:
+            return self._names[name]
+        except KeyError:
+            normalized = self._names[name] = normalize_name(name)
+            return normalized
+
+    def _get_requirement(self, req):
+        """Return the normalized name and the VersionPredicate of *req*."""
+        try:
+            return self._requirements[req]
+        except KeyError:
+            predicate = _parse_requirement(req)
+            result = self._get_name(predicate.name), predicate
+            self._requirements[req] = result
+            return result
+
+    def _add_provides(self, dist, provides):
+        """Index the ``(name, version string)`` tuples provided by
+        *dist*."""
+        indexed = self._provides.setdefault(dist, [])
+        for name, version in provides:
+            indexed.append((name, version))
+            name = self._get_name(name)
+            if version is not None:
+                try:
+                    version = self._versions[version]
+                except KeyError:
+                    version = self._versions[version] = _parse_version(
+                        version)
+            if name in self._provided:
+                self._provided[name].append((version, dist))
+            else:
+                self._provided[name] = [(version, dist)]
+
+    def _find_provider(self, name, predicate):
+        """Return the first distribution providing *name* whose version
+        matches *predicate*, or None."""
+        providers = self._provided.get(name)
+        if providers is None:
+            return None
+        return _find_provider(providers, predicate)
+
+    def _resolve(self, dist, req):
+        """Add an edge for the requirement *req* of *dist*, or a missing
+        requirement if no distribution matches it."""
+        name, predicate = self._get_requirement(req)
+        provider = self._find_provider(name, predicate)
+        if provider is None:
+            self._add_missing(dist, req, name)
+        else:
+            self.add_edge(dist, provider, req)
+
+    def _add_requirements(self, dist):
+        """Resolve all the requirements of *dist*."""
+        for req in dist.metadata['Requires-Dist'] + dist.metadata['Requires']:
+            self._resolve(dist, req)
+
+    def _add_missing(self, dist, req, name):
+        self.missing[dist].append(req)
+        if name in self._missing_names:
+            self._missing_names[name].append((dist, req))
+        else:
+            self._missing_names[name] = [(dist, req)]
 
     def _repr_dist(self, dist):
         return '%r %s' % (dist.name, dist.version)
 
-    def repr_node(self, dist, level=1):
-        """Prints only a subgraph"""
+    def repr_node(self, dist, level=1, depth=None):
+        """Prints only a subgraph: the dependencies of *dist* as a tree,
+        indented from *level*, at most *depth* levels deep.
+
+        The dependencies of a distribution are only listed the first time
+        it appears in the tree.
+        """
         output = []
-        output.append(self._repr_dist(dist))
-        for other, label in self.adjacency_list[dist]:
-            dist = self._repr_dist(other)
-            if label is not None:
-                dist = '%s [%s]' % (dist, label)
-            output.append('    ' * level + str(dist))
-            suboutput = self.repr_node(other, level + 1)
-            subs = suboutput.split('\n')
-            output.extend(subs[1:])
+        self._write_tree(output, dist, level, depth, set())
         return '\n'.join(output)
 
     def __repr__(self):
         """Representation of the graph"""
+        # the distributions nothing depends on first, then the remaining
+        # ones (in cycles); each distribution is expanded once
         output = []
-        for dist, adjs in self.adjacency_list.items():
-            output.append(self.repr_node(dist))
+        expanded = set()
+        dists = [dist for dist, dependents in self.reverse_list.iteritems()
+                 if not dependents]
+        dists.extend(self.adjacency_list)
+        for dist in dists:
+            if dist not in expanded:
+                self._write_tree(output, dist, 1, None, expanded)
         return '\n'.join(output)
 
+    def _write_tree(self, output, dist, level, depth, expanded):
+        """Append to *output* the lines of the tree of the dependencies of
+        *dist*, not expanding the distributions of *expanded*."""
+        output.append(self._repr_dist(dist))
+        expanded.add(dist)
+        if depth is not None and depth < 1:
+            return
+        # a stack of iterators on the edges instead of recursive calls, to
+        # handle long chains of dependencies
+        stack = [(iter(self.adjacency_list[dist]), level)]
+        while stack:
+            edges, current = stack[-1]
+            for other, label in edges:
+                line = self._repr_dist(other)
+                if label is not None:
+                    line = '%s [%s]' % (line, label)
+                output.append('    ' * current + str(line))
+                if other not in expanded and (
+                        depth is None or current - level + 1 < depth):
+                    expanded.add(other)
+                    stack.append((iter(self.adjacency_list[other]),
+                                  current + 1))
+                    break
+            else:
+                stack.pop()
+
 
-def graph_to_dot(graph, f, skip_disconnected=True):
+def graph_to_dot(graph, f, skip_disconnected=True, roots=None, depth=None):
     """Writes a DOT output for the graph to the provided file *f*.
 
     If *skip_disconnected* is set to ``True``, then all distributions
     that are not dependent on any other distribution are skipped.
 
+    Each edge is written once, as the graph is walked; see
+    :func:`graph_to_jsonl` for *roots* and *depth*.
+
     :type f: has to support ``file``-like operations
     :type skip_disconnected: ``bool``
     """
     disconnected = []
 
     f.write(u"digraph dependencies {\n")
-    for dist, adjs in graph.adjacency_list.items():
+    for dist, adjs in _walk_graph(graph, roots, depth):
         if len(adjs) == 0 and not skip_disconnected:
             disconnected.append(dist)
         for other, label in adjs:
@@ -129,98 +439,509 @@ def graph_to_dot(graph, f, skip_disconnected=True):
     f.write(u'}\n')
 
 
+def graph_to_jsonl(graph, f, roots=None, depth=None):
+    """Writes the graph to the provided file *f* in JSON lines: one JSON
+    object per line for each distribution, such as::
+
+        {"id": 0, "name": "choxie", "version": "2.0.0.9",
+         "requires": [[1, "towel-stuff (0.1)"]], "missing": ["nut"]}
+
+    (on one line).  ``requires`` lists the ``[id, label]`` pairs of the
+    edges to the distributions it depends on; ids are given in the order
+    the distributions are found and can be used before the line of the
+    distribution is written.  Each distribution and edge is written once.
+
+    If *roots* is given, only these distributions and the distributions
+    they depend on are written, at most *depth* edges away from *roots*
+    if *depth* is not None; the edges to other distributions are left out.
+
+    :type f: has to support ``file``-like operations
+    :type roots: list of distributions of the graph
+    :type depth: ``int`` or ``None``
+    """
+    ids = {}
+    for dist, adjs in _walk_graph(graph, roots, depth):
+        if dist not in ids:
+            ids[dist] = len(ids)
+        requires = []
+        for other, label in adjs:
+            if other not in ids:
+                ids[other] = len(ids)
+            requires.append(u'[%d, %s]' % (ids[other], _to_json(label)))
+        missing = [_to_json(req) for req in graph.missing[dist]]
+        f.write(u'{"id": %d, "name": %s, "version": %s, "requires": [%s], '
+                u'"missing": [%s]}\n' % (
+                    ids[dist], _to_json(dist.name), _to_json(dist.version),
+                    u', '.join(requires), u', '.join(missing)))
+
+
+def _walk_graph(graph, roots=None, depth=None):
+    """Iterate over the ``(dist, edges)`` tuples of the distributions of
+    *graph* found from *roots*, each distribution once.
+
+    The distributions are visited breadth-first from *roots*, at most
+    *depth* edges away from them; *edges* are the ``(other, label)`` edges
+    to the visited distributions.  All the distributions are visited if
+    *roots* is None.
+    """
+    if roots is None:
+        for dist, edges in graph.adjacency_list.iteritems():
+            yield dist, edges
+        return
+
+    levels = {}  # maps the distributions found to their distance
+    queue = []
+    for dist in roots:
+        if dist not in levels:
+            levels[dist] = 0
+            queue.append(dist)
+    # the distributions of a level are all found before the previous level
+    # is done, so an edge leaves the subgraph when its end is not found yet
+    i = 0
+    while i < len(queue):
+        dist = queue[i]
+        i += 1
+        level = levels[dist]
+        edges = []
+        for other, label in graph.adjacency_list[dist]:
+            if other not in levels:
+                if depth is not None and level >= depth:
+                    continue
+                levels[other] = level + 1
+                queue.append(other)
+            edges.append((other, label))
+        yield dist, edges
+
+
+# the characters of JSON strings that need no escape
+_JSON_PLAIN = re.compile(u'[ !#-\\[\\]-~]*\\Z')
+_JSON_ESCAPES = {u'"': u'\\"', u'\\': u'\\\\', u'\n': u'\\n', u'\r': u'\\r',
+                 u'\t': u'\\t'}
+
+
+def _to_json(value):
+    """Return the JSON form of *value*, a string, an object converted to a
+    string (such as a version) or None."""
+    if value is None:
+        return u'null'
+    if not isinstance(value, basestring):
+        value = str(value)
+    if _JSON_PLAIN.match(value) is not None:
+        return u'"%s"' % value
+    if not isinstance(value, unicode):
+        value = value.decode('utf-8')
+    chars = []
+    for char in value:
+        if char in _JSON_ESCAPES:
+            chars.append(_JSON_ESCAPES[char])
+        elif u' ' <= char <= u'~':
+            chars.append(char)
+        else:
+            code = ord(char)
+            if code > 0xffff:
+                # a surrogate pair, on wide builds of Python
+                code -= 0x10000
+                chars.append(u'\\u%04x' % (0xd800 | code >> 10))
+                code = 0xdc00 | code & 0x3ff
+            chars.append(u'\\u%04x' % code)
+    return u'"%s"' % u''.join(chars)
+
+
+# the positions of the bits set in each hexadecimal digit
+_HEX_BITS = dict((digit, [bit for bit in range(4)
+                          if int(digit, 16) & 1 << bit])
+                 for digit in '0123456789abcdef')
+
+
+def _get_bit_indexes(bits):
+    """Return the positions of the bits set in the integer *bits*, in
+    increasing order."""
+    indexes = []
+    digits = '%x' % bits
+    size = len(digits)
+    for i in xrange(size):
+        digit = digits[size - 1 - i]
+        if digit != '0':
+            for bit in _HEX_BITS[digit]:
+                indexes.append(4 * i + bit)
+    return indexes
+
+
+def _remove_last(items, item):
+    """Remove the last occurrence of *item* from the list *items*.
+
+    Items are compared by identity, starting from the end of the list where
+    the distributions inserted last are found.
+    """
+    for i in xrange(len(items) - 1, -1, -1):
+        if items[i] is item:
+            del items[i]
+            return
+    raise ValueError('item not in list')
+
+
+def _parse_provides(dist):
+    """Return the ``(name, version)`` tuples of the names provided by
+    *dist*, where *version* is a string or None if no version is given."""
+    provides = (dist.metadata['Provides-Dist'] +
+                dist.metadata['Provides'] +
+                ['%s (%s)' % (dist.name, dist.version)])
+
+    parsed = []
+    for p in provides:
+        comps = p.strip().rsplit(" ", 1)
+        name = comps[0]
+        version = None
+        if len(comps) == 2:
+            version = comps[1]
+            if len(version) < 3 or version[0] != '(' or version[-1] != ')':
+                raise PackagingError('distribution %r has ill-formed'
+                                     'provides field: %r' % (dist.name, p))
+            version = version[1:-1]  # trim off parenthesis
+        parsed.append((name, version))
+    return parsed
+
+
+def _parse_version(version):
+    """Return the NormalizedVersion of a provided *version*, or False if it
+    is not rational."""
+    try:
+        return NormalizedVersion(version)
+    except IrrationalVersionError:
+        # XXX small compat-mode: such versions never match
+        return False
+
+
+def _parse_requirement(req):
+    """Return the VersionPredicate of the requirement *req*."""
+    try:
+        return VersionPredicate(req)
+    except IrrationalVersionError:
+        # XXX compat-mode if cannot read the version
+        name = req.split()[0]
+        return VersionPredicate(name)
+
+
+def _find_provider(providers, predicate):
+    """Return the first distribution of the ``(version, dist)``
+    *providers* whose version matches *predicate*, or None.
+
+    A version of None matches any predicate, False matches none.
+    """
+    for version, provider in providers:
+        if version is None or (version and predicate.match(version)):
+            return provider
+    return None
+
+
 def generate_graph(dists):
     """Generates a dependency graph from the given distributions.
 
+    The names provided and required are compared regardless of case and of
+    the ``'-'``/``'_'`` spelling, and each provided version and requirement
+    is only parsed once.
+
     :parameter dists: a list of distributions
     :type dists: list of :class:`distutils2.database.Distribution` and
                  :class:`distutils2.database.EggInfoDistribution` instances
     :rtype: a :class:`DependencyGraph` instance
     """
     graph = DependencyGraph()
-    provided = {}  # maps names to lists of (version, dist) tuples
 
     # first, build the graph and find out the provides
     for dist in dists:
         graph.add_distribution(dist)
-        provides = (dist.metadata['Provides-Dist'] +
-                    dist.metadata['Provides'] +
-                    ['%s (%s)' % (dist.name, dist.version)])
-
-        for p in provides:
-            comps = p.strip().rsplit(" ", 1)
-            name = comps[0]
-            version = None
-            if len(comps) == 2:
-                version = comps[1]
-                if len(version) < 3 or version[0] != '(' or version[-1] != ')':
-                    raise PackagingError('distribution %r has ill-formed'
-                                         'provides field: %r' % (dist.name, p))
-                version = version[1:-1]  # trim off parenthesis
-            if name not in provided:
-                provided[name] = []
-            provided[name].append((version, dist))
+        graph._add_provides(dist, _parse_provides(dist))
 
     # now make the edges
     for dist in dists:
-        requires = dist.metadata['Requires-Dist'] + dist.metadata['Requires']
-        for req in requires:
-            try:
-                predicate = VersionPredicate(req)
-            except IrrationalVersionError:
-                # XXX compat-mode if cannot read the version
-                name = req.split()[0]
-                predicate = VersionPredicate(name)
-
-            name = predicate.name
-
-            if name not in provided:
-                graph.add_missing(dist, req)
+        graph._add_requirements(dist)
+    return graph
+
+
+def save_graph(graph, path, stamp=''):
+    """Write the *graph* to the file *path*, to be read by
+    :func:`load_graph`.
+
+    Distributions are identified by their ``path`` attribute, and their
+    name, version and the modification time of their metadata file are
+    recorded to detect changes.  Only the distributions added by
+    :func:`generate_graph` or :meth:`DependencyGraph.insert_distribution`
+    are written.  The file is replaced at once, so that readers never see a
+    partially written graph.
+
+    :param stamp: a string describing the state of the installed
+                  distributions, recorded in the file; :func:`load_graph`
+                  ignores the file if given another stamp.
+    """
+    rows = [('depgraph', _FORMAT_VERSION, stamp)]
+    dists = [dist for dist in graph.adjacency_list if dist in graph._provides]
+    for dist in dists:
+        rows.append(('distribution', dist.path) + _get_stamp(dist))
+        for name, version in graph._provides[dist]:
+            if version is None:
+                version = ''
+            rows.append(('provides', dist.path, name, version))
+    for dist in dists:
+        for other, label in graph.adjacency_list[dist]:
+            if label is not None and other in graph._provides:
+                rows.append(('edge', dist.path, other.path, label))
+        for req in graph.missing[dist]:
+            rows.append(('missing', dist.path, req))
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        fp = os.fdopen(fd, 'w')
+        try:
+            writer = csv.writer(fp, delimiter=',', lineterminator='\n',
+                                quotechar='"')
+            for row in rows:
+                writer.writerow([_encode(value) for value in row])
+        finally:
+            fp.close()
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load_graph(path, dists, stamp=''):
+    """Return the dependency graph of *dists*, read from the file *path*
+    written by :func:`save_graph`.
+
+    The graph is updated to *dists*: the distributions of the file that are
+    not in *dists* are removed from the graph and the distributions of
+    *dists* that are not in the file are inserted, see
+    :meth:`DependencyGraph.insert_distribution`.  So are the distributions
+    whose name, version or metadata file changed since the file was
+    written.  The graph is generated from scratch if the file is missing,
+    cannot be read or was saved with another *stamp*.
+
+    :parameter dists: a list of distributions, see :func:`generate_graph`
+    :parameter stamp: the stamp given to :func:`save_graph`
+    :rtype: a :class:`DependencyGraph` instance
+    """
+    try:
+        fp = open(path)
+    except IOError:
+        return generate_graph(dists)
+    try:
+        try:
+            rows = list(csv.reader(fp, delimiter=',', lineterminator='\n'))
+        except csv.Error:
+            return generate_graph(dists)
+    finally:
+        fp.close()
+    if not rows or rows[0] != ['depgraph', _FORMAT_VERSION, _encode(stamp)]:
+        return generate_graph(dists)
+
+    paths = {}
+    for dist in dists:
+        paths[dist.path] = dist
+    # the rows of the distributions that changed are ignored, they are
+    # inserted again below
+    known = {}
+    try:
+        for row in rows[1:]:
+            if row[0] == 'distribution':
+                dist = paths.get(row[1])
+                if dist is not None and tuple(row[2:]) == _get_stamp(dist):
+                    known[row[1]] = dist
+    except IndexError:
+        return generate_graph(dists)
+
+    graph = DependencyGraph()
+    stale = []  # (dist, req) tuples whose provider is gone
+    try:
+        for row in rows[1:]:
+            dist = known.get(row[1])
+            if dist is None:
+                continue
+            kind = row[0]
+            if kind == 'distribution':
+                graph.add_distribution(dist)
+                graph._add_provides(dist, ())
+            elif kind == 'provides':
+                version = row[3].decode('utf-8') or None
+                graph._add_provides(dist, [(row[2].decode('utf-8'),
+                                            version)])
+            elif kind == 'edge':
+                other = known.get(row[2])
+                label = row[3].decode('utf-8')
+                if other is None or other not in graph._provides:
+                    stale.append((dist, label))
+                else:
+                    graph.add_edge(dist, other, label)
+            elif kind == 'missing':
+                graph.add_missing(dist, row[2].decode('utf-8'))
             else:
-                matched = False
-                for version, provider in provided[name]:
-                    try:
-                        match = predicate.match(version)
-                    except IrrationalVersionError:
-                        # XXX small compat-mode
-                        if version.split(' ') == 1:
-                            match = True
-                        else:
-                            match = False
-
-                    if match:
-                        graph.add_edge(dist, provider, req)
-                        matched = True
-                        break
-                if not matched:
-                    graph.add_missing(dist, req)
+                raise ValueError('unknown row %r' % kind)
+    except (IndexError, KeyError, ValueError, UnicodeError):
+        return generate_graph(dists)
+
+    for dist, req in stale:
+        graph._resolve(dist, req)
+    for dist in dists:
+        if dist not in graph.adjacency_list:
+            graph.insert_distribution(dist)
     return graph
 
 
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _get_stamp(dist):
+    """Return the name, version and modification time of the metadata file
+    (an empty string if unknown) of *dist*, as encoded strings."""
+    path = dist.path
+    if os.path.isdir(path):
+        for name in ('METADATA', 'PKG-INFO', os.path.join('EGG-INFO',
+                                                          'PKG-INFO')):
+            if os.path.isfile(os.path.join(path, name)):
+                path = os.path.join(path, name)
+                break
+    try:
+        mtime = repr(os.stat(path).st_mtime)
+    except OSError:
+        mtime = ''
+    return _encode(dist.name), _encode(dist.version), mtime
+
+
+def strongly_connected_components(graph, dists=None):
+    """Return the strongly connected components of *graph*.
+
+    Each component is a list of distributions that all depend on each
+    other, directly or not; a distribution that is not part of a cycle is
+    a component on its own.  Components are returned in dependency order:
+    a component comes after the components it depends on.
+
+    :param dists: the distributions to consider and the order in which they
+                  are visited, by default all the distributions of the
+                  graph; the edges to other distributions are ignored.
+    :rtype: a list of lists of distributions
+    """
+    if dists is None:
+        dists = list(graph.adjacency_list)
+    nodes = set(dists)
+    # Tarjan's algorithm, with an explicit stack of the visited edges
+    # instead of recursive calls to handle long chains of dependencies
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in dists:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        visiting = [(root, iter(graph.adjacency_list[root]))]
+        while visiting:
+            dist, edges = visiting[-1]
+            for other, label in edges:
+                if other not in nodes:
+                    continue
+                if other not in index:
+                    index[other] = lowlink[other] = len(index)
+                    stack.append(other)
+                    on_stack.add(other)
+                    visiting.append((other,
+                                     iter(graph.adjacency_list[other])))
+                    break
+                if other in on_stack and index[other] < lowlink[dist]:
+                    lowlink[dist] = index[other]
+            else:
+                visiting.pop()
+                if visiting:
+                    parent = visiting[-1][0]
+                    if lowlink[dist] < lowlink[parent]:
+                        lowlink[parent] = lowlink[dist]
+                if lowlink[dist] == index[dist]:
+                    component = []
+                    while True:
+                        other = stack.pop()
+                        on_stack.remove(other)
+                        component.append(other)
+                        if other is dist:
+                            break
+                    component.reverse()
+                    components.append(component)
+    return components
+
+
+def topological_levels(graph, dists=None):
+    """Return the distributions of *graph* grouped in levels.
+
+    The first level contains the distributions that depend on no other
+    distribution, and each following level the distributions whose
+    dependencies are all in the previous levels: the distributions of a
+    level can be installed in any order, or at the same time, once the
+    previous levels are installed.  The distributions of a cycle of
+    dependencies are kept together as one unit, see
+    :func:`strongly_connected_components`.
+
+    :param dists: the distributions to consider, see
+                  :func:`strongly_connected_components`
+    :rtype: a list of levels, which are lists of units, which are lists of
+            distributions
+    """
+    components = strongly_connected_components(graph, dists)
+    owners = {}  # maps distributions to the index of their component
+    for i, component in enumerate(components):
+        for dist in component:
+            owners[dist] = i
+
+    # Kahn's algorithm on the graph of the components
+    pending = []  # the number of dependencies of each component
+    dependents = [[] for component in components]
+    for i, component in enumerate(components):
+        dependencies = set()
+        for dist in component:
+            for other, label in graph.adjacency_list[dist]:
+                j = owners.get(other)
+                if j is not None and j != i:
+                    dependencies.add(j)
+        pending.append(len(dependencies))
+        for j in dependencies:
+            dependents[j].append(i)
+
+    levels = []
+    level = [i for i in range(len(components)) if pending[i] == 0]
+    while level:
+        levels.append([components[i] for i in level])
+        next_level = []
+        for i in level:
+            for j in dependents[i]:
+                pending[j] -= 1
+                if pending[j] == 0:
+                    next_level.append(j)
+        # keep the order of strongly_connected_components in each level
+        next_level.sort()
+        level = next_level
+    return levels
+
+
 def dependent_dists(dists, dist):
     """Recursively generate a list of distributions from *dists* that are
     dependent on *dist*.
 
+    To look up the dependents of several distributions, use
+    :meth:`DependencyGraph.get_dependents` on the graph of *dists*.
+
     :param dists: a list of distributions
     :param dist: a distribution, member of *dists* for which we are interested
     """
     if dist not in dists:
         raise ValueError('given distribution %r is not a member of the list' %
                          dist.name)
-    graph = generate_graph(dists)
-
-    dep = [dist]  # dependent distributions
-    fringe = graph.reverse_list[dist]  # list of nodes we should inspect
-
-    while not len(fringe) == 0:
-        node = fringe.pop()
-        dep.append(node)
-        for prev in graph.reverse_list[node]:
-            if prev not in dep:
-                fringe.append(prev)
-
-    dep.pop(0)  # remove dist from dep, was there to prevent infinite loops
-    return dep
+    return generate_graph(dists).get_dependents([dist])
 
 
 def main():
@@ -19,8 +19,10 @@ from distutils2.util import (_is_archive_file, ask, get_install_method,
                              egginfo_to_distinfo)
 from distutils2.pypi import wrapper
 from distutils2.version import get_version_predicate
-from distutils2.database import get_distributions, get_distribution
-from distutils2.depgraph import generate_graph
+from distutils2.database import (get_distributions, find_distributions,
+                                 normalize_name)
+from distutils2.depgraph import (generate_graph, load_graph, save_graph,
+                                 topological_levels)
 
 from distutils2.errors import (PackagingError, InstallationException,
                                InstallationConflict, CCompilerError)
@@ -32,7 +34,11 @@ from distutils2._backport.sysconfig import (get_config_var, get_path,
 
 
 __all__ = ['install_dists', 'install_from_infos', 'get_infos', 'remove',
-           'install', 'install_local_project']
+           'install', 'install_local_project', 'get_graph', 'get_graph_path']
+
+# the file of the on-disk index directory where install saves the dependency
+# graph of the installed distributions, see get_graph_path
+_GRAPH_FILENAME = 'distutils2-depgraph.csv'
 
 
 def _move_files(files, destination):
@@ -275,7 +281,8 @@ def _get_setuptools_deps(release):
     pass
 
 
-def get_infos(requirements, index=None, installed=None, prefer_final=True):
+def get_infos(requirements, index=None, installed=None, prefer_final=True,
+              graph_path=None):
     """Return the informations on what's going to be installed and upgraded.
 
     :param requirements: is a *string* containing the requirements for this
@@ -285,6 +292,9 @@ def get_infos(requirements, index=None, installed=None, prefer_final=True):
     :param installed: a list of already installed distributions.
     :param prefer_final: when picking up the releases, prefer a "final" one
                          over a beta/alpha/etc one.
+    :param graph_path: the file where the dependency graph of the installed
+                       distributions was saved, see :func:`get_graph`.  It
+                       is only read.
 
     The results are returned in a dict, containing all the operations
     needed to install the given requirements::
@@ -293,8 +303,106 @@ def get_infos(requirements, index=None, installed=None, prefer_final=True):
         {'install': [<FooBar 1.1>], 'remove': [], 'conflict': []}
 
     Conflict contains all the conflicting distributions, if there is a
-    conflict.
+    conflict.  The releases to install are listed after their dependencies.
     """
+    if not installed:
+        logger.debug('Reading installed distributions')
+        installed = list(get_distributions(use_egg_info=True))
+
+    # index the installed projects once, requirements are then looked up
+    # by normalized name instead of scanning the whole list each time
+    names = {}
+    for installed_project in installed:
+        name = normalize_name(installed_project.name)
+        if name not in names:
+            names[name] = []
+        names[name].append(installed_project)
+
+    # the dependency graph of the installed projects is only built if a
+    # release has to be checked, then each release is inserted in the graph
+    # and removed once its dependencies are known
+    graphs = []
+
+    def get_graph_once():
+        if not graphs:
+            graphs.append(get_graph(installed, graph_path))
+        return graphs[0]
+
+    infos = _get_infos(requirements, index, names, get_graph_once)
+    infos['install'] = _order_releases(infos['install'])
+    return infos
+
+
+def _order_releases(releases):
+    """Return *releases* sorted so that each release comes after its
+    dependencies, see :func:`distutils2.depgraph.topological_levels`."""
+    if len(releases) < 2:
+        return releases
+    ordered = []
+    for level in topological_levels(generate_graph(releases), releases):
+        for unit in level:
+            ordered.extend(unit)
+    return ordered
+
+
+def get_graph_path():
+    """Return the path of the file where :func:`install` saves the
+    dependency graph of the installed distributions.
+
+    The file is kept in the directory of the on-disk index of the installed
+    distributions, see :func:`distutils2.database.enable_index`; None is
+    returned if the index is disabled, in which case the graph is neither
+    saved nor loaded.
+    """
+    index_dir = database.get_index_dir()
+    if index_dir is None:
+        return None
+    return os.path.join(index_dir, _GRAPH_FILENAME)
+
+
+def get_graph(installed, graph_path=None):
+    """Return the dependency graph of the *installed* distributions.
+
+    If *graph_path* is given, the graph saved in this file (see
+    :func:`get_graph_path`) is loaded and updated to *installed* instead of
+    being generated from scratch, see
+    :func:`distutils2.depgraph.load_graph`.  The saved graph is ignored if
+    a ``sys.path`` entry was modified since it was written.  The file is
+    not written.
+    """
+    if graph_path is None:
+        return generate_graph(installed)
+    return load_graph(graph_path, installed, _get_paths_stamp())
+
+
+def _save_graph(graph_path):
+    """Save the dependency graph of the installed distributions to
+    *graph_path*, for the next calls of :func:`get_graph`."""
+    if graph_path is None:
+        return
+    installed = list(get_distributions(use_egg_info=True))
+    try:
+        save_graph(get_graph(installed, graph_path), graph_path,
+                   _get_paths_stamp())
+    except (IOError, OSError), e:
+        logger.debug('Could not save the dependency graph: %s', e)
+
+
+def _get_paths_stamp():
+    """Return a string made of the ``sys.path`` entries and their
+    modification times, which change when distributions are installed or
+    removed there."""
+    stamp = []
+    for path in sys.path:
+        try:
+            mtime = repr(os.stat(path or os.curdir).st_mtime)
+        except OSError:
+            mtime = ''
+        stamp.append('%s=%s' % (path, mtime))
+    return os.pathsep.join(stamp)
+
+
+def _get_infos(requirements, index, names, get_graph):
     # this function does several things:
     # 1. get a release specified by the requirements
     # 2. gather its metadata, using setuptools compatibility if needed
@@ -304,21 +412,14 @@ def get_infos(requirements, index=None, installed=None, prefer_final=True):
     # 5. return a dict containing information about what is needed to install
     #    or remove
 
-    if not installed:
-        logger.debug('Reading installed distributions')
-        installed = list(get_distributions(use_egg_info=True))
-
     infos = {'install': [], 'remove': [], 'conflict': []}
     # Is a compatible version of the project already installed ?
     predicate = get_version_predicate(requirements)
-    found = False
 
     # check that the project isn't already installed
-    for installed_project in installed:
-        # is it a compatible project ?
-        if predicate.name.lower() != installed_project.name.lower():
-            continue
-        found = True
+    existing = names.get(normalize_name(predicate.name))
+    if existing:
+        installed_project = existing[0]
         logger.info('Found %r %s', installed_project.name,
                     installed_project.version)
 
@@ -326,17 +427,12 @@ def get_infos(requirements, index=None, installed=None, prefer_final=True):
         # requirements
         if predicate.match(installed_project.version):
             return infos
-        break
-
-    if not found:
+    else:
         logger.debug('Project not installed')
 
     if not index:
         index = wrapper.ClientWrapper()
 
-    if not installed:
-        installed = get_distributions(use_egg_info=True)
-
     # Get all the releases that match the requirements
     try:
         release = index.get_release(requirements)
@@ -353,24 +449,31 @@ def get_infos(requirements, index=None, installed=None, prefer_final=True):
     if 'requires_dist' not in metadata:
         metadata['requires_dist'] = _get_setuptools_deps(release)
 
-    # build the dependency graph with local and required dependencies
-    dists = list(installed)
-    dists.append(release)
-    depgraph = generate_graph(dists)
+    # add the release to the dependency graph of the local distributions
+    depgraph = get_graph()
+    existing = names.get(normalize_name(release.name))
+    try:
+        depgraph.insert_distribution(release)
+        # Get what the missing deps are
+        dists = list(depgraph.missing[release])
+        conflicts = []
+        if existing:
+            conflicts = list(depgraph.reverse_list[existing[0]])
+    finally:
+        # the release may be missing if insert_distribution failed early
+        if release in depgraph.adjacency_list:
+            depgraph.remove_distribution(release)
 
-    # Get what the missing deps are
-    dists = depgraph.missing[release]
     if dists:
         logger.info("Missing dependencies found, retrieving metadata")
         # we have missing deps
         for dist in dists:
-            _update_infos(infos, get_infos(dist, index, installed))
+            _update_infos(infos, _get_infos(dist, index, names, get_graph))
 
     # Fill in the infos
-    existing = [d for d in installed if d.name == release.name]
     if existing:
         infos['remove'].append(existing[0])
-        infos['conflict'].extend(depgraph.reverse_list[existing[0]])
+        infos['conflict'].extend(conflicts)
     infos['install'].append(release)
     return infos
 
@@ -389,9 +492,11 @@ def remove(project_name, paths=None, auto_confirm=True):
 
     Returns True on success
     """
-    dist = get_distribution(project_name, use_egg_info=True, paths=paths)
-    if dist is None:
+    dists = list(find_distributions(project_name, use_egg_info=True,
+                                    paths=paths))
+    if not dists:
         raise PackagingError('Distribution %r not found' % project_name)
+    dist = dists[0]
     files = dist.list_installed_files(local=True)
     rmdirs = []
     rmfiles = []
@@ -514,8 +619,9 @@ def install(project):
         return False
 
     logger.info('Getting information about %r...', project)
+    graph_path = get_graph_path()
     try:
-        info = get_infos(project)
+        info = get_infos(project, graph_path=graph_path)
     except InstallationException:
         logger.info('Cound not find %r', project)
         return False
@@ -533,5 +639,7 @@ def install(project):
         if logger.isEnabledFor(logging.INFO):
             projects = ('%r %s' % (p.name, p.version) for p in e.args[0])
             logger.info('%r conflicts with %s', project, ','.join(projects))
+    else:
+        _save_graph(graph_path)
 
     return True
@@ -439,14 +439,13 @@ class ReleasesList(IndexReference):
         internally to sort the releases.
         """
 
-        sort_by = []
         if prefer_final:
-            sort_by.append("is_final")
-        sort_by.append("version")
+            key = lambda release: (release.version.is_final,
+                                   release.version.sort_key)
+        else:
+            key = lambda release: release.version.sort_key
 
-        self.releases.sort(
-            key=lambda i: tuple(getattr(i, arg) for arg in sort_by),
-            reverse=reverse, *args, **kwargs)
+        self.releases.sort(key=key, reverse=reverse, *args, **kwargs)
 
     def get_release(self, version):
         """Return a release from its version."""
@@ -2,6 +2,7 @@
 
 import os
 import re
+import csv
 import sys
 import getopt
 import logging
@@ -11,13 +12,17 @@ from distutils2.dist import Distribution
 from distutils2.util import _is_archive_file, generate_setup_py
 from distutils2.command import get_command_class, STANDARD_COMMANDS
 from distutils2.command.cmd import Command
-from distutils2.install import install, install_local_project, remove
-from distutils2.database import get_distribution, get_distributions
-from distutils2.depgraph import generate_graph
+from distutils2.install import (install, install_local_project, remove,
+                                get_graph, get_graph_path)
+from distutils2.database import (get_distribution, get_distributions,
+                                 find_distributions, verify_distributions,
+                                 enable_index,
+                                 VERIFY_OK, VERIFY_UNCHECKED, normalize_name)
+from distutils2.depgraph import graph_to_dot, graph_to_jsonl
 from distutils2.fancy_getopt import FancyGetopt
 from distutils2.errors import (PackagingArgError, PackagingError,
                                PackagingModuleError, PackagingClassError,
-                               CCompilerError)
+                               CCompilerError, IrrationalVersionError)
 
 
 command_re = re.compile(r'^[a-zA-Z]([a-zA-Z0-9_]*)$')
@@ -116,24 +121,53 @@ def _generate(distpatcher, args, **kw):
 
 
 @action_help("""\
-Usage: pysetup graph dist
+Usage: pysetup graph dist [--depth N] [--format tree|dot|json]
    or: pysetup graph --help
 
 Print dependency graph for the distribution.
 
 positional arguments:
    dist  installed distribution name
+
+optional arguments:
+   --depth N   only print the dependencies up to N levels deep
+   --format F  print an indented tree (default), a DOT graph or JSON lines
 """)
 def _graph(dispatcher, args, **kw):
-    name = args[1]
+    opts = _parse_args(args[1:], '', ['depth=', 'format='])
+    if len(opts['args']) != 1:
+        logger.warning('Usage: pysetup graph dist')
+        return 1
+    depth = None
+    if 'depth' in opts:
+        try:
+            depth = int(opts['depth'][-1])
+        except ValueError:
+            logger.warning('Invalid depth: %r', opts['depth'][-1])
+            return 1
+    output_format = 'tree'
+    if 'format' in opts:
+        output_format = opts['format'][-1]
+        if output_format not in ('tree', 'dot', 'json'):
+            logger.warning('Unknown format: %r', output_format)
+            return 1
+
+    name = opts['args'][0]
     dist = get_distribution(name, use_egg_info=True)
     if dist is None:
         logger.warning('Distribution not found.')
         return 1
     else:
-        dists = get_distributions(use_egg_info=True)
-        graph = generate_graph(dists)
-        print graph.repr_node(dist)
+        dists = list(get_distributions(use_egg_info=True))
+        graph = get_graph(dists, get_graph_path())
+        # the graph may hold another instance of the distribution
+        dist = [other for other in dists if other == dist][0]
+        if output_format == 'dot':
+            graph_to_dot(graph, sys.stdout, roots=[dist], depth=depth)
+        elif output_format == 'json':
+            graph_to_jsonl(graph, sys.stdout, roots=[dist], depth=depth)
+        else:
+            print graph.repr_node(dist, depth=depth)
 
 
 @action_help("""\
@@ -215,6 +249,37 @@ def _metadata(dispatcher, args, **kw):
                 print '   ', value.replace('\n', '\n    ')
 
 
+def _warn_dependents(projects):
+    # the warning is only advisory: an unrelated distribution with broken
+    # metadata must not prevent the removal
+    try:
+        dependents = _get_dependents(projects)
+    except (PackagingError, IrrationalVersionError, ValueError), e:
+        logger.warning('Could not check the projects depending on the '
+                       'removed ones: %s', e)
+        return
+    if dependents:
+        logger.warning('These projects depend on the removed ones: %s',
+                       ', '.join(['%r %s' % (dist.name, dist.version)
+                                  for dist in dependents]))
+
+
+def _get_dependents(projects):
+    # the dependents of all the removed projects are found in one query,
+    # see DependencyGraph.get_dependents
+    names = set([normalize_name(name) for name in projects])
+    dists = list(get_distributions(use_egg_info=True))
+    removed = {}
+    for dist in dists:
+        name = normalize_name(dist.name)
+        if name in names and name not in removed:
+            removed[name] = dist
+    if not removed:
+        return []
+    graph = get_graph(dists, get_graph_path())
+    return graph.get_dependents(removed.values())
+
+
 @action_help("""\
 Usage: pysetup remove dist [-y]
    or: pysetup remove --help
@@ -234,8 +299,11 @@ def _remove(distpatcher, args, **kw):
     else:
         auto_confirm = False
 
+    projects = set(opts['args'])
+    _warn_dependents(projects)
+
     retcode = 0
-    for dist in set(opts['args']):
+    for dist in projects:
         try:
             remove(dist, auto_confirm=auto_confirm)
         except PackagingError:
@@ -296,12 +364,12 @@ positional arguments:
 """)
 def _list(dispatcher, args, **kw):
     opts = _parse_args(args[1:], '', [])
-    dists = get_distributions(use_egg_info=True)
     if opts['args']:
-        results = (d for d in dists if d.name.lower() in opts['args'])
+        results = (d for name in opts['args']
+                   for d in find_distributions(name, use_egg_info=True))
         listall = False
     else:
-        results = dists
+        results = get_distributions(use_egg_info=True)
         listall = True
 
     number = 0
@@ -319,6 +387,70 @@ def _list(dispatcher, args, **kw):
         logger.info('Found %d projects installed.', number)
 
 
+@action_help("""\
+Usage: pysetup verify [dist ...] [-j workers] [-i dir] [-a]
+   or: pysetup verify --help
+
+Check the installed files of distributions against the sizes and hashes
+recorded in their RECORD file.  One CSV line is printed for each problem
+found: name, version, path of the file and status (missing, bad-size or
+bad-hash).
+
+positional arguments:
+   dist  installed distribution name; omit to check all distributions
+
+optional arguments:
+   -j workers  number of files checked in parallel (default: 4)
+   -i dir      keep an index of installed distributions and of the hashes
+               of their files in dir; the next runs using the same dir
+               only hash the files whose size or modification time changed
+   -a          print a line for every file, with the ok status or the
+               unchecked one for files without recorded size and hash
+""")
+def _verify(dispatcher, args, **kw):
+    opts = _parse_args(args[1:], 'j:i:a', [])
+    workers = 4
+    if 'j' in opts:
+        try:
+            workers = int(opts['j'][-1])
+        except ValueError:
+            logger.warning('invalid number of workers: %r', opts['j'][-1])
+            return 1
+    if 'i' in opts:
+        try:
+            enable_index(opts['i'][-1])
+        except OSError, e:
+            logger.warning('cannot use the index: %s', e)
+            return 1
+
+    if opts['args']:
+        dists = []
+        for name in opts['args']:
+            found = list(find_distributions(name, use_egg_info=False))
+            if not found:
+                logger.warning('%r not installed', name)
+                return 1
+            dists.append(found[0])
+    else:
+        dists = None
+
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    problems = 0
+    for dist, path, status in verify_distributions(dists, workers):
+        if status not in (VERIFY_OK, VERIFY_UNCHECKED):
+            problems += 1
+        elif 'a' not in opts:
+            continue
+        writer.writerow([dist.name.encode('utf-8'),
+                         dist.version.encode('utf-8'), path, status])
+
+    if problems:
+        logger.warning('Found %d problems.', problems)
+        return 1
+    logger.info('All installed files are intact.')
+    return 0
+
+
 @action_help("""\
 Usage: pysetup search [project] [--simple [url]] [--xmlrpc [url] [--fieldname value ...] --operator or|and]
    or: pysetup search --help
@@ -361,6 +493,7 @@ actions = [
     ('remove', 'Remove a project', _remove),
     ('search', 'Search for a project in the indexes', _search),
     ('list', 'List installed projects', _list),
+    ('verify', 'Check the files of installed projects', _verify),
     ('graph', 'Display a graph', _graph),
     ('create', 'Create a project', _create),
     ('generate-setup', 'Generate a backward-compatible setup.py', _generate),
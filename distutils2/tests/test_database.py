@@ -1,26 +1,36 @@
 import os
 import csv
 import sys
+import time
 import tempfile
 try:
     from hashlib import md5
 except ImportError:
     from distutils2._backport.hashlib import md5
 from textwrap import dedent
+try:
+    import threading
+except ImportError:
+    threading = None
 
 from distutils2.tests.test_util import GlobTestCaseBase
 from distutils2.tests.support import requires_zlib
 
 import distutils2.database
 from distutils2.config import get_resources_dests
-from distutils2.errors import PackagingError
+from distutils2.errors import PackagingError, MetadataUnrecognizedVersionError
 from distutils2.metadata import Metadata
 from distutils2.tests import unittest, support
 from distutils2.database import (
     Distribution, EggInfoDistribution, get_distribution, get_distributions,
-    provides_distribution, obsoletes_distribution, get_file_users,
-    enable_cache, disable_cache, distinfo_dirname, _yield_distributions,
-    get_file, get_file_path)
+    find_distributions, provides_distribution, obsoletes_distribution,
+    get_file_users,
+    enable_cache, disable_cache, clear_cache, distinfo_dirname,
+    _yield_distributions, enable_index, disable_index, enable_parallel_scan,
+    disable_parallel_scan, verify_distributions, take_snapshot,
+    diff_snapshots, save_snapshot, load_snapshot, start_watcher, stop_watcher,
+    get_file, get_file_path, InstalledDatabase, get_databases,
+    VERIFY_OK, VERIFY_MISSING, VERIFY_SIZE, VERIFY_HASH, VERIFY_UNCHECKED)
 from distutils2._backport import shutil
 
 # TODO Add a test for getting a distribution provided by another distribution
@@ -96,6 +106,18 @@ class CommonDistributionTests(FakeDistsMixin):
         self.assertEqual(dist.version, version)
         self.assertEqual(dist.metadata['Version'], version)
 
+    @requires_zlib
+    def test_lazy_metadata(self):
+        name, version, distdir = self.sample_dist
+        dist = self.cls(self._get_dist_path(distdir))
+        self.assertEqual(dist.name, name)
+        self.assertEqual(dist.version, version)
+        # only the name and version were read
+        self.assertIsNone(dist._metadata)
+        metadata = dist.metadata
+        self.assertIsInstance(metadata, Metadata)
+        self.assertIs(dist.metadata, metadata)
+
     @requires_zlib
     def test_repr(self):
         dist = self.cls(self.dirs[0])
@@ -188,6 +210,69 @@ class TestDistribution(CommonDistributionTests, unittest.TestCase):
         super(TestDistribution, self).test_instantiation()
         self.assertIsInstance(self.dist.requested, bool)
 
+    def test_lazy_metadata_name(self):
+        # the name comes from METADATA, not from the escaped directory name
+        distinfo_dir = os.path.join(self.fake_dists_path,
+                                    'towel_stuff-0.1.dist-info')
+        dist = Distribution(distinfo_dir)
+        self.assertEqual(dist.name, 'towel-stuff')
+        self.assertIsNone(dist._metadata)
+
+        # fields that are not needed are not even parsed
+        distinfo_dir = os.path.join(self.fake_dists_path,
+                                    'choxie-2.0.0.9.dist-info')
+        fp = open(os.path.join(distinfo_dir, 'METADATA'), 'w')
+        try:
+            fp.write('Metadata-Version: 9.9\nName: choxie\nVersion: 2.1\n')
+        finally:
+            fp.close()
+        dist = Distribution(distinfo_dir)
+        self.assertEqual((dist.name, dist.version), ('choxie', '2.1'))
+        self.assertRaises(MetadataUnrecognizedVersionError, getattr, dist,
+                          'metadata')
+
+    def test_compact_layout(self):
+        distinfo_dir = os.path.join(self.fake_dists_path,
+                                    'choxie-2.0.0.9.dist-info')
+        fp = open(os.path.join(distinfo_dir, 'METADATA'), 'w')
+        try:
+            fp.write('Metadata-Version: 1.2\nName: choxie\nVersion: 1.0\n'
+                     'Description: A long\n       |description\n')
+        finally:
+            fp.close()
+        dist = Distribution(distinfo_dir)
+        grammar = Distribution(os.path.join(self.fake_dists_path,
+                                            'grammar-1.0a4.dist-info'))
+        self.assertRaises(AttributeError, setattr, dist, 'spam', 1)
+
+        # empty fields and the description are not kept in memory
+        metadata = dist.metadata
+        self.assertNotIn('Provides-Dist', metadata._fields)
+        self.assertEqual(metadata['Provides-Dist'], [])
+        self.assertNotIn('Description', metadata._fields)
+        self.assertEqual(metadata['Description'], 'A long\ndescription')
+        self.assertIn('Description', metadata._fields)
+        self.assertEqual(metadata['Requires-Dist'], [])
+        self.assertEqual(grammar.metadata['Requires-Dist'],
+                         ['truffles (>=1.2)'])
+
+        # a description set explicitly is not overwritten
+        grammar.metadata['Description'] = 'new'
+        self.assertEqual(grammar.metadata['Description'], 'new')
+
+        # strings are shared between distributions
+        other = Distribution(os.path.join(self.fake_dists_path,
+                                          'babar-0.1.dist-info'))
+        distinfo_dir = os.path.join(self.fake_dists_path,
+                                    'towel_stuff-0.1.dist-info')
+        fp = open(os.path.join(distinfo_dir, 'METADATA'), 'w')
+        try:
+            fp.write('Metadata-Version: 1.2\nName: towel-stuff\n'
+                     'Version: 0.1\n')
+        finally:
+            fp.close()
+        self.assertIs(Distribution(distinfo_dir).version, other.version)
+
     def test_uses(self):
         # Test to determine if a distribution uses a specified file.
         # Criteria to test against
@@ -272,6 +357,45 @@ class TestDistribution(CommonDistributionTests, unittest.TestCase):
         self.assertEqual(resource_path, 'babar.png')
         self.assertRaises(KeyError, dist.get_resource_path, 'notexist')
 
+    def test_records_cached(self):
+        distinfo_dir = os.path.join(self.fake_dists_path,
+                                    'grammar-1.0a4.dist-info')
+        dist = Distribution(distinfo_dir)
+
+        def write(name, content, mtime):
+            path = os.path.join(distinfo_dir, name)
+            fp = open(path, 'w')
+            try:
+                fp.write(content)
+            finally:
+                fp.close()
+            os.utime(path, (mtime, mtime))
+
+        write('RECORD', 'a.py,,\nb.py,,\n', 1000000000)
+        write('RESOURCES', 'a.png,x/a.png\n', 1000000000)
+        self.assertEqual(list(dist.list_installed_files()),
+                         [('a.py', '', ''), ('b.py', '', '')])
+        self.assertEqual(dist.get_resource_path('a.png'), 'x/a.png')
+        self.assertTrue(dist.uses('b.py'))
+
+        # the files are not parsed again while they are unchanged
+        write('RECORD', 'c.py,,\nd.py,,\n', 1000000000)
+        write('RESOURCES', 'a.png,y/a.png\n', 1000000000)
+        self.assertEqual([path for path, md5_, size
+                          in dist.list_installed_files()], ['a.py', 'b.py'])
+        self.assertEqual(dist.get_resource_path('a.png'), 'x/a.png')
+
+        write('RECORD', 'c.py,,\nd.py,,\n', 1000000010)
+        write('RESOURCES', 'a.png,y/a.png\n', 1000000010)
+        self.assertEqual([path for path, md5_, size
+                          in dist.list_installed_files()], ['c.py', 'd.py'])
+        self.assertFalse(dist.uses('b.py'))
+        self.assertEqual(dist.get_resource_path('a.png'), 'y/a.png')
+
+        # a removed file is noticed too
+        os.remove(os.path.join(distinfo_dir, 'RECORD'))
+        self.assertRaises(IOError, list, dist.list_installed_files())
+
 
 class TestEggInfoDistribution(CommonDistributionTests,
                               support.LoggingCatcher,
@@ -419,6 +543,265 @@ class TestDatabase(support.LoggingCatcher,
         self.assertIsInstance(dist, EggInfoDistribution)
         self.assertEqual(dist.name, 'strawberry')
 
+    def test_verify_distributions(self):
+        self.addCleanup(clear_cache)
+        distinfo = self._make_distinfo(self.fake_dists_path, 'spam', '1.0')
+        files = {}
+        for name in ('ok.py', 'missing.py', 'size.py', 'hash.py'):
+            path = files[name] = os.path.join(self.fake_dists_path, name)
+            fp = open(path, 'w')
+            try:
+                fp.write('# %s\n' % name)
+            finally:
+                fp.close()
+        record = os.path.join(distinfo, 'RECORD')
+        fp = open(record, 'w')
+        try:
+            writer = csv.writer(fp, lineterminator='\n')
+            for name in sorted(files):
+                writer.writerow((files[name], get_hexdigest(files[name]),
+                                 os.path.getsize(files[name])))
+            writer.writerow((record, '', ''))
+        finally:
+            fp.close()
+
+        os.remove(files['missing.py'])
+        fp = open(files['size.py'], 'a')
+        try:
+            fp.write('# more\n')
+        finally:
+            fp.close()
+        fp = open(files['hash.py'], 'w')
+        try:
+            fp.write('# HASH.PY\n')
+        finally:
+            fp.close()
+
+        os.utime(files['ok.py'], (1000000000, 1000000000))
+        dist = get_distribution('spam')
+        expected = [
+            (dist, files['hash.py'], VERIFY_HASH),
+            (dist, files['missing.py'], VERIFY_MISSING),
+            (dist, files['ok.py'], VERIFY_OK),
+            (dist, files['size.py'], VERIFY_SIZE),
+            (dist, record, VERIFY_UNCHECKED)]
+        for workers in (1, 4):
+            self.assertEqual(verify_distributions([dist], workers), expected)
+
+        # all .dist-info distributions are checked by default
+        results = verify_distributions(paths=[self.fake_dists_path])
+        self.assertIn(expected[0], results)
+        self.assertEqual(set(type(dist) for dist, path, status in results),
+                         set([Distribution]))
+
+        # hashes are not computed again for files that did not change
+        fp = open(files['ok.py'], 'w')
+        try:
+            fp.write('# OK.PY\n')
+        finally:
+            fp.close()
+        os.utime(files['ok.py'], (1000000000, 1000000000))
+        self.assertIn((dist, files['ok.py'], VERIFY_OK),
+                      verify_distributions([dist]))
+        clear_cache()
+        self.assertIn((dist, files['ok.py'], VERIFY_HASH),
+                      verify_distributions([dist]))
+
+        # the memory cache is bounded
+        old_max = distutils2.database._MAX_HASHES
+        distutils2.database._MAX_HASHES = 1
+        try:
+            clear_cache()
+            verify_distributions([dist])
+            self.assertEqual(len(distutils2.database._file_hashes), 1)
+        finally:
+            distutils2.database._MAX_HASHES = old_max
+
+        # with the on-disk index, the hashes are reused by other processes
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        self.addCleanup(disable_index)
+        enable_index(index_dir)
+        fp = open(files['ok.py'], 'w')
+        try:
+            fp.write('# ok.py\n')
+        finally:
+            fp.close()
+        os.utime(files['ok.py'], (1000000000, 1000000000))
+        self.assertEqual(verify_distributions([dist]), expected)
+        clear_cache()
+        fp = open(files['ok.py'], 'w')
+        try:
+            fp.write('# OK.PY\n')
+        finally:
+            fp.close()
+        os.utime(files['ok.py'], (1000000000, 1000000000))
+        self.assertEqual(verify_distributions([dist]), expected)
+        self.assertEqual(distutils2.database._file_hashes, {})
+
+    def test_snapshots(self):
+        paths = [self.fake_dists_path]
+        grammar = os.path.join(self.fake_dists_path, 'grammar-1.0a4.dist-info')
+        self._write_record(grammar, 'grammar/__init__.py,abc,10\n',
+                           1000000000)
+        snapshot = take_snapshot(paths=paths)
+        self.assertEqual(snapshot['grammar'][:2], ('1.0a4', grammar))
+        self.assertEqual(snapshot['grammar'][3],
+                         (('grammar/__init__.py', 'abc', '10'),))
+        self.assertEqual(snapshot['bacon'][2:], (None, ()))
+        self.assertEqual(diff_snapshots(snapshot, paths=paths),
+                         {'added': [], 'removed': [], 'changed': [],
+                          'modified': []})
+
+        filename = os.path.join(self.fake_dists_path, 'snapshot')
+        save_snapshot(snapshot, filename)
+        self.assertEqual(load_snapshot(filename), snapshot)
+        fp = open(filename, 'wb')
+        try:
+            fp.write('garbage')
+        finally:
+            fp.close()
+        self.assertRaises(PackagingError, load_snapshot, filename)
+
+        self._make_distinfo(self.fake_dists_path, 'spam', '1.0')
+        shutil.rmtree(os.path.join(self.fake_dists_path,
+                                   'choxie-2.0.0.9.dist-info'))
+        fp = open(os.path.join(self.fake_dists_path,
+                               'towel_stuff-0.1.dist-info', 'METADATA'), 'w')
+        try:
+            fp.write('Metadata-Version: 1.2\nName: towel-stuff\n'
+                     'Version: 0.2\n')
+        finally:
+            fp.close()
+        self._write_record(grammar, 'grammar/__init__.py,abc,10\n'
+                                    'grammar/utils.py,def,20\n', 1000000010)
+        expected = {'added': [('spam', '1.0')],
+                    'removed': [('choxie', '2.0.0.9')],
+                    'changed': [('towel-stuff', '0.1', '0.2')],
+                    'modified': [('grammar', '1.0a4', ['grammar/utils.py'])]}
+        self.assertEqual(diff_snapshots(snapshot, paths=paths), expected)
+        self.assertEqual(diff_snapshots(snapshot, take_snapshot(paths=paths)),
+                         expected)
+
+        # RECORD files that did not change are not read again
+        version, path, key, records = snapshot['grammar']
+        snapshot['grammar'] = version, path, key, ()
+        self._write_record(grammar, 'grammar/__init__.py,abc,10\n',
+                           1000000000)
+        self.assertEqual(diff_snapshots(snapshot, paths=paths)['modified'],
+                         [])
+
+    def _write_record(self, distinfo, content, mtime):
+        path = os.path.join(distinfo, 'RECORD')
+        fp = open(path, 'w')
+        try:
+            fp.write(content)
+        finally:
+            fp.close()
+        os.utime(path, (mtime, mtime))
+
+    @unittest.skipIf(threading is None, 'needs threading')
+    def test_watcher(self):
+        self.addCleanup(clear_cache)
+        self.addCleanup(stop_watcher)
+        enable_cache()
+        paths = [self.fake_dists_path]
+        self.assertIsNone(get_distribution('spam', paths=paths))
+        start_watcher(0.01, use_inotify=False)
+
+        # the watcher notices new distributions by itself
+        self._make_distinfo(self.fake_dists_path, 'spam', '1.0')
+        entry = distutils2.database._cache_entries[self.fake_dists_path]
+        for i in range(500):
+            if 'spam' in entry.names:
+                break
+            time.sleep(0.01)
+        self.assertIn('spam', entry.names)
+
+        # queries do not check the watched entries anymore
+        calls = []
+        old_get_mtime = distutils2.database._get_mtime
+
+        def _get_mtime(realpath):
+            calls.append(realpath)
+            return old_get_mtime(realpath)
+
+        distutils2.database._get_mtime = _get_mtime
+        try:
+            self.assertIsNotNone(get_distribution('spam', paths=paths))
+            self.assertEqual(calls, [])
+            stop_watcher()
+            self.assertIsNotNone(get_distribution('spam', paths=paths))
+            self.assertEqual(calls, [self.fake_dists_path])
+        finally:
+            distutils2.database._get_mtime = old_get_mtime
+
+    @requires_zlib
+    def test_zipped_egg(self):
+        import zipfile
+        self.addCleanup(clear_cache)
+        path = os.path.join(self.fake_dists_path, 'spam-1.0-py2.7.egg')
+        zf = zipfile.ZipFile(path, 'w')
+        try:
+            zf.writestr('EGG-INFO/PKG-INFO', 'Metadata-Version: 1.0\n'
+                        'Name: spam\nVersion: 1.0\n')
+            zf.writestr('EGG-INFO/requires.txt', 'bacon>=0.1\neggs\n')
+            zf.writestr('spam/__init__.py', '')
+        finally:
+            zf.close()
+        module = os.path.join(path, 'spam', '__init__.py')
+
+        dist = EggInfoDistribution(path)
+        self.assertEqual(dist.metadata['Requires-Dist'],
+                         ['bacon (>=0.1)', 'eggs'])
+        self.assertTrue(dist.uses(module))
+        self.assertTrue(dist.uses(path))
+        self.assertFalse(dist.uses(os.path.join(path, 'spam', 'other.py')))
+        self.assertEqual(list(get_file_users(module)), [])
+        self.assertEqual(list(get_file_users(module, use_egg_info=True)),
+                         [dist])
+
+        # the archive is not read again while it is unchanged
+        def _fail(*args):
+            raise AssertionError('zip file read again')
+
+        old_zipfile = distutils2.database.zipfile.ZipFile
+        distutils2.database.zipfile.ZipFile = _fail
+        try:
+            other = EggInfoDistribution(path)
+            self.assertEqual(other.metadata['Name'], 'spam')
+            self.assertTrue(other.uses(module))
+            enable_cache()
+            self.assertEqual(list(get_file_users(module, use_egg_info=True)),
+                             [other])
+        finally:
+            distutils2.database.zipfile.ZipFile = old_zipfile
+
+    def test_find_distributions(self):
+        # a dist-info distribution with the same normalized name as an
+        # egg-info one comes first
+        distinfo = self._make_distinfo(self.fake_dists_path, 'Bacon', '0.3')
+        for cached in (False, True):
+            if cached:
+                self.addCleanup(clear_cache)
+                enable_cache()
+            l = [dist.name for dist in find_distributions('TOWEL_stuff')]
+            self.assertEqual(l, ['towel-stuff'])
+            l = [(dist.name, dist.version)
+                 for dist in find_distributions('bacon')]
+            self.assertEqual(l, [('Bacon', '0.3'), ('bacon', '0.1')])
+            l = [dist.name for dist in find_distributions(
+                'bacon', use_egg_info=False)]
+            self.assertEqual(l, ['Bacon'])
+            self.assertEqual(list(find_distributions('towel')), [])
+
+        # the index follows changes of the directory
+        shutil.rmtree(distinfo)
+        mtime = os.stat(self.fake_dists_path).st_mtime
+        os.utime(self.fake_dists_path, (mtime + 20, mtime + 20))
+        l = [dist.name for dist in find_distributions('Bacon')]
+        self.assertEqual(l, ['bacon'])
+
     def test_get_file_users(self):
         # Test the iteration of distributions that use a file.
         name = 'towel_stuff-0.1'
@@ -428,6 +811,68 @@ class TestDatabase(support.LoggingCatcher,
             self.assertIsInstance(dist, Distribution)
             self.assertEqual(dist.name, name)
 
+    def test_get_file_users_cached(self):
+        self.addCleanup(clear_cache)
+        enable_cache()
+        paths = [self.fake_dists_path]
+        path = os.path.join(self.fake_dists_path, 'grammar-1.0a4', 'grammar',
+                            'utils.py')
+        record = os.path.join(self.fake_dists_path, 'grammar-1.0a4.dist-info',
+                              'RECORD')
+        fp = open(record, 'w')
+        try:
+            fp.write('%s,,\n' % path)
+        finally:
+            fp.close()
+
+        dists = list(get_file_users(path, paths=paths))
+        self.assertEqual([dist.name for dist in dists], ['grammar'])
+        # paths are normalized before the lookup
+        messy_path = os.path.join(self.fake_dists_path, 'grammar-1.0a4',
+                                  'grammar', os.pardir, 'grammar', 'utils.py')
+        self.assertEqual(list(get_file_users(messy_path, paths=paths)),
+                         dists)
+        self.assertEqual(list(get_file_users('bogus.py', paths=paths)), [])
+
+        # the index is not built again while nothing changed
+        calls = []
+        old_get_records = Distribution._get_records
+
+        def _get_records(dist, local=False):
+            calls.append(dist)
+            return old_get_records(dist, local)
+
+        Distribution._get_records = _get_records
+        try:
+            for i in range(2):
+                self.assertEqual(list(get_file_users(path, paths=paths)),
+                                 dists)
+        finally:
+            Distribution._get_records = old_get_records
+        self.assertEqual(calls, [])
+
+        # a RECORD rewritten in place is seen once it is read again
+        distinfo = os.path.dirname(record)
+        self._write_record(distinfo, 'other.py,,\n', 1000000000)
+        list(dists[0].list_installed_files())
+        self.assertEqual(list(get_file_users(path, paths=paths)), [])
+        # or once the entry is scanned again
+        self._write_record(distinfo, '%s,,\n' % path, 1000000001)
+        mtime = os.stat(self.fake_dists_path).st_mtime
+        os.utime(self.fake_dists_path, (mtime + 10, mtime + 10))
+        self.assertEqual(list(get_file_users(path, paths=paths)), dists)
+
+        # a new distribution claiming the same file is found
+        distinfo = self._make_distinfo(self.fake_dists_path, 'grammar2', '1.0')
+        fp = open(os.path.join(distinfo, 'RECORD'), 'w')
+        try:
+            fp.write('%s,,\n' % path)
+        finally:
+            fp.close()
+        self.assertEqual(sorted(dist.name for dist in
+                                get_file_users(path, paths=paths)),
+                         ['grammar', 'grammar2'])
+
     @requires_zlib
     def test_provides(self):
         # Test for looking up distributions by what they provide
@@ -537,6 +982,24 @@ class TestDatabase(support.LoggingCatcher,
                                                           use_egg_info=False)]
         checkLists(l, ['towel-stuff'])
 
+    @requires_zlib
+    def test_provides_obsoletes_cached(self):
+        self.addCleanup(clear_cache)
+        enable_cache()
+        self.test_provides()
+        self.test_obsoletes()
+
+        # the index and the parsed predicates are kept between calls
+        entry = distutils2.database._cache_entries[self.fake_dists_path]
+        relations = entry._relations
+        relation = entry.get_relations(distutils2.database._OBSOLETES,
+                                       'truffles')[0]
+        predicate = relation.get_predicate()
+        l = [dist.name for dist in obsoletes_distribution('truffles', '0.8')]
+        self.assertEqual(sorted(l), ['cheese', 'choxie'])
+        self.assertIs(entry._relations, relations)
+        self.assertIs(relation.get_predicate(), predicate)
+
     @requires_zlib
     def test_yield_distribution(self):
         # tests the internal function _yield_distributions
@@ -565,6 +1028,292 @@ class TestDatabase(support.LoggingCatcher,
                  if dist.path.startswith(self.fake_dists_path)]
         checkLists(dists + eggs, found)
 
+    def _make_distinfo(self, site_packages, name, version):
+        distinfo = os.path.join(site_packages,
+                                distinfo_dirname(name, version))
+        os.mkdir(distinfo)
+        fp = open(os.path.join(distinfo, 'METADATA'), 'w')
+        try:
+            fp.write('Metadata-Version: 1.2\nName: %s\nVersion: %s\n' %
+                     (name, version))
+        finally:
+            fp.close()
+        # make sure the change is seen even with coarse timestamps
+        mtime = os.stat(site_packages).st_mtime
+        os.utime(site_packages, (mtime + 10, mtime + 10))
+        return distinfo
+
+    def _write_spam_metadata(self, path, description):
+        fp = open(path, 'w')
+        try:
+            fp.write('Metadata-Version: 1.2\nName: spam\nVersion: 1.0\n'
+                     'Keywords: spam\nRequires-Dist: bacon\n'
+                     'Description: %s\n' % description)
+        finally:
+            fp.close()
+
+    def test_databases(self):
+        # the cache is disabled by setUp, databases cache anyway
+        self.addCleanup(clear_cache)
+        envs = []
+        for i in range(2):
+            env = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, env)
+            envs.append(env)
+        metadata_files = []
+        for env in envs:
+            distinfo = self._make_distinfo(env, 'spam', '1.0')
+            metadata_files.append(os.path.join(distinfo, 'METADATA'))
+            self._write_spam_metadata(metadata_files[-1], 'Spam.')
+        self._make_distinfo(envs[1], 'ham', '2.0')
+        shared = self.fake_dists_path
+
+        first, second = get_databases([[envs[0], shared], [envs[1], shared]])
+        self.assertEqual(first.paths, [envs[0], shared])
+        self.assertEqual(first.get_distribution('spam').path,
+                         os.path.join(envs[0], 'spam-1.0.dist-info'))
+        self.assertIs(first.get_distribution('ham'), None)
+        self.assertEqual(second.get_distribution('ham').version, '2.0')
+        self.assertEqual([dist.name for dist in second.find_distributions(
+                          'Towel_Stuff')], ['towel-stuff'])
+        for name in ('provides_distribution', 'obsoletes_distribution'):
+            found = getattr(first, name)('truffles', '1.0')
+            expected = getattr(distutils2.database, name)(
+                'truffles', '1.0', paths=[envs[0], shared])
+            self.assertEqual(list(found), list(expected))
+        self.assertTrue(list(first.provides_distribution('truffles')))
+
+        # the shared entry is scanned once and its distributions are cached
+        names = [dist.name for dist in first.get_distributions()]
+        self.assertIn('grammar', names)
+        self.assertIn('bacon', names)
+        grammar = first.get_distribution('grammar')
+        self.assertIs(second.get_distribution('grammar'), grammar)
+        self.assertIs(InstalledDatabase([shared]).get_distribution('grammar'),
+                      grammar)
+
+        # identical metadata files are parsed once
+        spam1 = first.get_distribution('spam')
+        spam2 = second.get_distribution('spam')
+        self.assertIsNot(spam1, spam2)
+        self.assertIs(spam1.metadata._fields, spam2.metadata._fields)
+        # the lists of values are not shared
+        for name, value in (('Keywords', 'spam'), ('Requires-Dist', 'bacon')):
+            spam1.metadata[name].append('eggs')
+            self.assertEqual(spam1.metadata[name], [value])
+            self.assertEqual(spam2.metadata[name], [value])
+        self.assertIs(spam1.metadata._fields, spam2.metadata._fields)
+        self.assertIsNot(second.get_distribution('ham').metadata._fields,
+                         spam2.metadata._fields)
+        # but each distribution reads its own description
+        self._write_spam_metadata(metadata_files[0], 'Changed.')
+        self.assertEqual(spam1.metadata['Description'], 'Changed.')
+        self.assertEqual(spam2.metadata['Description'], 'Spam.')
+        # and changes are not seen by the other distributions
+        spam1.metadata['Summary'] = 'Changed.'
+        self.assertEqual(spam2.metadata['Summary'], 'UNKNOWN')
+        # outside of databases, metadata is not shared
+        self.assertIsNot(Distribution(spam2.path).metadata._fields,
+                         spam2.metadata._fields)
+
+        # changes are seen by the next call
+        self._make_distinfo(envs[0], 'eggs', '0.1')
+        self.assertEqual(first.get_distribution('eggs').version, '0.1')
+        self.assertIs(second.get_distribution('eggs'), None)
+
+        snapshot = first.take_snapshot()
+        self.assertEqual(snapshot['spam'][:2],
+                         ('1.0', os.path.join(envs[0], 'spam-1.0.dist-info')))
+        self.assertEqual(first.diff_snapshot(snapshot)['added'], [])
+        shutil.rmtree(os.path.join(envs[0], 'eggs-0.1.dist-info'))
+        self.assertEqual(first.diff_snapshot(snapshot)['removed'],
+                         [('eggs', '0.1')])
+
+    def test_cache_per_path_entry(self):
+        self.addCleanup(clear_cache)
+        enable_cache()
+        other_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_path)
+        self._make_distinfo(other_path, 'choxie', '3.0')
+        paths = [self.fake_dists_path]
+        other_paths = [other_path]
+
+        # each set of paths gets its own results
+        self.assertEqual(get_distribution('choxie', paths=paths).version,
+                         '2.0.0.9')
+        self.assertEqual(get_distribution('choxie', paths=other_paths).version,
+                         '3.0')
+        self.assertIsNone(get_distribution('grammar', paths=other_paths))
+        # the first path entry wins
+        self.assertEqual(get_distribution(
+            'choxie', paths=other_paths + paths).version, '3.0')
+        self.assertEqual(get_distribution(
+            'choxie', paths=paths + other_paths).version, '2.0.0.9')
+
+        # only the changed entry is scanned again, and the distributions
+        # that are still present are reused
+        choxie = get_distribution('choxie', paths=paths)
+        other_choxie = get_distribution('choxie', paths=other_paths)
+        self._make_distinfo(other_path, 'bacon', '1.0')
+        self.assertEqual(get_distribution('bacon', paths=other_paths,
+                                          use_egg_info=False).version, '1.0')
+        self.assertIs(get_distribution('choxie', paths=other_paths),
+                      other_choxie)
+        self.assertIs(get_distribution('choxie', paths=paths), choxie)
+
+        # removed distributions disappear
+        shutil.rmtree(os.path.join(other_path, 'bacon-1.0.dist-info'))
+        mtime = os.stat(other_path).st_mtime
+        os.utime(other_path, (mtime + 10, mtime + 10))
+        self.assertIsNone(get_distribution('bacon', paths=other_paths,
+                                           use_egg_info=False))
+
+        # clearing one entry does not touch the others
+        clear_cache(other_paths)
+        self.assertIs(get_distribution('choxie', paths=paths), choxie)
+        self.assertIsNot(get_distribution('choxie', paths=other_paths),
+                         other_choxie)
+
+    @requires_zlib
+    def test_index(self):
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        self.addCleanup(disable_index)
+        enable_index(index_dir)
+        paths = [self.fake_dists_path]
+
+        dists = list(get_distributions(paths=paths))
+        expected = sorted((dist.name, dist.version, dist.path)
+                          for dist in dists)
+        # one index file for the directory, one for the zipped egg
+        self.assertEqual(len(os.listdir(index_dir)), 2)
+        # indexing does not read the whole metadata files
+        for dist in dists:
+            self.assertIsNone(dist._metadata)
+
+        # the other indexed fields are written once they are needed
+        self.addCleanup(clear_cache)
+        enable_cache()
+        self.assertEqual(len(list(provides_distribution(
+                          'truffles', '1.0', paths=paths))), 2)
+        clear_cache()
+        disable_cache()
+
+        # the metadata files are not read again while the index is valid
+        metadata_path = os.path.join(self.fake_dists_path,
+                                     'choxie-2.0.0.9.dist-info', 'METADATA')
+        os.remove(metadata_path)
+        dists = list(get_distributions(paths=paths))
+        self.assertEqual(sorted((dist.name, dist.version, dist.path)
+                                for dist in dists), expected)
+        for dist in dists:
+            self.assertIsNone(dist._metadata)
+
+        # provides and obsoletes are answered from the index too
+        l = [dist.name for dist in provides_distribution('truffles', '1.0',
+                                                         use_egg_info=False)]
+        self.assertEqual(l, ['choxie'])
+        l = [dist.name for dist in obsoletes_distribution('truffles', '0.2',
+                                                          use_egg_info=False)]
+        self.assertEqual(l, ['towel-stuff'])
+
+        # other fields are loaded on demand
+        grammar = get_distribution('grammar', paths=paths)
+        self.assertEqual(grammar.metadata['Summary'], grammar.metadata.get(
+            'Summary'))
+        self.assertIsNotNone(grammar._metadata)
+
+        # changing the directory invalidates the index
+        shutil.rmtree(os.path.join(self.fake_dists_path,
+                                   'choxie-2.0.0.9.dist-info'))
+        mtime = os.stat(self.fake_dists_path).st_mtime
+        os.utime(self.fake_dists_path, (mtime + 10, mtime + 10))
+        self.assertIsNone(get_distribution('choxie', paths=paths))
+        self.assertIsNotNone(get_distribution('grammar', paths=paths))
+
+        # once disabled, the index is neither used nor written anymore
+        disable_index()
+        shutil.rmtree(index_dir)
+        os.mkdir(index_dir)
+        self.assertIsNone(get_distribution('choxie', paths=paths))
+        self.assertEqual(os.listdir(index_dir), [])
+
+    def test_index_unparsable_metadata(self):
+        # the index is written without parsing the whole metadata files
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        self.addCleanup(disable_index)
+        enable_index(index_dir)
+        distinfo = self._make_distinfo(self.fake_dists_path, 'future', '1.0')
+        fp = open(os.path.join(distinfo, 'METADATA'), 'w')
+        try:
+            fp.write('Metadata-Version: 2.0\nName: future\nVersion: 1.0\n')
+        finally:
+            fp.close()
+        paths = [self.fake_dists_path]
+        self.assertEqual(get_distribution('future', paths=paths).version,
+                         '1.0')
+        self.assertEqual(get_distribution('future', paths=paths).path,
+                         distinfo)
+
+    def test_index_without_eggs(self):
+        # enabling the index does not make every scan look for eggs
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        self.addCleanup(disable_index)
+        enable_index(index_dir)
+        paths = [self.fake_dists_path]
+
+        names = sorted(dist.name for dist in get_distributions(False, paths))
+        self.assertNotIn('bacon', names)
+        realpath = os.path.realpath(self.fake_dists_path)
+        mtime = os.stat(realpath).st_mtime
+        has_eggs = distutils2.database._read_index(realpath, mtime)[0]
+        self.assertFalse(has_eggs)
+        # a query needing the eggs rescans the entry and rewrites the index
+        self.assertIsNotNone(get_distribution('bacon', use_egg_info=True,
+                                              paths=paths))
+        self.assertTrue(distutils2.database._read_index(realpath, mtime)[0])
+        self.assertEqual(sorted(dist.name for dist in
+                                get_distributions(False, paths)), names)
+
+    def test_parallel_scan(self):
+        # the same distribution is installed in two entries: the first one
+        # on the path must win, whatever the order the threads finish in
+        other_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_path)
+        self._make_distinfo(other_path, 'grammar', '2.0')
+        self._make_distinfo(other_path, 'frobnicate', '1.0')
+        paths = [self.fake_dists_path, other_path]
+
+        def scan():
+            return [(dist.name, dist.version, dist.path)
+                    for dist in get_distributions(True, paths)]
+
+        expected = scan()
+        grammar = get_distribution('grammar', paths=paths)
+        self.assertEqual(grammar.version, '1.0a4')
+
+        self.addCleanup(disable_parallel_scan)
+        self.assertRaises(ValueError, enable_parallel_scan, 0)
+        enable_parallel_scan(4)
+        self.assertEqual(scan(), expected)
+        self.assertEqual(get_distribution('grammar', paths=paths).path,
+                         grammar.path)
+        self.assertEqual(get_distribution('frobnicate', paths=paths).path,
+                         os.path.join(other_path, 'frobnicate-1.0.dist-info'))
+
+        self.addCleanup(clear_cache)
+        enable_cache()
+        cached = scan()
+        self.assertEqual(sorted(cached), sorted(expected))
+        self.assertEqual(get_distribution('grammar', paths=paths).path,
+                         grammar.path)
+
+        disable_parallel_scan()
+        clear_cache()
+        self.assertEqual(scan(), cached)
+
 
 class DataFilesTestCase(GlobTestCaseBase):
 
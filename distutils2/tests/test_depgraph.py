@@ -11,7 +11,18 @@ from distutils2.tests import unittest, support
 from distutils2.tests.support import requires_zlib
 
 
+class FakeDistribution(object):
+
+    def __init__(self, name, version, requires=(), provides=()):
+        self.name = name
+        self.version = version
+        self.path = '/fake/%s-%s.dist-info' % (name, version)
+        self.metadata = {'Provides-Dist': list(provides), 'Provides': [],
+                         'Requires-Dist': list(requires), 'Requires': []}
+
+
 class DepGraphTestCase(support.LoggingCatcher,
+                       support.TempdirManager,
                        unittest.TestCase):
 
     DISTROS_DIST = ('choxie', 'grammar', 'towel-stuff')
@@ -25,6 +36,24 @@ class DepGraphTestCase(support.LoggingCatcher,
         """ Compare two lists without taking the order into consideration """
         self.assertListEqual(sorted(l1), sorted(l2))
 
+    def checkGraphs(self, graph, expected):
+        """ Compare two graphs without taking the order into consideration """
+        for attr in ('adjacency_list', 'reverse_list', 'missing'):
+            lists = getattr(graph, attr)
+            expected_lists = getattr(expected, attr)
+            self.checkLists(lists.keys(), expected_lists.keys())
+            for dist in lists:
+                self.checkLists(lists[dist], expected_lists[dist])
+
+    def fake_dists(self):
+        return [
+            FakeDistribution('bacon', '0.1'),
+            FakeDistribution('towel-stuff', '0.1', ['bacon (<=0.2)']),
+            FakeDistribution('choxie', '2.0', ['towel-stuff (0.1)', 'nut']),
+            FakeDistribution('grammar', '1.0', ['truffles (>=1.2)']),
+            FakeDistribution('truffles', '1.5', provides=['nut (1.0)']),
+            FakeDistribution('bacon', '0.2', ['nut (>=1.0)'])]
+
     def setUp(self):
         super(DepGraphTestCase, self).setUp()
         path = os.path.join(os.path.dirname(__file__), 'fake_dists')
@@ -102,6 +131,179 @@ class DepGraphTestCase(support.LoggingCatcher,
         self.checkLists([], deps)
         self.checkLists(graph.missing[cheese], [])
 
+    def test_generate_graph_provides(self):
+        towel = FakeDistribution('towel-stuff', '0.1',
+                                 provides=['towels', 'bathroom (1.0)',
+                                           'garden (rc1)'])
+        choxie = FakeDistribution('choxie', '2.0', requires=[
+            'Towel_Stuff (>=0.1)', 'towels (>=2.0)', 'bathroom (<2.0)',
+            'garden', 'garden (>=1.0)', 'bathroom (<2.0)'])
+        graph = depgraph.generate_graph([towel, choxie])
+
+        # names are normalized and versionless provides match any version
+        self.assertEqual(graph.adjacency_list[choxie], [
+            (towel, 'Towel_Stuff (>=0.1)'), (towel, 'towels (>=2.0)'),
+            (towel, 'bathroom (<2.0)'), (towel, 'bathroom (<2.0)')])
+        # the edges are only listed once in reverse_list
+        self.assertEqual(graph.reverse_list[towel], [choxie])
+        # irrational versions never match
+        self.assertEqual(graph.missing[choxie], ['garden', 'garden (>=1.0)'])
+
+    def test_insert_remove_distribution(self):
+        dists = self.fake_dists()
+        graph = depgraph.generate_graph(dists[:3])
+        for dist in dists[3:]:
+            graph.insert_distribution(dist)
+        self.checkGraphs(graph, depgraph.generate_graph(dists))
+        self.assertRaises(ValueError, graph.insert_distribution, dists[0])
+
+        # towel-stuff now depends on the second bacon, choxie on nothing
+        bacon, towel, choxie, grammar, truffles, bacon2 = dists
+        graph.remove_distribution(bacon)
+        self.assertEqual(graph.adjacency_list[towel],
+                         [(bacon2, 'bacon (<=0.2)')])
+        graph.remove_distribution(truffles)
+        self.checkLists(graph.missing[choxie], ['nut'])
+        self.checkLists(graph.missing[grammar], ['truffles (>=1.2)'])
+        self.checkGraphs(graph, depgraph.generate_graph(
+            [towel, choxie, grammar, bacon2]))
+
+        graph.insert_distribution(truffles)
+        graph.insert_distribution(bacon)
+        self.checkGraphs(graph, depgraph.generate_graph(
+            [towel, choxie, grammar, bacon2, truffles, bacon]))
+
+    def test_save_load_graph(self):
+        dists = self.fake_dists()
+        path = os.path.join(self.mkdtemp(), 'depgraph.csv')
+        graph = depgraph.generate_graph(dists[:5])
+        depgraph.save_graph(graph, path)
+        self.checkGraphs(depgraph.load_graph(path, dists[:5]), graph)
+
+        # the graph is updated to the given distributions
+        current = dists[1:]
+        self.checkGraphs(depgraph.load_graph(path, current),
+                         depgraph.generate_graph(current))
+
+        # or generated again if the file cannot be used
+        self.write_file(path, 'depgraph,0\n')
+        self.checkGraphs(depgraph.load_graph(path, current),
+                         depgraph.generate_graph(current))
+        os.remove(path)
+        self.checkGraphs(depgraph.load_graph(path, current),
+                         depgraph.generate_graph(current))
+
+    def test_load_changed_graph(self):
+        # distributions reinstalled at the same path are inserted again
+        tmpdir = self.mkdtemp()
+        bacon = FakeDistribution('bacon', '0.1')
+        eggs = FakeDistribution('eggs', '1.0', ['bacon'])
+        eggs.path = os.path.join(tmpdir, 'eggs-1.0.dist-info')
+        os.mkdir(eggs.path)
+        metadata_path = os.path.join(eggs.path, 'METADATA')
+        self.write_file(metadata_path, '')
+        os.utime(metadata_path, (1000000000, 1000000000))
+        path = os.path.join(tmpdir, 'depgraph.csv')
+        depgraph.save_graph(depgraph.generate_graph([bacon, eggs]), path)
+
+        # same version, new metadata file
+        new_eggs = FakeDistribution('eggs', '1.0', ['ham'])
+        new_eggs.path = eggs.path
+        os.utime(metadata_path, (1000000010, 1000000010))
+        self.checkGraphs(depgraph.load_graph(path, [bacon, new_eggs]),
+                         depgraph.generate_graph([bacon, new_eggs]))
+
+        # new version at the same path
+        os.utime(metadata_path, (1000000000, 1000000000))
+        new_bacon = FakeDistribution('bacon', '0.2', ['eggs'])
+        new_bacon.path = bacon.path
+        self.checkGraphs(depgraph.load_graph(path, [new_bacon, eggs]),
+                         depgraph.generate_graph([new_bacon, eggs]))
+
+    def test_strongly_connected_components(self):
+        bacon = FakeDistribution('bacon', '0.1', ['eggs'])
+        eggs = FakeDistribution('eggs', '1.0', ['ham'])
+        ham = FakeDistribution('ham', '1.0', ['bacon', 'salt'])
+        salt = FakeDistribution('salt', '1.0')
+        toast = FakeDistribution('toast', '1.0', ['ham', 'salt'])
+        dists = [toast, bacon, eggs, ham, salt]
+        graph = depgraph.generate_graph(dists)
+
+        components = depgraph.strongly_connected_components(graph, dists)
+        self.assertEqual(components, [[salt], [ham, bacon, eggs], [toast]])
+        self.assertEqual(
+            depgraph.strongly_connected_components(graph, [toast, salt]),
+            [[salt], [toast]])
+        components = depgraph.strongly_connected_components(graph)
+        self.checkLists([sorted(c) for c in components],
+                        [[salt], sorted([ham, bacon, eggs]), [toast]])
+
+    def test_topological_levels(self):
+        dists = self.fake_dists()
+        bacon, towel, choxie, grammar, truffles, bacon2 = dists
+        cycle = FakeDistribution('cycle', '1.0', ['choxie', 'cycle-2'])
+        cycle2 = FakeDistribution('cycle-2', '1.0', ['cycle'])
+        dists.extend([cycle, cycle2])
+        graph = depgraph.generate_graph(dists)
+
+        levels = depgraph.topological_levels(graph, dists)
+        self.assertEqual(levels, [[[bacon], [truffles]],
+                                  [[towel], [grammar], [bacon2]],
+                                  [[choxie]],
+                                  [[cycle, cycle2]]])
+        self.assertEqual(depgraph.topological_levels(graph, [towel, choxie]),
+                         [[[towel]], [[choxie]]])
+        self.assertEqual(depgraph.topological_levels(graph, []), [])
+
+    def test_get_dependents(self):
+        dists = self.fake_dists()
+        bacon, towel, choxie, grammar, truffles, bacon2 = dists
+        cycle = FakeDistribution('cycle', '1.0', ['choxie', 'cycle-2'])
+        cycle2 = FakeDistribution('cycle-2', '1.0', ['cycle'])
+        dists.extend([cycle, cycle2])
+        graph = depgraph.generate_graph(dists)
+
+        dependents = graph.get_dependents([bacon])
+        self.checkLists(dependents, [towel, choxie, cycle, cycle2])
+        # dependencies come first
+        self.assertLess(dependents.index(towel), dependents.index(choxie))
+        self.assertLess(dependents.index(choxie), dependents.index(cycle))
+        self.checkLists(graph.get_dependents([truffles]),
+                        [choxie, grammar, bacon2, cycle, cycle2])
+        self.checkLists(graph.get_dependents([bacon, truffles]),
+                        [towel, choxie, grammar, bacon2, cycle, cycle2])
+        self.assertEqual(graph.get_dependents([cycle]), [cycle2])
+        self.assertEqual(graph.get_dependents([cycle, cycle2]), [])
+        self.assertEqual(graph.get_dependents([]), [])
+        self.assertRaises(ValueError, graph.get_dependents,
+                          [FakeDistribution('spam', '1.0')])
+
+        # the closure follows the changes of the graph
+        graph.remove_distribution(choxie)
+        self.assertEqual(graph.get_dependents([bacon]), [towel])
+        graph.insert_distribution(choxie)
+        self.checkLists(graph.get_dependents([bacon]),
+                        [towel, choxie, cycle, cycle2])
+
+    def test_get_dependencies(self):
+        dists = self.fake_dists()
+        bacon, towel, choxie, grammar, truffles, bacon2 = dists
+        cycle = FakeDistribution('cycle', '1.0', ['choxie', 'cycle-2'])
+        cycle2 = FakeDistribution('cycle-2', '1.0', ['cycle'])
+        dists.extend([cycle, cycle2])
+        graph = depgraph.generate_graph(dists)
+
+        self.assertEqual(graph.get_dependencies([bacon]), [])
+        self.checkLists(graph.get_dependencies([choxie]),
+                        [bacon, towel, truffles])
+        self.checkLists(graph.get_dependencies([cycle2]),
+                        [bacon, towel, truffles, choxie, cycle])
+        self.checkLists(graph.get_dependencies([grammar, bacon2]),
+                        [truffles])
+
+        graph.add_edge(bacon, grammar)
+        self.assertEqual(graph.get_dependencies([bacon]), [truffles, grammar])
+
     def test_dependent_dists(self):
         dists = []
         for name in self.DISTROS_DIST:
@@ -270,6 +472,94 @@ class DepGraphTestCase(support.LoggingCatcher,
 
         self.checkLists(matches, expected)
 
+    def test_graph_to_dot_subgraph(self):
+        dists = self.fake_dists()
+        bacon, towel, choxie, grammar, truffles, bacon2 = dists
+        graph = depgraph.generate_graph(dists)
+
+        buf = StringIO()
+        depgraph.graph_to_dot(graph, buf, roots=[choxie], depth=1)
+        self.assertEqual(buf.getvalue(), (
+            'digraph dependencies {\n'
+            '"choxie" -> "towel-stuff" [label="towel-stuff (0.1)"]\n'
+            '"choxie" -> "truffles" [label="nut"]\n'
+            '}\n'))
+
+        buf = StringIO()
+        depgraph.graph_to_dot(graph, buf, skip_disconnected=False,
+                              roots=[grammar, bacon2])
+        edges = [line for line in buf.getvalue().splitlines()
+                 if '->' in line]
+        self.checkLists(edges, [
+            '"grammar" -> "truffles" [label="truffles (>=1.2)"]',
+            '"bacon" -> "truffles" [label="nut (>=1.0)"]'])
+        self.assertIn('subgraph disconnected {\n'
+                      'label = "Disconnected"\n'
+                      'bgcolor = red\n'
+                      '"truffles"\n'
+                      '}\n', buf.getvalue())
+
+    def test_graph_to_jsonl(self):
+        dists = self.fake_dists()
+        bacon, towel, choxie, grammar, truffles, bacon2 = dists
+        spam = FakeDistribution(u'sp\xe4m "\\"', '1.0',
+                                ['choxie', 'eggs (>=1.0)'])
+        dists.append(spam)
+        graph = depgraph.generate_graph(dists)
+
+        buf = StringIO()
+        depgraph.graph_to_jsonl(graph, buf, roots=[spam])
+        self.assertEqual(buf.getvalue().splitlines(), [
+            '{"id": 0, "name": "sp\\u00e4m \\"\\\\\\"", "version": "1.0", '
+            '"requires": [[1, "choxie"]], "missing": ["eggs (>=1.0)"]}',
+            '{"id": 1, "name": "choxie", "version": "2.0", '
+            '"requires": [[2, "towel-stuff (0.1)"], [3, "nut"]], '
+            '"missing": []}',
+            '{"id": 2, "name": "towel-stuff", "version": "0.1", '
+            '"requires": [[4, "bacon (<=0.2)"]], "missing": []}',
+            '{"id": 3, "name": "truffles", "version": "1.5", '
+            '"requires": [], "missing": []}',
+            '{"id": 4, "name": "bacon", "version": "0.1", '
+            '"requires": [], "missing": []}'])
+
+        buf = StringIO()
+        depgraph.graph_to_jsonl(graph, buf, roots=[spam], depth=1)
+        self.assertEqual(len(buf.getvalue().splitlines()), 2)
+        self.assertIn('"requires": []', buf.getvalue().splitlines()[1])
+
+        buf = StringIO()
+        depgraph.graph_to_jsonl(graph, buf)
+        self.assertEqual(len(buf.getvalue().splitlines()), len(dists))
+
+    def test_repr_node(self):
+        # shared dependencies are only expanded once, and cycles or long
+        # chains of dependencies do not recurse
+        dists = [FakeDistribution('top', '1.0', ['left', 'right']),
+                 FakeDistribution('left', '1.0', ['bottom']),
+                 FakeDistribution('right', '1.0', ['bottom']),
+                 FakeDistribution('bottom', '1.0', ['top'])]
+        graph = depgraph.generate_graph(dists)
+        self.assertEqual(graph.repr_node(dists[0]).splitlines(), [
+            "'top' 1.0",
+            "    'left' 1.0 [left]",
+            "        'bottom' 1.0 [bottom]",
+            "            'top' 1.0 [top]",
+            "    'right' 1.0 [right]",
+            "        'bottom' 1.0 [bottom]"])
+        self.assertEqual(graph.repr_node(dists[0], depth=1).splitlines(), [
+            "'top' 1.0",
+            "    'left' 1.0 [left]",
+            "    'right' 1.0 [right]"])
+        self.assertEqual(len(repr(graph).splitlines()), 6)
+
+        dists = [FakeDistribution('project0', '1.0')]
+        for i in range(1, 3000):
+            dists.append(FakeDistribution('project%d' % i, '1.0',
+                                          ['project%d' % (i - 1)]))
+        graph = depgraph.generate_graph(dists)
+        self.assertEqual(len(graph.repr_node(dists[-1]).splitlines()), 3000)
+        self.assertEqual(len(repr(graph).splitlines()), 3000)
+
     @requires_zlib
     def test_repr(self):
         dists = []
@@ -1,10 +1,12 @@
 """Tests for the distutils2.install module."""
 import os
+import sys
 import logging
 
 from tempfile import mkstemp
 
-from distutils2 import install
+from distutils2 import install, database
+from distutils2.depgraph import save_graph
 from distutils2.pypi.xmlrpc import Client
 from distutils2.metadata import Metadata
 from distutils2.tests.support import (LoggingCatcher, TempdirManager, unittest,
@@ -26,6 +28,7 @@ class InstalledDist(object):
         self.metadata = Metadata()
         self.name = name
         self.version = version
+        self.path = '/fake/%s-%s.dist-info' % (name, version)
         self.metadata['Name'] = name
         self.metadata['Version'] = version
         self.metadata['Requires-Dist'] = deps
@@ -144,6 +147,26 @@ class TestInstall(LoggingCatcher, TempdirManager, unittest.TestCase):
         self.assertIn(('towel-stuff', '0.1'), readable_output)
         self.assertIn(('choxie', '2.0.0.9'), readable_output)
 
+    @unittest.skipIf(threading is None, 'needs threading')
+    @use_xmlrpc_server()
+    def test_existing_deps_normalized_name(self, server):
+        # installed projects are found regardless of case and of the
+        # '-'/'_' spelling used in the requirements
+        client = self._get_client(server)
+        archive_path = '%s/distribution.tar.gz' % server.full_address
+        server.xmlrpc.set_distributions([
+            {'name': 'choxie',
+             'version': '2.0.0.9',
+             'requires_dist': ['towel-stuff (0.1)'],
+             'url': archive_path},
+            ])
+        installed = get_installed_dists([('Towel_Stuff', '0.1', [])])
+        output = install.get_infos("choxie", index=client,
+                                   installed=installed)
+        installed, remove, conflict = self._get_results(output)
+        self.assertEqual(installed, [('choxie', '2.0.0.9')])
+        self.assertEqual(remove, [])
+
     @unittest.skipIf(threading is None, 'needs threading')
     @use_xmlrpc_server()
     def test_upgrade_existing_deps(self, server):
@@ -216,6 +239,76 @@ class TestInstall(LoggingCatcher, TempdirManager, unittest.TestCase):
         self.assertIn(('bacon', '0.1'), remove)
         self.assertIn(('chicken', '1.1'), conflict)
 
+    @unittest.skipIf(threading is None, 'needs threading')
+    @use_xmlrpc_server()
+    def test_saved_graph(self, server):
+        # the dependency graph is saved and updated between calls
+        client = self._get_client(server)
+        archive_path = '%s/distribution.tar.gz' % server.full_address
+        server.xmlrpc.set_distributions([
+            {'name': 'towel-stuff',
+             'version': '0.2',
+             'requires_dist': ['bacon (>= 0.2)'],
+             'url': archive_path},
+            {'name': 'bacon',
+             'version': '0.2',
+             'requires_dist': [],
+             'url': archive_path},
+            ])
+        graph_path = os.path.join(self.mkdtemp(), 'depgraph.csv')
+
+        already_installed = get_installed_dists(
+            [('bacon', '0.1', []), ('chicken', '1.1', ['bacon (0.1)'])])
+        output = install.get_infos(
+            'towel-stuff', index=client, graph_path=graph_path,
+            installed=already_installed)
+        # the graph is only read
+        self.assertFalse(os.path.exists(graph_path))
+        installed, remove, conflict = self._get_results(output)
+        self.assertEqual(installed, [('bacon', '0.2'), ('towel-stuff', '0.2')])
+        self.assertEqual(conflict, [('chicken', '1.1')])
+
+        save_graph(install.get_graph(already_installed), graph_path,
+                   install._get_paths_stamp())
+        saved = open(graph_path).read()
+        already_installed = [('bacon', '0.1', []),
+                             ('towel-stuff', '0.1', ['bacon (<= 0.2)'])]
+        output = install.get_infos(
+            'towel-stuff (>0.1)', index=client, graph_path=graph_path,
+            installed=get_installed_dists(already_installed))
+        self.assertEqual(open(graph_path).read(), saved)
+        installed, remove, conflict = self._get_results(output)
+        self.assertEqual(installed, [('bacon', '0.2'), ('towel-stuff', '0.2')])
+        self.assertEqual(remove, [('bacon', '0.1'), ('towel-stuff', '0.1')])
+        self.assertEqual(conflict, [('towel-stuff', '0.1')])
+
+    def test_graph_path(self):
+        # the graph is only saved in the directory of the on-disk index
+        self.assertIsNone(install.get_graph_path())
+        index_dir = self.mkdtemp()
+        self.addCleanup(database.disable_index)
+        database.enable_index(index_dir)
+        graph_path = install.get_graph_path()
+        self.assertEqual(os.path.dirname(graph_path), index_dir)
+
+        site_packages = self.mkdtemp()
+        self.addCleanup(setattr, sys, 'path', sys.path[:])
+        sys.path.append(site_packages)
+        dists = get_installed_dists([('bacon', '0.1', []),
+                                     ('chicken', '1.1', ['bacon (0.1)'])])
+        save_graph(install.get_graph(dists), graph_path,
+                   install._get_paths_stamp())
+        # the saved graph is used as long as sys.path is unchanged
+        dists[1].metadata['Requires-Dist'] = []
+        graph = install.get_graph(dists, graph_path)
+        self.assertEqual(graph.adjacency_list[dists[1]],
+                         [(dists[0], 'bacon (0.1)')])
+
+        mtime = os.stat(site_packages).st_mtime
+        os.utime(site_packages, (mtime + 10, mtime + 10))
+        graph = install.get_graph(dists, graph_path)
+        self.assertEqual(graph.adjacency_list[dists[1]], [])
+
     @unittest.skipIf(threading is None, 'needs threading')
     @use_xmlrpc_server()
     def test_installation_unexisting_project(self, server):
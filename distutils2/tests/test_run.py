@@ -5,7 +5,8 @@ import sys
 import textwrap
 from StringIO import StringIO
 
-from distutils2 import install
+from distutils2 import install, run
+from distutils2.database import get_distributions
 from distutils2.tests import unittest, support
 from distutils2.run import main
 
@@ -94,6 +95,59 @@ class RunTestCase(support.TempdirManager,
 
     # TODO test that custom commands don't break --list-commands
 
+    def test_verify(self):
+        site_packages = self.mkdtemp()
+        distinfo = os.path.join(site_packages, 'spam-1.0.dist-info')
+        os.mkdir(distinfo)
+        self.write_file((distinfo, 'METADATA'),
+                        'Metadata-Version: 1.2\nName: spam\nVersion: 1.0\n')
+        module = os.path.join(site_packages, 'spam.py')
+        self.write_file(module, '# spam\n')
+        self.write_file((distinfo, 'RECORD'),
+                        '%s,bogus,7\n%s,,\n' % (
+                            module, os.path.join(distinfo, 'RECORD')))
+        pythonpath = os.pathsep.join([self.get_pythonpath(), site_packages])
+
+        index_dir = self.mkdtemp()
+        _, out, err = assert_python_failure(
+            '-m', 'distutils2.run', 'verify', '-i', index_dir, 'spam',
+            PYTHONPATH=pythonpath)
+        self.assertEqual(out, 'spam,1.0,%s,bad-hash\n' % module)
+        self.assertEqual(len([name for name in os.listdir(index_dir)
+                              if name.endswith('.hashes')]), 1)
+
+        self.write_file((distinfo, 'RECORD'), '%s,,\n' % module)
+        _, out, err = assert_python_ok(
+            '-m', 'distutils2.run', 'verify', '-a', '-j', '2', 'spam',
+            PYTHONPATH=pythonpath)
+        self.assertEqual(out, 'spam,1.0,%s,unchecked\n' % module)
+
+    def test_remove_broken_dependents(self):
+        # a distribution with broken metadata does not prevent removals
+        site_packages = self.mkdtemp()
+        for name, extra in (('spam', ''),
+                            ('bad', 'Provides-Dist: bad (1.0\n')):
+            distinfo = os.path.join(site_packages, '%s-1.0.dist-info' % name)
+            os.mkdir(distinfo)
+            self.write_file((distinfo, 'METADATA'),
+                            'Metadata-Version: 1.2\nName: %s\nVersion: 1.0\n'
+                            '%s' % (name, extra))
+
+        removed = []
+        old_get_distributions = run.get_distributions
+        old_remove = run.remove
+        run.get_distributions = lambda use_egg_info: get_distributions(
+            use_egg_info, paths=[site_packages])
+        run.remove = lambda name, auto_confirm: removed.append(name)
+        try:
+            self.assertEqual(main(['remove', '-y', 'spam']), 0)
+        finally:
+            run.get_distributions = old_get_distributions
+            run.remove = old_remove
+        self.assertEqual(removed, ['spam'])
+        warnings = self.get_logs()
+        self.assertIn('Could not check the projects depending', warnings[-1])
+
     def test_unknown_command_option(self):
         out, err = self.call_pysetup_fail('run', 'build', '--unknown')
         self.assertGreater(out, '')
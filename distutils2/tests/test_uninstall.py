@@ -93,6 +93,12 @@ class UninstallTestCase(support.TempdirManager,
         self.assertIsNotFile(site_packages, 'foo', 'sub', '__init__.py')
         self.assertIsNotFile(site_packages, 'Foo-0.1.dist-info', 'RECORD')
 
+    def test_uninstall_normalized_name(self):
+        dist, site_packages = self.install_dist('Foo_Bar')
+        self.assertIsFile(site_packages, 'foo_bar', '__init__.py')
+        self.assertTrue(remove('foo-bar', paths=[site_packages]))
+        self.assertIsNotFile(site_packages, 'foo_bar', '__init__.py')
+
     def test_uninstall_error_handling(self):
         # makes sure if there are OSErrors (like permission denied)
         # remove() stops and displays a clean error
@@ -19,7 +19,7 @@ from distutils2.util import (
     spawn, get_pypirc_path, generate_pypirc, read_pypirc, resolve_name, iglob,
     RICH_GLOB, egginfo_to_distinfo, is_setuptools, is_distutils, is_packaging,
     get_install_method, cfg_to_args, generate_setup_py, encode_multipart,
-    parse_requires)
+    parse_requires, _parallel_map)
 
 from distutils2.tests import support, unittest
 from distutils2.tests.test_config import SETUP_CFG
@@ -586,6 +586,26 @@ class UtilTestCase(support.EnvironRestorer,
         self.assertEqual('multipart/form-data; boundary=-x', content_type)
         self.assertEqual(EXPECTED_MULTIPART_OUTPUT, body.split('\r\n'))
 
+    def test_parallel_map(self):
+        items = range(50)
+        for workers in (0, 1, 4, 100):
+            self.assertEqual(_parallel_map(str, items, workers),
+                             [str(item) for item in items])
+
+        def func(item):
+            if item % 10 == 3:
+                raise ValueError(item)
+            return item
+
+        # the exception raised for the first failing item wins
+        for workers in (1, 4):
+            try:
+                _parallel_map(func, items, workers)
+            except ValueError, e:
+                self.assertEqual(e.args, (3,))
+            else:
+                self.fail('ValueError not raised')
+
 
 class GlobTestCaseBase(support.TempdirManager,
                        support.LoggingCatcher,
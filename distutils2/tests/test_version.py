@@ -4,7 +4,10 @@ import doctest
 from distutils2.version import NormalizedVersion as V
 from distutils2.version import HugeMajorVersionNumError, IrrationalVersionError
 from distutils2.version import suggest_normalized_version as suggest
+from distutils2.version import suggest_normalized_versions
 from distutils2.version import VersionPredicate
+from distutils2.version import get_sort_key, get_sort_keys, sort_versions
+from distutils2.version import VersionSet
 from distutils2.tests import unittest
 
 
@@ -155,6 +158,42 @@ class VersionTestCase(unittest.TestCase):
         self.assertGreater(V('1.0rc2'), V('1.0rc1'))
         self.assertGreater(V('1.0c4'), V('1.0c1'))
 
+    def test_sort_keys(self):
+        versions = ['1.0a1', '1.0a2.dev456', '1.0a12.dev456', '1.0a12',
+                    '1.0b1.dev456', '1.0b2', '1.0b2.post345.dev456',
+                    '1.0b2.post345', '1.0c1.dev456', '1.0c1', '1.0rc1',
+                    '1.0.dev456', '1.0', '1.0.post456.dev34', '1.0.post456',
+                    '1.0.0', '1.0.1', '1.1', '1.1.dev1', '1.10', '2.0',
+                    '10.0', '1.0', '1.0.0.0']
+        parsed = [V(version) for version in versions]
+        keys = get_sort_keys(versions)
+        self.assertEqual(keys, [version.sort_key for version in parsed])
+        for i, v1 in enumerate(parsed):
+            for j, v2 in enumerate(parsed):
+                self.assertEqual(cmp(keys[i], keys[j]),
+                                 cmp(v1.parts, v2.parts), (v1, v2))
+
+        self.assertEqual(sort_versions(versions), sorted(
+            versions, key=lambda version: V(version).parts))
+        self.assertEqual(sort_versions(parsed, reverse=True),
+                         sorted(parsed, reverse=True))
+        self.assertEqual(max(versions, key=get_sort_key), '10.0')
+        self.assertEqual(get_sort_key(u'1.0b1'), get_sort_key(V('1.0b1')))
+        self.assertEqual(
+            get_sort_key('1.2.0', error_on_huge_major_num=False),
+            V('1.2.0').sort_key)
+        self.assertEqual(get_sort_key('1981.1', error_on_huge_major_num=False),
+                         V('1981.1', error_on_huge_major_num=False).sort_key)
+        self.assertRaises(HugeMajorVersionNumError, get_sort_key, '1981.1')
+        self.assertRaises(IrrationalVersionError, get_sort_keys,
+                          ['1.0', '1.0-beta'])
+
+        # sort keys can be bisected
+        import bisect
+        keys = sorted(keys)
+        index = bisect.bisect_left(keys, get_sort_key('1.0'))
+        self.assertEqual(keys[index], V('1.0').sort_key)
+
     def test_suggest_normalized_version(self):
 
         self.assertEqual(suggest('1.0'), '1.0')
@@ -187,6 +226,18 @@ class VersionTestCase(unittest.TestCase):
         # they us "p1" "p2" for post releases
         self.assertEqual(suggest('1.4p1'), '1.4.post1')
 
+    def test_suggest_normalized_versions(self):
+        from distutils2 import version
+        version._suggestions.clear()
+        versions = ['1.0', '1.0-beta', 'v1.0', '1.0-beta', 'nonsense', '1.0']
+        self.assertEqual(suggest_normalized_versions(versions),
+                         ['1.0', '1.0b0', '1.0', '1.0b0', None, '1.0'])
+        self.assertEqual(suggest_normalized_versions(versions),
+                         [suggest(v) for v in versions])
+        self.assertEqual(sorted(version._suggestions),
+                         ['1.0', '1.0-beta', 'nonsense', 'v1.0'])
+        self.assertEqual(suggest_normalized_versions([]), [])
+
     def test_predicate(self):
         # VersionPredicate knows how to parse stuff like:
         #
@@ -232,6 +283,77 @@ class VersionTestCase(unittest.TestCase):
         for predicate in predicates:
             self.assertEqual(str(VersionPredicate(predicate)), predicate)
 
+    def test_predicate_cache(self):
+        first = VersionPredicate('Hey (>=2.5, !=2.6, <3.0)')
+        second = VersionPredicate('Hey (>=2.5, !=2.6, <3.0)')
+        self.assertIsNot(first, second)
+        self.assertIs(first._tests, second._tests)
+        self.assertEqual(first.predicates, second.predicates)
+        self.assertEqual(first.predicates,
+                         (('>=', V('2.5')), ('!=', V('2.6')), ('<', V('3.0'))))
+        # instances are independent, and replacing the predicates of one
+        # of them recompiles its tests
+        second.predicates += (('!=', V('2.7')),)
+        self.assertFalse(second.match('2.7'))
+        self.assertTrue(first.match('2.7'))
+        self.assertNotIn(V('2.7'), second.get_version_set())
+        self.assertEqual(len(VersionPredicate(
+            'Hey (>=2.5, !=2.6, <3.0)').predicates), 3)
+
+        for version in ('2.5', '2.5.1', '2.7', '2.6', '2.6.1', '3.0', '2.4'):
+            self.assertEqual(first.match(version), first.match(V(version)))
+        self.assertTrue(first.match(V('2.7')))
+        self.assertFalse(first.match(V('2.6.1')))
+        self.assertRaises(IrrationalVersionError, first.match, '2.6-beta')
+        self.assertRaises(ValueError, VersionPredicate, '(>=2.5)')
+
+    def test_version_set(self):
+        versions = sort_versions(
+            [main + suffix
+             for main in ('0.9', '1.0', '1.0.1', '1.1', '1.1.5', '1.10',
+                          '1.15.2', '1.2', '2.0', '10.0')
+             for suffix in ('', 'a1', 'a10', 'c1', 'rc1', '.dev3', '.dev35',
+                            '.post2', '.post2.dev3', 'a1.post2')])
+        keys = get_sort_keys(versions)
+        # sets give the same results as the predicates
+        for operator in ('<', '>', '<=', '>=', '==', '!='):
+            for version in ('1.0', '1.1', '1.0a1', '1.0.dev3', '1.0.post2',
+                            '1.0.post2.dev3', '1.10'):
+                predicate = VersionPredicate('Hey (%s%s)' % (operator,
+                                                              version))
+                version_set = predicate.get_version_set()
+                expected = [v for v in versions if predicate.match(v)]
+                self.assertEqual(version_set.filter(versions, keys),
+                                 expected, predicate)
+                self.assertEqual(version_set.filter(versions), expected)
+                self.assertEqual([v for v in versions if v in version_set],
+                                 expected)
+                self.assertEqual(version_set.complement().filter(versions),
+                                 [v for v in versions if v not in expected])
+
+        first = VersionSet.from_predicate('Hey (>=1.0, <2.0)')
+        second = VersionSet.from_predicate('Hey (>=1.1, !=1.2, <=3.0)')
+        third = VersionSet.from_predicate(VersionPredicate('Hey (>=2.0)'))
+        self.assertEqual(first.intersection(second).filter(versions, keys),
+                         [v for v in versions
+                          if v in first and v in second])
+        self.assertEqual(first.union(third).filter(versions, keys),
+                         [v for v in versions if v in first or v in third])
+        # 2.0a1 is less than 2.0 but starts like it
+        self.assertEqual(first.intersection(third).filter(versions),
+                         ['2.0a1', '2.0a1.post2', '2.0a10', '2.0c1',
+                          '2.0rc1', '2.0.dev3', '2.0.dev35'])
+        self.assertTrue(first.intersection(
+            VersionSet.from_predicate('Hey (>2.5)')).is_empty())
+        self.assertFalse(first.intersection(second).is_empty())
+        self.assertTrue(VersionSet([]).is_empty())
+        self.assertTrue(VersionSet().complement().is_empty())
+        self.assertEqual(VersionSet([]).complement(), VersionSet())
+        self.assertEqual(first.complement().complement(), first)
+        self.assertEqual(VersionSet.from_predicate('Hey'), VersionSet())
+        self.assertIn(V('1.5'), first)
+        self.assertNotIn('2.0', first)
+
     def test_predicate_name(self):
         # Test that names are parsed the right way
 
@@ -265,6 +387,36 @@ class VersionWhiteBoxTestCase(unittest.TestCase):
             V('1.0')._parse_numdots('1.0', '1.0', pad_zeros_length=3),
             [1, 0, 0])
 
+    def test_parse_cache(self):
+        from distutils2 import version
+        self.addCleanup(setattr, version, '_MAX_PARSED', version._MAX_PARSED)
+        version._parsed.clear()
+
+        # equal versions share their parts
+        self.assertIs(V('1.2.3b1').parts, V('1.2.3b1').parts)
+        self.assertIsNot(V('1.2.0', drop_trailing_zeros=True).parts,
+                         V('1.2.0').parts)
+        self.assertFalse(V('1.2.3b1').is_final)
+
+        # errors are cached too
+        for i in range(2):
+            self.assertRaises(IrrationalVersionError, V, '1.02')
+            self.assertRaises(HugeMajorVersionNumError, V, '2011.1')
+        self.assertEqual(str(V('2011.1', error_on_huge_major_num=False)),
+                         '2011.1')
+        self.assertRaises(TypeError, V, None)
+        self.assertRaises(TypeError, V, ['1.0'])
+
+        # the cache is bounded
+        version._MAX_PARSED = 3
+        for s in ('1.0', '1.1', '1.2', '1.3'):
+            V(s)
+        self.assertEqual(len(version._parsed), 1)
+        version._MAX_PARSED = 0
+        version._parsed.clear()
+        V('1.4')
+        self.assertEqual(version._parsed, {})
+
 
 def test_suite():
     #README = os.path.join(os.path.dirname(__file__), 'README.txt')
@@ -9,6 +9,7 @@ import codecs
 import string
 import posixpath
 import subprocess
+import Queue
 from fnmatch import fnmatchcase
 from inspect import getsource
 from ConfigParser import RawConfigParser
@@ -20,6 +21,10 @@ try:
     import hashlib
 except ImportError:
     from distutils2._backport import hashlib
+try:
+    import threading
+except ImportError:
+    threading = None
 
 from distutils2 import logger
 from distutils2.errors import (PackagingPlatformError, PackagingFileError,
@@ -1179,6 +1184,20 @@ def parse_requires(req_path):
 
     *req_path* must be the path to a setuptools-produced requires.txt file.
     """
+    try:
+        fp = open(req_path, 'r')
+        try:
+            requires = fp.read()
+        finally:
+            fp.close()
+    except IOError:
+        return None
+    return _parse_requires(requires)
+
+
+def _parse_requires(requires):
+    """Create a list of dependencies from the contents of a requires.txt
+    file."""
 
     # reused from Distribute's pkg_resources
     def yield_lines(strs):
@@ -1201,15 +1220,6 @@ def parse_requires(req_path):
         r'(?P<extras>\[.*\])?')
 
     reqs = []
-    try:
-        fp = open(req_path, 'r')
-        try:
-            requires = fp.read()
-        finally:
-            fp.close()
-    except IOError:
-        return None
-
     for line in yield_lines(requires):
         if line.startswith('['):
             logger.warning('extensions in requires.txt are not supported')
@@ -1591,3 +1601,45 @@ def encode_multipart(fields, files, boundary=None):
     body = '\r\n'.join(l)
     content_type = 'multipart/form-data; boundary=' + boundary
     return content_type, body
+
+
+def _parallel_map(func, items, workers):
+    """Return the list of ``func(item)`` for each item of *items*.
+
+    The calls are made by up to *workers* threads; the results are returned
+    in the order of *items*.  If some calls raise an exception, the one
+    raised for the first item is raised again once all threads are done.
+    Without thread support, the calls are made sequentially.
+    """
+    items = list(items)
+    if threading is None or workers < 2 or len(items) < 2:
+        return [func(item) for item in items]
+
+    results = [None] * len(items)
+    errors = {}
+    todo = Queue.Queue()
+    for i in range(len(items)):
+        todo.put(i)
+
+    def work():
+        while True:
+            try:
+                i = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = func(items[i])
+            except:
+                errors[i] = sys.exc_info()
+
+    threads = [threading.Thread(target=work)
+               for i in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        type_, value, tb = errors[min(errors)]
+        raise type_, value, tb
+    return results
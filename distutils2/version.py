@@ -1,12 +1,15 @@
 """Implementation of the versioning scheme defined in PEP 386."""
 
 import re
+from bisect import bisect_left, bisect_right
 
 from distutils2.errors import IrrationalVersionError, HugeMajorVersionNumError
 
 __all__ = ['NormalizedVersion', 'suggest_normalized_version',
+           'suggest_normalized_versions',
            'VersionPredicate', 'is_valid_version', 'is_valid_versions',
-           'is_valid_predicate']
+           'is_valid_predicate', 'get_sort_key', 'get_sort_keys',
+           'sort_versions', 'VersionSet']
 
 # A marker used in the second and third parts of the `parts` tuple, for
 # versions that don't have those segments, to sort properly. An example
@@ -26,6 +29,13 @@ __all__ = ['NormalizedVersion', 'suggest_normalized_version',
 # 'rc' we must use 'z'
 _FINAL_MARKER = ('z',)
 
+# The parts are also flattened into a tuple of integers that sorts like
+# them, see _get_sort_key: the markers are replaced by integers in the same
+# order, and each part is terminated by -1 so that shorter parts still sort
+# first.  Markers are never compared with numbers in the parts, so their
+# values can overlap.
+_MARKER_CODES = {'a': 0, 'b': 1, 'c': 2, 'dev': 3, 'post': 4, 'rc': 5, 'z': 6}
+
 _VERSION_RE = re.compile(r'''
     ^
     (?P<version>\d+\.\d+)          # minimum 'N.N'
@@ -38,6 +48,15 @@ _VERSION_RE = re.compile(r'''
     (?P<postdev>(\.post(?P<post>\d+))?(\.dev(?P<dev>\d+))?)?
     $''', re.VERBOSE)
 
+# Results of NormalizedVersion._parse, of the parsing of predicates and of
+# suggest_normalized_version, see _cache_result; like the cache of the re
+# module, each cache is cleared when it holds _MAX_PARSED entries, and
+# setting _MAX_PARSED to 0 disables them.
+_parsed = {}
+_predicates = {}
+_suggestions = {}
+_MAX_PARSED = 5000
+
 
 class NormalizedVersion(object):
     """A rational version.
@@ -89,7 +108,19 @@ class NormalizedVersion(object):
         return cls(cls.parts_to_str((version, prerelease, devpost)))
 
     def _parse(self, s, error_on_huge_major_num=True):
-        """Parses a string version into parts."""
+        """Parses a string version into parts.
+
+        The same strings are parsed over and over when resolving
+        dependencies, so the results (including errors) are cached and the
+        ``parts`` tuple is shared by the equal versions.
+        """
+        (self.parts, self.is_final, self.sort_key,
+         self._string) = _get_parse_result(self, s, error_on_huge_major_num)
+
+    def _parse_parts(self, s, error_on_huge_major_num=True):
+        """Return the parts of the string version *s* and whether it is a
+        final version."""
+        is_final = True
         match = _VERSION_RE.search(s)
         if not match:
             raise IrrationalVersionError(s)
@@ -111,7 +142,7 @@ class NormalizedVersion(object):
             block += self._parse_numdots(groups.get('prerelversion'), s,
                                          pad_zeros_length=1)
             parts.append(tuple(block))
-            self.is_final = False
+            is_final = False
         else:
             parts.append(_FINAL_MARKER)
 
@@ -126,14 +157,15 @@ class NormalizedVersion(object):
                     postdev.append(_FINAL_MARKER[0])
             if dev is not None:
                 postdev.extend(('dev', int(dev)))
-                self.is_final = False
+                is_final = False
             parts.append(tuple(postdev))
         else:
             parts.append(_FINAL_MARKER)
-        self.parts = tuple(parts)
-        if error_on_huge_major_num and self.parts[0][0] > 1980:
+        parts = tuple(parts)
+        if error_on_huge_major_num and parts[0][0] > 1980:
             raise HugeMajorVersionNumError("huge major version number, %r, "
-               "which might cause future problems: %r" % (self.parts[0][0], s))
+               "which might cause future problems: %r" % (parts[0][0], s))
+        return parts, is_final
 
     def _parse_numdots(self, s, full_ver_str, pad_zeros_length=0):
         """Parse 'N.N.N' sequences, return a list of ints.
@@ -216,6 +248,102 @@ class NormalizedVersion(object):
         return hash(self.parts)
 
 
+def _get_parse_result(version, s, error_on_huge_major_num):
+    """Return the ``(parts, is_final, sort_key, string)`` tuple of the string
+    *s* parsed by the NormalizedVersion *version*, where *string* is the
+    normalized form of *s*, or raise the error found."""
+    key = (s, error_on_huge_major_num, version.drop_trailing_zeros)
+    try:
+        result = _parsed[key]
+    except KeyError:
+        try:
+            parts, is_final = version._parse_parts(s, error_on_huge_major_num)
+        except IrrationalVersionError, e:
+            result = (e.__class__, e.args)
+        else:
+            result = (parts, is_final, _get_sort_key(parts),
+                      NormalizedVersion.parts_to_str(parts))
+        _cache_result(_parsed, key, result)
+    except TypeError:
+        # unhashable object, let the regular expression complain
+        parts, is_final = version._parse_parts(s, error_on_huge_major_num)
+        result = (parts, is_final, _get_sort_key(parts),
+                  NormalizedVersion.parts_to_str(parts))
+
+    if len(result) == 2:
+        error, args = result
+        raise error(*args)
+    return result
+
+
+def _cache_result(cache, key, result):
+    """Store the *result* of parsing a version or a predicate in *cache*."""
+    if _MAX_PARSED:
+        if len(cache) >= _MAX_PARSED:
+            cache.clear()
+        cache[key] = result
+
+
+def _get_sort_key(parts):
+    """Flatten the *parts* of a version into a tuple of integers."""
+    key = []
+    for part in parts:
+        for item in part:
+            if isinstance(item, basestring):
+                item = _MARKER_CODES[item]
+            key.append(item)
+        key.append(-1)
+    return tuple(key)
+
+
+def get_sort_key(version, error_on_huge_major_num=True):
+    """Return the sort key of *version*, a version string or a
+    :class:`NormalizedVersion`.
+
+    Sort keys are flat tuples of integers that compare like the versions
+    they come from, only faster: they can be given as the *key* argument of
+    ``sorted``, ``min`` or ``max``, or searched with the ``bisect`` module.
+    """
+    if isinstance(version, NormalizedVersion):
+        return version.sort_key
+    return _get_parse_result(_prototype, version, error_on_huge_major_num)[2]
+
+
+def get_sort_keys(versions, error_on_huge_major_num=True):
+    """Return the list of the sort keys of *versions*, parsing each distinct
+    version string only once.  See :func:`get_sort_key`."""
+    keys = {}
+    result = []
+    for version in versions:
+        if isinstance(version, NormalizedVersion):
+            result.append(version.sort_key)
+            continue
+        key = keys.get(version)
+        if key is None:
+            key = keys[version] = get_sort_key(version,
+                                               error_on_huge_major_num)
+        result.append(key)
+    return result
+
+
+def sort_versions(versions, reverse=False, error_on_huge_major_num=True):
+    """Return a new list of *versions*, version strings or
+    :class:`NormalizedVersion` instances, sorted in ascending order (or
+    descending if *reverse* is true).
+
+    Irrational version strings raise :exc:`IrrationalVersionError`.
+    """
+    versions = list(versions)
+    keys = get_sort_keys(versions, error_on_huge_major_num)
+    order = range(len(versions))
+    order.sort(key=keys.__getitem__, reverse=reverse)
+    return [versions[i] for i in order]
+
+
+# used to parse the version strings given to get_sort_key
+_prototype = NormalizedVersion('0.0')
+
+
 def suggest_normalized_version(s):
     """Suggest a normalized version close to the given version string.
 
@@ -232,12 +360,49 @@ def suggest_normalized_version(s):
 
     @param s {str} An irrational version string.
     @returns A rational version string, or None, if couldn't determine one.
+
+    The suggestions are cached, see also `suggest_normalized_versions`.
     """
     try:
-        NormalizedVersion(s)
-        return s   # already rational
-    except IrrationalVersionError:
+        return _suggestions[s]
+    except KeyError:
         pass
+    suggestion = _suggest_normalized_version(s)
+    _cache_result(_suggestions, s, suggestion)
+    return suggestion
+
+
+def suggest_normalized_versions(versions):
+    """Suggest normalized versions close to the version strings *versions*.
+
+    Returns the list of the suggestions of `suggest_normalized_version`
+    for *versions*, in the same order; each distinct string is only
+    examined once.
+    """
+    suggestions = {}
+    result = []
+    for version in versions:
+        try:
+            suggestion = suggestions[version]
+        except KeyError:
+            suggestion = suggestions[version] = suggest_normalized_version(
+                version)
+        result.append(suggestion)
+    return result
+
+
+def _is_rational(s):
+    """Return True if *s* is a rational version string."""
+    try:
+        _get_parse_result(_prototype, s, True)
+    except IrrationalVersionError:
+        return False
+    return True
+
+
+def _suggest_normalized_version(s):
+    if _is_rational(s):
+        return s   # already rational
 
     rs = s.lower()
 
@@ -320,11 +485,8 @@ def suggest_normalized_version(s):
     # Tcl/Tk uses "px" for their post release markers
     rs = re.sub(r"p(\d+)$", r".post\1", rs)
 
-    try:
-        NormalizedVersion(rs)
-        return rs   # already rational
-    except IrrationalVersionError:
-        pass
+    if _is_rational(rs):
+        return rs
     return None
 
 
@@ -346,34 +508,45 @@ def _split_predicate(predicate):
     return comp, NormalizedVersion(version)
 
 
-class VersionPredicate(object):
-    """Defines a predicate: ProjectName (>ver1,ver2, ..)"""
-
-    _operators = {"<": lambda x, y: x < y,
-                  ">": lambda x, y: x > y,
-                  "<=": lambda x, y: str(x).startswith(str(y)) or x < y,
-                  ">=": lambda x, y: str(x).startswith(str(y)) or x > y,
-                  "==": lambda x, y: str(x).startswith(str(y)),
-                  "!=": lambda x, y: not str(x).startswith(str(y)),
-                  }
-
-    def __init__(self, predicate):
-        self._string = predicate
-        predicate = predicate.strip()
-        match = _PREDICATE.match(predicate)
-        if match is None:
-            raise ValueError('Bad predicate "%s"' % predicate)
-
-        name, predicates = match.groups()
-        self.name = name.strip()
-        self.predicates = []
-        if predicates is None:
-            return
+# The comparison operators of predicates, as functions of the sort keys and
+# normalized strings of the version to match and of the version of the
+# predicate, see _compile_predicates.  Versions match the "==" operator when
+# their string starts with the string of the predicate.
+_OPERATORS = {
+    '<': lambda key, string, other_key, other_string: key < other_key,
+    '>': lambda key, string, other_key, other_string: key > other_key,
+    '<=': lambda key, string, other_key, other_string: (
+        string.startswith(other_string) or key < other_key),
+    '>=': lambda key, string, other_key, other_string: (
+        string.startswith(other_string) or key > other_key),
+    '==': lambda key, string, other_key, other_string: (
+        string.startswith(other_string)),
+    '!=': lambda key, string, other_key, other_string: (
+        not string.startswith(other_string)),
+}
+
+
+def _compile_predicates(predicates):
+    """Turn a list of ``(operator, NormalizedVersion)`` predicates into a
+    tuple of ``(function, sort_key, string)`` tests, see _OPERATORS."""
+    return tuple([(_OPERATORS[operator], version.sort_key, str(version))
+                  for operator, version in predicates])
+
+
+def _parse_predicate(predicate):
+    """Return the name, the ``(operator, NormalizedVersion)`` predicates and
+    the compiled tests of the *predicate* string."""
+    predicate = predicate.strip()
+    match = _PREDICATE.match(predicate)
+    if match is None:
+        raise ValueError('Bad predicate "%s"' % predicate)
 
+    name, predicates = match.groups()
+    name = name.strip()
+    parsed = []
+    if predicates is not None:
         predicates = _VERSIONS.match(predicates.strip())
-        if predicates is None:
-            return
-
+    if predicates is not None:
         predicates = predicates.groupdict()
         if predicates['versions'] is not None:
             versions = predicates['versions']
@@ -384,17 +557,70 @@ class VersionPredicate(object):
             for version in versions.split(','):
                 if version.strip() == '':
                     continue
-                self.predicates.append(_split_predicate(version))
+                parsed.append(_split_predicate(version))
+    return name, tuple(parsed), _compile_predicates(parsed)
+
+
+class VersionPredicate(object):
+    """Defines a predicate: ProjectName (>ver1,ver2, ..)
+
+    Predicate strings are parsed once: the results are cached and shared by
+    all the instances created from the same string.  The predicates are
+    exposed as a tuple of ``(operator, NormalizedVersion)`` pairs; assigning
+    new ones drops the compiled tests.
+    """
+
+    _tests = None  # compiled predicates, see _compile_predicates
+    _version_set = None  # see get_version_set
+
+    def __init__(self, predicate):
+        self._string = predicate
+        try:
+            parsed = _predicates[predicate]
+        except KeyError:
+            parsed = _parse_predicate(predicate)
+            _cache_result(_predicates, predicate, parsed)
+        self.name, self._predicates, self._tests = parsed
+
+    def _get_predicates(self):
+        return self._predicates
+
+    def _set_predicates(self, predicates):
+        self._predicates = tuple(predicates)
+        self._tests = None
+        self._version_set = None
+
+    predicates = property(_get_predicates, _set_predicates)
 
     def match(self, version):
-        """Check if the provided version matches the predicates."""
-        if isinstance(version, basestring):
-            version = NormalizedVersion(version)
-        for operator, predicate in self.predicates:
-            if not self._operators[operator](version, predicate):
+        """Check if the provided version matches the predicates.
+
+        *version* can be a version string or a :class:`NormalizedVersion`.
+        """
+        if isinstance(version, NormalizedVersion):
+            key, string = version.sort_key, version._string
+        else:
+            key, string = _get_parse_result(_prototype, version, True)[2:]
+        tests = self._tests
+        if tests is None:
+            tests = self._tests = _compile_predicates(self.predicates)
+        for test, other_key, other_string in tests:
+            if not test(key, string, other_key, other_string):
                 return False
         return True
 
+    def get_version_set(self):
+        """Return the :class:`VersionSet` of the versions matching the
+        predicates."""
+        version_set = self._version_set
+        if version_set is None:
+            version_set = VersionSet()
+            for operator, version in self.predicates:
+                version_set = version_set.intersection(
+                    _operator_set(operator, version))
+            self._version_set = version_set
+        return version_set
+
     def __repr__(self):
         return self._string
 
@@ -417,6 +643,197 @@ class _Version(VersionPredicate):
         self.predicates = _split_predicate(match.groups()[0])
 
 
+# Versions are sets of sort keys: the keys of the versions whose string
+# starts with the string of another one (the "==" operator) are found with
+# this many digits at most in their numbers.
+_MAX_DIGITS = 18
+
+
+def _after(key):
+    """Return the smallest bound greater than the sort *key* of a version.
+
+    No sort key is the beginning of another one (they all contain the same
+    number of -1 terminators), so the keys greater than *key* are greater
+    than *key* followed by anything."""
+    return key + (0,)
+
+
+def _prefix_intervals(version):
+    """Return the intervals of the sort keys of the versions whose string
+    starts with the string of *version*."""
+    main, prerel, postdev = version.parts
+    key = version.sort_key
+    if len(postdev) > 1 and postdev[-1] == _FINAL_MARKER[0]:
+        # the string of post-releases ends with the final marker, so
+        # nothing else starts with it
+        return [(key, _after(key))]
+
+    # the sort keys of the versions that continue *version* (1.0.1, 1.0a1
+    # and 1.0.post1 for 1.0) start with its sort key up to its last number
+    if len(postdev) > 1:
+        end = len(key) - 1
+    elif prerel != _FINAL_MARKER:
+        end = len(main) + 1 + len(prerel)
+    else:
+        end = len(main)
+    prefix = key[:end]
+    if not prefix:
+        return [((), None)]
+    base, last = prefix[:-1], prefix[-1]
+    intervals = [(prefix, base + (last + 1,))]
+    if last:
+        # the versions whose last number starts with the same digits: 1.10
+        # to 1.19, 1.100 to 1.199, etc. for 1.1
+        for digits in range(1, _MAX_DIGITS):
+            scale = 10 ** digits
+            intervals.append((base + (last * scale,),
+                              base + ((last + 1) * scale,)))
+    return intervals
+
+
+def _operator_set(operator, version):
+    """Return the :class:`VersionSet` matching *operator* applied to the
+    NormalizedVersion *version*, see _OPERATORS."""
+    key = version.sort_key
+    if operator == '<':
+        return VersionSet([((), key)])
+    elif operator == '>':
+        return VersionSet([(_after(key), None)])
+    prefix = VersionSet(_prefix_intervals(version))
+    if operator == '<=':
+        return prefix.union(VersionSet([((), key)]))
+    elif operator == '>=':
+        return prefix.union(VersionSet([(_after(key), None)]))
+    elif operator == '!=':
+        return prefix.complement()
+    return prefix
+
+
+def _merge_intervals(intervals):
+    """Sort *intervals*, drop the empty ones and merge the overlapping
+    ones."""
+    merged = []
+    for low, high in sorted(intervals):
+        if high is not None and low >= high:
+            continue
+        if merged:
+            last_low, last_high = merged[-1]
+            if last_high is None:
+                break
+            if low <= last_high:
+                if high is None or high > last_high:
+                    merged[-1] = (last_low, high)
+                continue
+        merged.append((low, high))
+    return merged
+
+
+class VersionSet(object):
+    """A set of versions, such as the versions matching a predicate.
+
+    The set is stored as a sorted list of ``(low, high)`` intervals of sort
+    keys (see :func:`get_sort_key`): the keys of the versions in an interval
+    are greater than or equal to *low* and less than *high*; ``()`` is the
+    lowest bound and None the highest one.  The default set contains all
+    the versions.
+
+    Intervals are only made of sort keys, so a set can contain no version
+    while not being empty, e.g. the versions between 1.0.dev1 and
+    1.0.dev2: :meth:`is_empty` is only true when no version can match.
+    """
+
+    def __init__(self, intervals=None):
+        if intervals is None:
+            intervals = [((), None)]
+        self.intervals = _merge_intervals(intervals)
+        self._lows = [low for low, high in self.intervals]
+
+    @classmethod
+    def from_predicate(cls, predicate):
+        """Return the set of the versions matching *predicate*, a string
+        or a :class:`VersionPredicate`."""
+        return get_version_predicate(predicate).get_version_set()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.intervals)
+
+    def __eq__(self, other):
+        if not isinstance(other, VersionSet):
+            return NotImplemented
+        return self.intervals == other.intervals
+
+    def __ne__(self, other):
+        if not isinstance(other, VersionSet):
+            return NotImplemented
+        return self.intervals != other.intervals
+
+    def __contains__(self, version):
+        key = get_sort_key(version)
+        index = bisect_right(self._lows, key) - 1
+        if index < 0:
+            return False
+        low, high = self.intervals[index]
+        return high is None or key < high
+
+    def is_empty(self):
+        """Return True if no version is in the set."""
+        return not self.intervals
+
+    def union(self, other):
+        """Return the set of the versions in either set."""
+        return VersionSet(self.intervals + other.intervals)
+
+    def intersection(self, other):
+        """Return the set of the versions in both sets."""
+        intervals = []
+        first, second = self.intervals, other.intervals
+        i = j = 0
+        while i < len(first) and j < len(second):
+            low = max(first[i][0], second[j][0])
+            high, other_high = first[i][1], second[j][1]
+            if high is None or (other_high is not None and
+                                other_high < high):
+                high = other_high
+                j += 1
+            else:
+                i += 1
+            intervals.append((low, high))
+        return VersionSet(intervals)
+
+    def complement(self):
+        """Return the set of the versions not in this set."""
+        intervals = []
+        low = ()
+        for start, end in self.intervals:
+            intervals.append((low, start))
+            low = end
+            if end is None:
+                break
+        else:
+            intervals.append((low, None))
+        return VersionSet(intervals)
+
+    def filter(self, versions, keys=None):
+        """Return the versions of the sorted list *versions* that are in
+        the set, in the same order.
+
+        *keys* can be the sort keys of *versions*, as returned by
+        :func:`get_sort_keys`: the versions are then found by bisection,
+        without looking at the other ones.
+        """
+        if keys is None:
+            keys = get_sort_keys(versions)
+        found = []
+        for low, high in self.intervals:
+            start = bisect_left(keys, low)
+            if high is None:
+                end = len(keys)
+            else:
+                end = bisect_left(keys, high, start)
+            found.extend(versions[start:end])
+        return found
+
+
 def is_valid_predicate(predicate):
     try:
         VersionPredicate(predicate)
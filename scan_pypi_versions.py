@@ -17,7 +17,7 @@ try:
 except ImportError:
    import pickle
 
-from distutils2.version import suggest_normalized_version
+from distutils2.version import suggest_normalized_versions
 from distutils2.tests import unittest, run_unittest
 
 def test_pypi():
@@ -82,8 +82,7 @@ def test_pypi():
     suggs = []
     no_suggs = []
 
-    for ver in versions:
-        sugg = suggest_normalized_version(ver)
+    for ver, sugg in zip(versions, suggest_normalized_versions(versions)):
         if sugg == ver:
             matches += 1
         elif sugg == None: